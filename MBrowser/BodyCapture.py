@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import base64
+import fnmatch
+import hashlib
+import logging
+import os
+import re
+
+from MBrowser import EventLoop
+from MBrowser.Const import *
+
+__all__ = ['BodyCapture', 'BodyCapturePolicy']
+
+
+class BodyCapturePolicy(object):
+    """
+    Which response bodies a HAR recording fetches and how
+
+    a body is fetched when its mime type matches mimeTypes and not excludeMimeTypes, its url matches urlPatterns and
+    not excludeUrlPatterns, and its size is not above maxSize
+    """
+
+    def __init__(self, mimeTypes: list = None, excludeMimeTypes: list = ('video/*', 'audio/*'),
+                 maxSize: int = 2 ** 21, urlPatterns: list = None, excludeUrlPatterns: list = None,
+                 concurrency: int = 4, batchSize: int = 8, backlog: int = 512, storeDir: str = None):
+        """
+        :param mimeTypes: list of mime type globs to fetch, default None for all
+        :param excludeMimeTypes: list of mime type globs never fetched, default video and audio
+        :param maxSize: max body size in bytes, default 2MB, None for no limit
+        :param urlPatterns: list of url regex to fetch, default None for all
+        :param excludeUrlPatterns: list of url regex never fetched
+        :param concurrency: number of fetch workers
+        :param batchSize: max Network.getResponseBody commands a worker pipelines at once
+        :param backlog: max bodies waiting to be fetched, bodies over it are skipped
+        :param storeDir: write bodies to this directory (content addressed) instead of keeping them in memory
+        """
+        self.maxSize = maxSize
+        self.concurrency = concurrency
+        self.batchSize = batchSize
+        self.backlog = backlog
+        self.storeDir = storeDir
+        self._mimeTypes = self._compileGlobs(mimeTypes)
+        self._excludeMimeTypes = self._compileGlobs(excludeMimeTypes)
+        self._urlPatterns = re.compile('|'.join('(?:{})'.format(p) for p in urlPatterns)) if urlPatterns else None
+        self._excludeUrlPatterns = re.compile(
+            '|'.join('(?:{})'.format(p) for p in excludeUrlPatterns)) if excludeUrlPatterns else None
+
+    def _compileGlobs(self, globs):
+        if not globs:
+            return None
+        return re.compile('|'.join(fnmatch.translate(glob.lower()) for glob in globs))
+
+    def allows(self, url: str, mimeType: str, size: int) -> bool:
+        mimeType = (mimeType or '').lower()
+        if self.maxSize != None and size and size > self.maxSize:
+            return False
+        if self._mimeTypes and not self._mimeTypes.match(mimeType):
+            return False
+        if self._excludeMimeTypes and self._excludeMimeTypes.match(mimeType):
+            return False
+        if self._urlPatterns and not self._urlPatterns.search(url):
+            return False
+        if self._excludeUrlPatterns and self._excludeUrlPatterns.search(url):
+            return False
+        return True
+
+
+class BodyCapture(object):
+    """
+    Fetch response bodies with a bounded number of workers and a bounded backlog, so body capture never blocks the
+    event handling of the page and never holds more than backlog pending requests
+    """
+
+    def __init__(self, client, onBody, policy: BodyCapturePolicy = None):
+        """
+        :param client: Session
+        :param onBody: function(requestId, body, base64Encoded, bodyFile), body is None when stored to bodyFile,
+                       called with ('', None, None) for skipped and failed bodies
+        :param policy: BodyCapturePolicy, default BodyCapturePolicy()
+        """
+        self._client = client
+        self._onBody = onBody
+        self._policy = policy or BodyCapturePolicy()
+        self._log = logging.getLogger('BodyCapture.BodyCapture')
+        self._queue = asyncio.Queue(self._policy.backlog)
+        self._workers = []
+        self.fetched = 0
+        self.skipped = 0
+        self.dropped = 0
+        if self._policy.storeDir:
+            os.makedirs(self._policy.storeDir, exist_ok=True)
+
+    def start(self) -> None:
+        if not self._workers:
+            self._workers = [EventLoop.create_task(self._work()) for _ in range(self._policy.concurrency)]
+
+    def stop(self) -> None:
+        for worker in self._workers:
+            worker.cancel()
+        self._workers = []
+
+    def submit(self, requestId: str, url: str, mimeType: str, size: int) -> None:
+        """
+        Queue the body of a finished request, onBody is called once it is fetched or skipped
+        """
+        if not self._policy.allows(url, mimeType, size):
+            self.skipped += 1
+            self._onBody(requestId, '', None, None)
+            return
+        try:
+            self._queue.put_nowait(requestId)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            self._log.warning('body backlog full, skip body of {}'.format(url))
+            self._onBody(requestId, '', None, None)
+
+    async def join(self) -> None:
+        """
+        Wait until every queued body is handled
+        """
+        await self._queue.join()
+
+    def stats(self) -> dict:
+        return dict(fetched=self.fetched, skipped=self.skipped, dropped=self.dropped, backlog=self._queue.qsize())
+
+    async def _work(self):
+        while True:
+            requestIds = [await self._queue.get()]
+            while len(requestIds) < self._policy.batchSize and not self._queue.empty():
+                requestIds.append(self._queue.get_nowait())
+            try:
+                results = await self._client.sendMany(
+                    [('Network.getResponseBody', dict(requestId=requestId)) for requestId in requestIds])
+                for requestId, result in zip(requestIds, results):
+                    await self._handle(requestId, result)
+            except Exception as e:
+                self._log.exception(e)
+            finally:
+                for _ in requestIds:
+                    self._queue.task_done()
+
+    async def _handle(self, requestId, result):
+        if not isinstance(result, dict) or not result.get(RESULT):
+            self._log.error('Error: get body of {} failed: {}'.format(requestId, result))
+            self._onBody(requestId, '', None, None)
+            return
+        self.fetched += 1
+        body = result.get(RESULT).get('body') or ''
+        base64Encoded = result.get(RESULT).get('base64Encoded')
+        if not self._policy.storeDir:
+            self._onBody(requestId, body, base64Encoded, None)
+            return
+        try:
+            # decoding, hashing and writing a large body would stall the loop, they run in a thread
+            bodyFile = await EventLoop.loop.run_in_executor(None, self._store, body, base64Encoded)
+        except OSError as e:
+            self._log.error('Error: store body of {} failed: {}'.format(requestId, e))
+            self._onBody(requestId, '', None, None)
+            return
+        self._onBody(requestId, None, None, bodyFile)
+
+    def _store(self, body: str, base64Encoded: bool) -> str:
+        """
+        :return: path of the file holding body, named by its sha1 so a body shared by many requests is written once
+        """
+        data = base64.b64decode(body) if base64Encoded else body.encode('utf-8')
+        bodyFile = os.path.join(self._policy.storeDir, hashlib.sha1(data).hexdigest())
+        if not os.path.exists(bodyFile):
+            with open(bodyFile, 'wb') as fileHandler:
+                fileHandler.write(data)
+        return bodyFile
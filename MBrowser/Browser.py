@@ -1,34 +1,182 @@
 # -*- coding: utf-8 -*-
 
+import asyncio
 import logging
 
 from MBrowser.Connections import Connection
 from MBrowser.Const import *
+from MBrowser.PagePool import PagePool
 from MBrowser.Pages import Page
 
-__all__ = ['Browser']
+__all__ = ['Browser', 'BrowserContext']
 
 
 class Browser(object):
-    def __init__(self, browserWSEndpoint: str = ''):
+    def __init__(self, browserWSEndpoint: str = '', maxQueue: int = DISPATCH_QUEUE_SIZE,
+                 overflow: str = OVERFLOW_COALESCE):
+        """
+        :param maxQueue: events queued per page at most before the overflow policy applies, see Session
+        :param overflow: OVERFLOW_COALESCE, OVERFLOW_DROP_OLDEST or OVERFLOW_DROP_NEWEST
+        """
         self._log = logging.getLogger('Browser.Browser')
         self._ws_url = browserWSEndpoint
         self._isconnected = False
         self._connection = None
         self._pages = []
+        self._contexts = {}
+        self._maxQueue = maxQueue
+        self._overflow = overflow
 
     async def connect(self) -> Connection:
         if not self._isconnected:
-            self._connection = await Connection.create(self._ws_url)
+            self._connection = await Connection.create(self._ws_url, self._maxQueue, self._overflow)
             self._isconnected = True
             return self._connection
 
-    async def createPage(self) -> Page:
+    @property
+    def connection(self) -> Connection:
+        return self._connection
+
+    @property
+    def endpoint(self) -> str:
+        return self._ws_url
+
+    @property
+    def pageCount(self) -> int:
+        return len(self._pages)
+
+    def disconnect(self) -> None:
+        """
+        Close the connection, the browser process keeps running
+        """
+        if self._isconnected:
+            self._connection.close()
+            self._isconnected = False
+        self._pages = []
+        self._contexts = {}
+
+    async def createPage(self, browserContextId: str = None) -> Page:
+        """
+        :param browserContextId: create the page in this browser context, default None for the default context,
+                                 see createContext
+        """
         if self._isconnected:
-            result = await self._connection.send("Target.createTarget", dict(url='about:blank'))
+            params = dict(url='about:blank')
+            if browserContextId:
+                params['browserContextId'] = browserContextId
+            result = await self._connection.send("Target.createTarget", params)
             session = await self._connection.createSession(result.get(TID))
-            page = Page(session)
+            page = await Page.create(session)
             self._log.info('Page created for session {}'.format(session))
             self._pages.append(page)
 
             return page
+
+    async def createContext(self, proxyServer: str = None, proxyBypassList: str = None):
+        """
+        Create an isolated browser context, like an incognito profile: its pages share cookies, storage and cache
+        with each other but not with the other contexts, many identities can run in one browser process this way
+        :param proxyServer: proxy of this context only, e.g. 'http://127.0.0.1:8080'
+        :param proxyBypassList: hosts not going through proxyServer, e.g. 'localhost;*.local'
+        :return: BrowserContext
+        """
+        if not self._isconnected:
+            return None
+        params = {}
+        if proxyServer:
+            params['proxyServer'] = proxyServer
+            if proxyBypassList:
+                params['proxyBypassList'] = proxyBypassList
+        result = await self._connection.send("Target.createBrowserContext", params)
+        if not result or not result.get('browserContextId'):
+            raise RuntimeError('Target.createBrowserContext failed: {}'.format(result))
+        context = BrowserContext(self, result.get('browserContextId'))
+        self._contexts[context.id] = context
+        self._log.info('Browser context {} created'.format(context.id))
+        return context
+
+    @property
+    def contexts(self) -> list:
+        return list(self._contexts.values())
+
+    async def closePage(self, page: Page) -> None:
+        """
+        Close the target of page, its session is dropped when the browser reports the detach
+        """
+        if page in self._pages:
+            self._pages.remove(page)
+        if self._isconnected:
+            result = await self._connection.send("Target.closeTarget", dict(targetId=page.targetId))
+            if not result or not result.get('success'):
+                self._log.warning('close target {} failed: {}'.format(page.targetId, result))
+
+    async def createPagePool(self, size: int = 2, maxSize: int = 8, idleTimeout: float = 60, maxUses: int = 50,
+                             clearCookies: bool = False, clearStorage: bool = False,
+                             clearCache: bool = False) -> PagePool:
+        """
+        Pages created ahead and reused across jobs, see PagePool
+        :return: started PagePool
+        """
+        return await PagePool(self, size, maxSize, idleTimeout, maxUses, clearCookies, clearStorage=clearStorage,
+                              clearCache=clearCache).start()
+
+
+class BrowserContext(object):
+    """
+    Isolated browser context created by Browser.createContext, pages created here share their cookies only with each
+    other, close() closes the pages and disposes the context together
+    """
+
+    def __init__(self, browser: Browser, browserContextId: str):
+        self._log = logging.getLogger('Browser.BrowserContext')
+        self._browser = browser
+        self._id = browserContextId
+        self._pages = []
+        self._closed = False
+
+    @property
+    def id(self) -> str:
+        return self._id
+
+    @property
+    def pages(self) -> list:
+        return list(self._pages)
+
+    async def createPage(self) -> Page:
+        if self._closed:
+            raise RuntimeError('browser context {} is closed'.format(self._id))
+        page = await self._browser.createPage(self._id)
+        if page != None:
+            self._pages.append(page)
+        return page
+
+    async def closePage(self, page: Page) -> None:
+        if page in self._pages:
+            self._pages.remove(page)
+        await self._browser.closePage(page)
+
+    async def createPagePool(self, size: int = 2, maxSize: int = 8, idleTimeout: float = 60, maxUses: int = 50,
+                             clearCookies: bool = False, clearStorage: bool = False,
+                             clearCache: bool = False) -> PagePool:
+        """
+        PagePool of pages in this context, close the pool before the context
+        """
+        return await PagePool(self, size, maxSize, idleTimeout, maxUses, clearCookies, clearStorage=clearStorage,
+                              clearCache=clearCache).start()
+
+    async def close(self) -> None:
+        """
+        Close every page of the context and dispose it, its cookies and storage are gone
+        """
+        if self._closed:
+            return
+        self._closed = True
+        await asyncio.gather(*[self._browser.closePage(page) for page in self._pages], return_exceptions=True)
+        self._pages = []
+        self._browser._contexts.pop(self._id, None)
+        if self._browser._isconnected:
+            result = await self._browser._connection.send("Target.disposeBrowserContext",
+                                                          dict(browserContextId=self._id))
+            if result == None:
+                self._log.warning('dispose browser context {} failed'.format(self._id))
+        self._log.info('Browser context {} closed'.format(self._id))
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+import json
+import logging
+
+__all__ = ['Codec', 'loads', 'dumps', 'getCodec', 'setCodec', 'availableCodecs']
+
+log = logging.getLogger('Codec.Codec')
+
+
+class Codec(object):
+    """
+    JSON encoder/decoder pair used by the CDP transport
+
+    loads accepts str or bytes, dumps always returns str since the devtools socket only takes text frames
+    """
+
+    def __init__(self, name: str, loads, dumps):
+        self.name = name
+        self.loads = loads
+        self.dumps = dumps
+
+    def __repr__(self):
+        return 'Codec({})'.format(self.name)
+
+
+def _stdlibCodec():
+    return Codec('json', json.loads, lambda obj: json.dumps(obj, ensure_ascii=False))
+
+
+def _orjsonCodec():
+    import orjson
+    return Codec('orjson', orjson.loads, lambda obj: orjson.dumps(obj).decode('utf-8'))
+
+
+def _ujsonCodec():
+    import ujson
+    return Codec('ujson', ujson.loads, lambda obj: ujson.dumps(obj, ensure_ascii=False))
+
+
+# fastest first
+_factories = [('orjson', _orjsonCodec), ('ujson', _ujsonCodec), ('json', _stdlibCodec)]
+
+
+def availableCodecs() -> dict:
+    """
+    Get all codecs which can be used in this environment
+    :return: dict, {name: Codec}, fastest first
+    """
+    codecs = {}
+    for name, factory in _factories:
+        try:
+            codecs[name] = factory()
+        except ImportError:
+            continue
+    return codecs
+
+
+def _bestCodec() -> Codec:
+    for name, factory in _factories:
+        try:
+            return factory()
+        except ImportError:
+            continue
+
+
+_codec = _bestCodec()
+log.debug('use {} for CDP messages'.format(_codec))
+
+
+def getCodec() -> Codec:
+    return _codec
+
+
+def setCodec(name: str) -> Codec:
+    """
+    Select the JSON codec used by Connection and Session
+    :param name: one of 'orjson', 'ujson', 'json'
+    :return: Codec
+    """
+    global _codec
+    codecs = availableCodecs()
+    if name not in codecs:
+        raise ValueError('codec {} is not available, installed: {}'.format(name, list(codecs.keys())))
+    _codec = codecs[name]
+    return _codec
+
+
+def loads(msg):
+    return _codec.loads(msg)
+
+
+def dumps(obj) -> str:
+    return _codec.dumps(obj)
@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import logging
+
+from MBrowser import EventLoop
+from MBrowser.Browser import Browser
+from MBrowser.Const import *
+from MBrowser.Launcher import Launcher
+
+__all__ = ['ConnectionPool']
+
+
+class _Member(object):
+    __slots__ = ('browser', 'healthy', 'failures', 'placed')
+
+    def __init__(self, browser: Browser):
+        self.browser = browser
+        self.healthy = True
+        # health checks failed in a row
+        self.failures = 0
+        # pages placed on the browser so far
+        self.placed = 0
+
+
+class ConnectionPool(object):
+    """
+    Browsers of several endpoints driven from one process, each over its own Connection, eg:
+
+            pool = ConnectionPool(healthInterval=15)
+            await pool.launch(4, {BROWSEPATH: BROWSER, HEADLESS: True})
+            await pool.add('ws://10.0.0.2:9222/devtools/browser/...')
+            page = await pool.createPage()
+
+    a new page goes to the healthy browser with the fewest pages, a browser which does not answer maxFailures health
+    checks in a row gets no new page until it answers again; a browser whose Connection is lost is reconnected by the
+    health check, its pages are gone with the Connection, and it is removed from the pool after maxFailures failed
+    reconnects in a row; the pool has createPage and closePage like Browser, so PagePool and CrawlScheduler can
+    spread their pages over all the browsers
+    """
+
+    def __init__(self, endpoints: list = None, healthInterval: float = 30, healthTimeout: float = 5,
+                 maxFailures: int = 2, maxPagesPerBrowser: int = None):
+        """
+        :param endpoints: browserWSEndpoint of browsers already running, connected by start
+        :param healthInterval: seconds between two health checks of every browser, None for no check
+        :param healthTimeout: seconds a browser has to answer a health check
+        :param maxFailures: health checks failed in a row before a browser is taken out of placement, reconnects
+                            failed in a row before a browser with a lost Connection is removed
+        :param maxPagesPerBrowser: pages per browser at most, None for no limit
+        """
+        self._endpoints = list(endpoints or [])
+        self._healthInterval = healthInterval
+        self._healthTimeout = healthTimeout
+        self._maxFailures = maxFailures
+        self._maxPagesPerBrowser = maxPagesPerBrowser
+        self._log = logging.getLogger('ConnectionPool.ConnectionPool')
+        self._members = []
+        # id(page) -> (_Member, Page)
+        self._owners = {}
+        self._checker = None
+        # (process, userDataDir) of each browser started by launch
+        self._processes = []
+
+    ################################# members ###################################
+    async def start(self):
+        """
+        Connect the endpoints given to the constructor and start the health checks
+        :return: self
+        """
+        endpoints = self._endpoints
+        self._endpoints = []
+        await asyncio.gather(*[self.add(endpoint) for endpoint in endpoints])
+        if self._checker == None and self._healthInterval:
+            self._checker = EventLoop.create_task(self._checkLoop())
+        return self
+
+    async def add(self, endpoint: str) -> Browser:
+        """
+        Connect one more browser
+        :param endpoint: browserWSEndpoint
+        :return: Browser, None when the connection failed
+        """
+        browser = Browser(endpoint)
+        try:
+            await browser.connect()
+        except Exception as e:
+            self._log.error('connect {} failed: {}'.format(endpoint, e))
+            return None
+        self._members.append(_Member(browser))
+        self._log.info('browser {} added, {} in the pool'.format(endpoint, len(self._members)))
+        return browser
+
+    async def launch(self, count: int, options: dict = None) -> list:
+        """
+        Start count browser processes with Launcher and add them, browsers already running are kept, each one runs
+        on a temporary profile of its own unless options give a --user-data-dir
+        :param options: Launcher.startBrowser options
+        :return: list of Browser added
+        """
+        options = dict(options or {})
+        options[KILLEXISTING] = False
+        browsers = []
+        for _ in range(count):
+            # startBrowser blocks until the browser prints its endpoint
+            launched = await EventLoop.loop.run_in_executor(None, Launcher.startBrowser, options)
+            if launched == None:
+                self._log.error('launch browser failed')
+                continue
+            launch = (Launcher.browserPid, Launcher.userDataDir)
+            browser = await self.add(launched.endpoint)
+            if browser == None:
+                await EventLoop.loop.run_in_executor(None, Launcher.closeBrowser, *launch)
+                continue
+            self._processes.append(launch)
+            browsers.append(browser)
+        return browsers
+
+    def remove(self, browser: Browser) -> None:
+        """
+        Disconnect browser and forget its pages
+        """
+        for member in list(self._members):
+            if member.browser is browser:
+                self._members.remove(member)
+                self._forgetPages(member)
+                browser.disconnect()
+
+    async def close(self) -> None:
+        """
+        Stop the health checks, close the pages created by the pool, disconnect every browser and stop the
+        processes started by launch
+        """
+        if self._checker != None:
+            self._checker.cancel()
+            self._checker = None
+        pages = [(member, page) for (member, page) in self._owners.values() if member.browser.connection.alive]
+        results = await asyncio.gather(*[member.browser.closePage(page) for (member, page) in pages],
+                                       return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                self._log.warning('close page failed: {}'.format(result))
+        for member in self._members:
+            member.browser.disconnect()
+        self._members = []
+        self._owners = {}
+        # closeBrowser waits for each process to exit before removing its profile
+        await asyncio.gather(*[EventLoop.loop.run_in_executor(None, Launcher.closeBrowser, process, userDataDir)
+                               for (process, userDataDir) in self._processes])
+        self._processes = []
+
+    @property
+    def browsers(self) -> list:
+        return [member.browser for member in self._members]
+
+    ################################# members ###################################
+
+    ################################# placement #################################
+    def pick(self) -> Browser:
+        """
+        :return: the healthy Browser with the fewest pages, None when no browser can take a page
+        """
+        candidates = [member for member in self._members if member.healthy and member.browser.connection.alive
+                      and (self._maxPagesPerBrowser == None or member.browser.pageCount < self._maxPagesPerBrowser)]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda member: (member.browser.pageCount, member.placed)).browser
+
+    async def createPage(self):
+        """
+        Create a page on the least loaded healthy browser
+        :return: Page
+        """
+        browser = self.pick()
+        if browser == None:
+            raise RuntimeError('no healthy browser with room for a page in the pool')
+        member = self._member(browser)
+        member.placed += 1
+        page = await browser.createPage()
+        if page == None:
+            raise RuntimeError('create page on {} failed'.format(browser.endpoint))
+        self._owners[id(page)] = (member, page)
+        return page
+
+    async def closePage(self, page) -> None:
+        (member, _) = self._owners.pop(id(page), (None, None))
+        if member == None:
+            # also a page lost with the Connection of its browser
+            self._log.warning('close a page which is not created by the pool or already gone')
+            return
+        await member.browser.closePage(page)
+
+    def browserOf(self, page) -> Browser:
+        (member, _) = self._owners.get(id(page), (None, None))
+        return member.browser if member != None else None
+
+    def _forgetPages(self, member: _Member) -> int:
+        """
+        :return: count of pages of member dropped
+        """
+        owners = {key: owned for (key, owned) in self._owners.items() if owned[0] is not member}
+        dropped = len(self._owners) - len(owners)
+        self._owners = owners
+        return dropped
+
+    def _member(self, browser: Browser) -> _Member:
+        for member in self._members:
+            if member.browser is browser:
+                return member
+        return None
+
+    ################################# placement #################################
+
+    ################################# health ####################################
+    async def checkHealth(self) -> dict:
+        """
+        Ping every browser once, reconnect the browsers whose Connection is lost
+        :return: dict endpoint -> healthy
+        """
+        lost = [member for member in self._members if not member.browser.connection.alive]
+        await asyncio.gather(*[self._reconnect(member) for member in lost])
+        members = [member for member in self._members if member not in lost]
+        results = await asyncio.gather(*[member.browser.connection.ping(self._healthTimeout)
+                                         for member in members], return_exceptions=True)
+        for member, result in zip(members, results):
+            if result is True:
+                if not member.healthy:
+                    self._log.info('browser {} is healthy again'.format(member.browser.endpoint))
+                member.healthy = True
+                member.failures = 0
+                continue
+            member.failures += 1
+            if member.healthy and (member.failures >= self._maxFailures or not member.browser.connection.alive):
+                member.healthy = False
+                self._log.error('browser {} is unhealthy, {} pages on it'.format(member.browser.endpoint,
+                                                                                member.browser.pageCount))
+        return {member.browser.endpoint: member.healthy for member in self._members}
+
+    async def _reconnect(self, member: _Member) -> None:
+        browser = member.browser
+        # the pages and sessions of the lost Connection are gone
+        dropped = self._forgetPages(member)
+        browser.disconnect()
+        member.healthy = False
+        try:
+            await browser.connect()
+        except Exception as e:
+            member.failures += 1
+            self._log.error('reconnect {} failed {} times in a row: {}'.format(browser.endpoint, member.failures, e))
+            if member.failures >= self._maxFailures:
+                self._log.error('browser {} removed from the pool'.format(browser.endpoint))
+                self.remove(browser)
+            return
+        member.healthy = True
+        member.failures = 0
+        self._log.info('browser {} reconnected, {} pages lost'.format(browser.endpoint, dropped))
+
+    async def _checkLoop(self):
+        while True:
+            await asyncio.sleep(self._healthInterval)
+            try:
+                await self.checkHealth()
+            except Exception as e:
+                self._log.exception(e)
+
+    def stats(self) -> dict:
+        return {member.browser.endpoint: dict(pages=member.browser.pageCount, placed=member.placed,
+                                              healthy=member.healthy, failures=member.failures)
+                for member in self._members}
+
+    ################################# health ####################################
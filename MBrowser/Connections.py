@@ -2,33 +2,37 @@
 
 
 import asyncio
-import json
 import logging
 
-import websockets
-import websockets.protocol
+# websockets is only needed to talk to a browser, tools like HarBatch import the package without it
+try:
+    import websockets
+    import websockets.protocol
+except ImportError:
+    websockets = None
 
-from MBrowser import EventLoop
+from MBrowser import Codec, EventLoop
 from MBrowser.Const import *
 from MBrowser.Session import Session
 
 __all__ = ['Connection']
 
 
-class Singleton(type):
-    _instances = {}
-
-    def __call__(cls, *args, **kwargs):
-        if cls not in cls._instances:
-            cls._instances[cls] = super(Singleton, cls).__call__(*args, **kwargs)
-        return cls._instances[cls]
-
-
-class Connection(metaclass=Singleton):
+class Connection(object):
+    """
+    Websocket connection to one browser, every Connection.create opens its own socket, so one process can drive
+    several browsers, see ConnectionPool
+    """
     mid = 0
 
-    def __init__(self, ws: str):
+    def __init__(self, ws: str, maxQueue: int = DISPATCH_QUEUE_SIZE, overflow: str = OVERFLOW_COALESCE):
+        """
+        :param maxQueue: events queued per Session at most, see Session
+        :param overflow: what happens to an event of a Session whose queue is full, see Session
+        """
         self._ws = ws
+        self._maxQueue = maxQueue
+        self._overflow = overflow
         self._sessions = {}
         self._connected = False
         self._msgQ = {}
@@ -38,21 +42,47 @@ class Connection(metaclass=Singleton):
         self._recv_task = None
         self._createReceiveTask()
         self._stopping = False
+        self._frameRecorder = None
         self._log.info('Connection init done')
 
     @staticmethod
-    async def create(ws_url: str):
+    async def create(ws_url: str, maxQueue: int = DISPATCH_QUEUE_SIZE, overflow: str = OVERFLOW_COALESCE):
         """
         Create a websocket connection to Browser
         :param ws_url: String
+        :param maxQueue: events queued per Session at most, see Session
+        :param overflow: OVERFLOW_COALESCE, OVERFLOW_DROP_OLDEST or OVERFLOW_DROP_NEWEST
         :return: Connection
         """
+        if websockets == None:
+            raise ImportError('Connection needs websockets, install it by pip install websockets')
         ws = await websockets.connect(ws_url, max_size=MAX_PAYLOAD_SIZE_BYTES)
         logging.getLogger('Connections.Connection').info('WS connected: {}'.format(ws_url))
-        connection = Connection(ws)
+        connection = Connection(ws, maxQueue, overflow)
         connection._connected = True
         return connection
 
+    @property
+    def alive(self) -> bool:
+        """
+        False once closed or once the receive loop ended, e.g. the browser is gone
+        """
+        return not self._stopping and self._recv_task != None and not self._recv_task.done()
+
+    @property
+    def sessionCount(self) -> int:
+        return len(self._sessions)
+
+    async def ping(self, timeout: float = TIMEOUT_S) -> bool:
+        """
+        Health check, a cheap browser command answered in time
+        :return: True when the browser answered within timeout
+        """
+        if not self.alive:
+            return False
+        result = await self.send('Browser.getVersion', {}, timeout)
+        return result != None
+
     def _createReceiveTask(self):
         self._recv_task = EventLoop.create_task(self.receive())
         return self._recv_task
@@ -63,27 +93,61 @@ class Connection(metaclass=Singleton):
 
     def close(self):
         self._stopping = True
+        for session in self._sessions.values():
+            session._onClosed()
         self._sessions.clear()
         self._ws.close()
         self._connected = False
         if self._recv_task != None:
             self._recv_task.cancel()
 
+    def queueStats(self) -> dict:
+        """
+        :return: dict sessionId -> Session.queueStats, to find the tabs falling behind
+        """
+        return {sessionId: session.queueStats() for (sessionId, session) in self._sessions.items()}
+
+    def recordFrames(self, filehandler) -> None:
+        """
+        Write every raw frame received to filehandler, one frame per line, the file can be replayed by
+        Test/benchCodec.py
+        :param filehandler: text file object, None to stop recording
+        :return: None
+        """
+        self._frameRecorder = filehandler
+
     async def receive(self):
+        received = 0
         try:
             while True:
                 if self._stopping:
                     break
+                received += 1
+                if received % DISPATCH_BATCH == 0:
+                    # recv does not suspend while frames are buffered, let the session dispatchers drain
+                    await asyncio.sleep(0)
                 result = await self._ws.recv()
                 self._recv_log.debug('◀ RECV {}'.format(result))
                 if not result:
                     self._recv_log.error('Missing message, may have been a connection timeout...')
                     continue
-                result = json.loads(result)
+                if self._frameRecorder:
+                    self._frameRecorder.write(result if isinstance(result, str) else result.decode('utf-8'))
+                    self._frameRecorder.write('\n')
+                result = Codec.loads(result)
                 if not isinstance(result, dict):
                     self._recv_log.error('decoded messages is of type "%s" and = "%s"' % (type(result), result))
                     continue
-                if ID in result:
+                if SID in result:
+                    #### flattened session msg, route it to the session directly
+                    session = self._sessions.get(result.get(SID))
+                    if session:
+                        # acks are resolved right here, events only queued, the loop never waits for a session
+                        session._onMessage(result)
+                    else:
+                        self._recv_log.warning('get a msg for unknown sid {}'.format(result.get(SID)))
+                    continue
+                elif ID in result:
                     #### ack msg
                     msgid = result[ID]
                     # self._recv_log.info('Received ACK message id = {}!'.format(msgid))
@@ -91,7 +155,8 @@ class Connection(metaclass=Singleton):
                     if result.get(ERROR):
                         self._recv_log.error('get Error Response: {}'.format(result))
                     if future:
-                        future.set_result(result.get(RESULT))
+                        if not future.done():
+                            future.set_result(result.get(RESULT))
                         self._msgQ.pop(msgid)
                     else:
                         self._recv_log.error('Not found valid msg request with id {}'.format(msgid))
@@ -128,28 +193,68 @@ class Connection(metaclass=Singleton):
             if self._ws.state != websockets.protocol.OPEN:
                 raise ConnectionError('Websocket lost with {} code'.format(self._ws.close_code))
 
+    async def sendRaw(self, message: dict) -> None:
+        """
+        Write a prepared message to the websocket as is, the caller takes care of the ack
+        :param message: dict, full protocol message with id, method and params
+        :return: None
+        """
+        msg = Codec.dumps(message)
+        self._send_log.debug('SEND ► msg = {}'.format(msg))
+        await self._ws.send(msg)
+
     async def send(self, method: str, param: dict = None, timeout: int = TIMEOUT_S) -> object:
         messageid = self._msgid()
         try:
-            msg = json.dumps(dict(id=messageid, method=method, params=param))
-            self._send_log.debug('SEND ► message id {} msg = {}'.format(messageid, msg))
-            await self._ws.send(msg)
             future = EventLoop.create_future()
             self._msgQ[messageid] = future
+            msg = Codec.dumps(dict(id=messageid, method=method, params=param))
+            self._send_log.debug('SEND ► message id {} msg = {}'.format(messageid, msg))
+            await self._ws.send(msg)
             return await asyncio.wait_for(future, timeout)
         except Exception as e:
             self._send_log.exception(e)
-            self._msgQ.pop(messageid)
+            self._msgQ.pop(messageid, None)
+
+    async def sendMany(self, commands: list, timeout: int = TIMEOUT_S) -> list:
+        """
+        Pipeline commands: write all of them back to back, then wait for all the acks together
+        :param commands: list of (method, params)
+        :param timeout: timeout for the whole batch
+        :return: list of results in the same order as commands, a failed command gets None or its exception,
+                 it does not affect the others
+        """
+        messageids = []
+        futures = []
+        for method, param in commands:
+            messageid = self._msgid()
+            future = EventLoop.create_future()
+            self._msgQ[messageid] = future
+            messageids.append(messageid)
+            futures.append(future)
+            try:
+                await self.sendRaw(dict(id=messageid, method=method, params=param))
+            except Exception as e:
+                self._send_log.exception(e)
+                future.set_exception(e)
+        results = await asyncio.gather(*[asyncio.wait_for(future, timeout) for future in futures],
+                                       return_exceptions=True)
+        for messageid in messageids:
+            self._msgQ.pop(messageid, None)
+        return results
 
-    async def createSession(self, targetId: int) -> object:
+    async def createSession(self, targetId: int, flatten: bool = True) -> object:
         """
         Create a Session for a page
         :param targetId: String
+        :param flatten: attach in flattened mode, session messages go over the browser socket with a sessionId
+                        instead of being wrapped in Target.sendMessageToTarget, default True
         :return: session
         """
-        sessionId = await self.send("Target.attachToTarget", dict(targetId=targetId))
+        sessionId = await self.send("Target.attachToTarget", dict(targetId=targetId, flatten=flatten))
         sessionId = sessionId[SID]
-        session = Session(self, targetId, sessionId)
+        session = Session(self, targetId, sessionId, flatten=flatten, maxQueue=self._maxQueue,
+                          overflow=self._overflow)
         self._sessions[sessionId] = session
         self._log.info('Session {} created'.format(sessionId))
         return session
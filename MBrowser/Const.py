@@ -2,6 +2,8 @@
 
 BROWSEPATH = 'BROWSEPATH'
 HEADLESS = 'headless'
+ARGS = 'args'
+KILLEXISTING = 'killExisting'
 ACK_EVENT = 'ACK_EVENT'
 ACK = 'ack'
 RESULT = 'result'
@@ -29,6 +31,7 @@ Page_frameAttached = 'Page.frameAttached'
 Page_frameNavigated = 'Page.frameNavigated'
 Page_frameDetached = 'Page.frameDetached'
 Page_domContentEventFired = 'Page.domContentEventFired'
+Page_lifecycleEvent = 'Page.lifecycleEvent'
 Runtime_executionContextCreated = 'Runtime.executionContextCreated'
 Runtime_executionContextDestroyed = 'Runtime.executionContextDestroyed'
 Runtime_executionContextsCleared = 'Runtime.executionContextsCleared'
@@ -40,6 +43,20 @@ Network_responseReceived = 'Network.responseReceived'
 Network_resourceChangedPriority = 'Network.resourceChangedPriority'
 Network_loadingFailed = 'Network.loadingFailed'
 Security_securityStateChanged = 'Security.securityStateChanged'
+Fetch_requestPaused = 'Fetch.requestPaused'
+
+SCRIPT_CACHE_GROUP = 'MBrowser.scriptCache'
+HANDLE_GROUP = 'MBrowser.handles'
+SCRIPT_CACHE_MIN_SIZE = 128
 
 TIMEOUT_S = 10
+# storage Page.reset(clearStorage=True) clears per origin, cookies are cleared by clearCookies
+STORAGE_TYPES = 'local_storage,indexeddb,websql,cache_storage,service_workers,file_systems'
+# events waiting per Session for its dispatcher, and what happens to an event arriving when the queue is full
+DISPATCH_QUEUE_SIZE = 10000
+OVERFLOW_COALESCE = 'coalesce'
+OVERFLOW_DROP_OLDEST = 'dropOldest'
+OVERFLOW_DROP_NEWEST = 'dropNewest'
+# events a Session dispatcher handles before it lets the receive loop and the other sessions run
+DISPATCH_BATCH = 64
 MAX_PAYLOAD_SIZE_BYTES = 2 ** 23
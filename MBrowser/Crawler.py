@@ -0,0 +1,410 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+from urllib.parse import urlsplit
+
+from MBrowser import EventLoop
+
+__all__ = ['CrawlJob', 'CrawlScheduler', 'gotoHandler']
+
+# finished jobs kept for the latency percentiles
+LATENCY_WINDOW = 10000
+# seconds the live throughput is measured over
+RATE_WINDOW = 10.0
+# page creations failed in a row before the scheduler stops
+MAX_PAGE_FAILURES = 3
+# default max jobs running at the same time per host
+HOST_CONCURRENCY = 2
+
+
+async def gotoHandler(page, job):
+    """
+    Default job handler, navigate to job.url and wait for the load
+    :return: url of the page once loaded
+    """
+    await page.goto(job.url, waitFinish=False)
+    await page.waitForPageLoadFinish(job.timeout)
+    return page.url()
+
+
+class CrawlJob(object):
+    """
+    One unit of work of the CrawlScheduler, a url handled on a page by an async function(page, job)
+    """
+    __slots__ = ('url', 'host', 'priority', 'handler', 'timeout', 'meta', 'attempts', 'result', 'error',
+                 'addedAt', 'readyAt', 'startedAt', 'finishedAt', 'queueTime', 'runTime')
+
+    def __init__(self, url: str, priority: int = 0, handler=None, timeout: float = None, meta: dict = None):
+        self.url = url
+        self.host = (urlsplit(url).hostname or '').lower()
+        self.priority = priority
+        self.handler = handler
+        self.timeout = timeout
+        self.meta = meta
+        self.attempts = 0
+        self.result = None
+        self.error = None
+        self.addedAt = None
+        self.readyAt = None
+        self.startedAt = None
+        self.finishedAt = None
+        # seconds waiting in the queue and running, summed over the attempts
+        self.queueTime = 0.0
+        self.runTime = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return self.finishedAt != None and self.error == None
+
+    def __repr__(self):
+        return '<CrawlJob {} priority={} attempts={}>'.format(self.url, self.priority, self.attempts)
+
+
+class _Host(object):
+    """
+    Jobs waiting for one host and its limits
+    """
+    __slots__ = ('name', 'jobs', 'running', 'nextStart')
+
+    def __init__(self, name: str):
+        self.name = name
+        # heap of (-priority, seq, job)
+        self.jobs = []
+        self.running = 0
+        self.nextStart = 0.0
+
+
+class CrawlScheduler(object):
+    """
+    Run prioritized jobs across several pages, eg:
+
+            scheduler = CrawlScheduler(browser, pages=8, hostConcurrency=2, hostQps=1.0)
+            scheduler.add('https://www.jd.com', priority=10)
+            scheduler.add('https://item.jd.com/1.html', handler=parseItem)
+            jobs = await scheduler.run()
+
+    a free page takes the highest priority job among the hosts which are below hostConcurrency running jobs and
+    whose last start is at least 1/hostQps ago, so one slow origin never blocks the pages for the others; a failed or
+    timed out job is retried after backoff * 2 ** attempt seconds, up to retries times
+    """
+
+    def __init__(self, browser, pages: int = 4, hostConcurrency: int = HOST_CONCURRENCY, hostQps: float = None,
+                 retries: int = 2, backoff: float = 1.0, maxBackoff: float = 60.0, timeout: float = 30.0,
+                 handler=gotoHandler, reportInterval: float = None, onResult=None, keepFinished: bool = True):
+        """
+        :param browser: Browser or BrowserContext the pages are created in
+        :param pages: pages running jobs at the same time
+        :param hostConcurrency: max jobs running at the same time per host, None for no limit
+        :param hostQps: max job starts per second per host, None for no limit
+        :param retries: extra attempts of a failed job
+        :param backoff: seconds before the first retry, doubled for each next one
+        :param maxBackoff: cap of the retry delay, seconds
+        :param timeout: default seconds a job may run
+        :param handler: default async function(page, job) -> result
+        :param reportInterval: seconds between two stats log lines while running, None for no log
+        :param onResult: function(job) called when a job is finished, succeeded or failed for good
+        :param keepFinished: keep the finished jobs for run to return, False when onResult consumes them, so a long
+                             run(keepOpen=True) does not grow with every job
+        """
+        self._browser = browser
+        self._pageCount = pages
+        self._hostConcurrency = hostConcurrency
+        self._minInterval = 1.0 / hostQps if hostQps else 0.0
+        self._retries = retries
+        self._backoff = backoff
+        self._maxBackoff = maxBackoff
+        self._timeout = timeout
+        self._handler = handler
+        self._reportInterval = reportInterval
+        self._onResult = onResult
+        self._keepFinished = keepFinished
+        self._log = logging.getLogger('Crawler.CrawlScheduler')
+        self._hosts = {}
+        self._seq = itertools.count()
+        self._queued = 0
+        self._delayed = 0
+        self._running = 0
+        self._changed = None
+        self._stopping = False
+        self._keepOpen = False
+        self._pageFailures = 0
+        self._finished = []
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._recent = deque()
+        self._startedAt = None
+        self.succeeded = 0
+        self.failed = 0
+        self.retried = 0
+        self.timedOut = 0
+
+    ################################# jobs ######################################
+    def add(self, url: str, priority: int = 0, handler=None, timeout: float = None, meta: dict = None) -> CrawlJob:
+        """
+        Queue a job, may be called while running, e.g. from a handler for the links it found
+        :param priority: larger runs first
+        :param handler: async function(page, job) -> result, default the handler of the scheduler
+        :param timeout: seconds, default the timeout of the scheduler
+        :param meta: anything the handler needs
+        :return: CrawlJob, its result or error is set once finished
+        """
+        job = CrawlJob(url, priority, handler or self._handler, timeout or self._timeout, meta)
+        job.addedAt = time.monotonic()
+        self._push(job)
+        return job
+
+    def addJobs(self, urls: list, priority: int = 0) -> list:
+        return [self.add(url, priority) for url in urls]
+
+    def _push(self, job: CrawlJob) -> None:
+        host = self._hosts.get(job.host)
+        if host == None:
+            host = self._hosts[job.host] = _Host(job.host)
+        job.readyAt = time.monotonic()
+        heapq.heappush(host.jobs, (-job.priority, next(self._seq), job))
+        self._queued += 1
+        self._notify()
+
+    def _pick(self, now: float):
+        """
+        :return: (job, None) for the job to run now, (None, seconds) until a rate limited host may start again
+        """
+        best = None
+        wait = None
+        idle = []
+        for host in self._hosts.values():
+            if not host.jobs:
+                # dropped once done with, so a long crawl only scans the hosts it still has work for
+                if not host.running and host.nextStart <= now:
+                    idle.append(host.name)
+                continue
+            if self._hostConcurrency and host.running >= self._hostConcurrency:
+                continue
+            if host.nextStart > now:
+                wait = host.nextStart - now if wait == None else min(wait, host.nextStart - now)
+                continue
+            if best == None or host.jobs[0] < best.jobs[0]:
+                best = host
+        for name in idle:
+            del self._hosts[name]
+        if best == None:
+            return (None, wait)
+        (_, _, job) = heapq.heappop(best.jobs)
+        self._queued -= 1
+        best.running += 1
+        best.nextStart = now + self._minInterval
+        return (job, None)
+
+    async def _next(self):
+        """
+        :return: next CrawlJob, None once every job is finished or the scheduler is stopped
+        """
+        async with self._changed:
+            while True:
+                if self._stopping:
+                    return None
+                (job, wait) = self._pick(time.monotonic())
+                if job != None:
+                    self._running += 1
+                    return job
+                if not self._queued and not self._delayed and not self._running and not self._keepOpen:
+                    return None
+                try:
+                    await asyncio.wait_for(self._changed.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+
+    def _notify(self) -> None:
+        if self._changed != None:
+            EventLoop.create_task(self._notifyAll())
+
+    async def _notifyAll(self):
+        async with self._changed:
+            self._changed.notify_all()
+
+    ################################# jobs ######################################
+
+    ################################# run #######################################
+    async def run(self, keepOpen: bool = False) -> list:
+        """
+        Run until every job, including the ones added while running, is finished or stop is called
+        :param keepOpen: wait for more jobs once the queue is empty until close is called, for jobs fed from
+                         outside, e.g. by ShardRunner
+        :return: list of finished CrawlJob in finish order, empty with keepFinished False
+        """
+        self._changed = asyncio.Condition()
+        self._stopping = False
+        self._keepOpen = keepOpen
+        self._startedAt = time.monotonic()
+        reporter = EventLoop.create_task(self._report()) if self._reportInterval else None
+        try:
+            await asyncio.gather(*[self._worker(index) for index in range(self._pageCount)])
+        finally:
+            if reporter != None:
+                reporter.cancel()
+        self._log.info('crawl done: {}'.format(self.stats()))
+        return self._finished
+
+    def close(self) -> None:
+        """
+        End a run(keepOpen=True) once the jobs queued are finished
+        """
+        self._keepOpen = False
+        self._notify()
+
+    def stop(self) -> None:
+        """
+        Let the running jobs finish and start no other one, run returns then
+        """
+        self._stopping = True
+        self._notify()
+
+    async def _worker(self, index: int):
+        page = None
+        try:
+            while True:
+                job = await self._next()
+                if job == None:
+                    return
+                if page == None:
+                    page = await self._newPage()
+                if page == None:
+                    # the job counts the attempt, so retries stays the limit when no page can be created
+                    job.attempts += 1
+                    self._pageFailures += 1
+                    if self._pageFailures >= MAX_PAGE_FAILURES and not self._stopping:
+                        self._log.error('{} page creations failed in a row, stop the crawl'.format(
+                            self._pageFailures))
+                        self._stopping = True
+                    self._done(job, None, RuntimeError('no page for the job'))
+                    continue
+                self._pageFailures = 0
+                healthy = await self._runJob(page, job)
+                if not healthy:
+                    page = await self._recyclePage(page)
+        finally:
+            if page != None:
+                await self._closePage(page)
+
+    async def _runJob(self, page, job: CrawlJob) -> bool:
+        """
+        :return: False when the page is left in an unknown state and has to be reset
+        """
+        job.attempts += 1
+        job.startedAt = time.monotonic()
+        job.queueTime += job.startedAt - job.readyAt
+        try:
+            result = await asyncio.wait_for(job.handler(page, job), job.timeout)
+            error = None
+        except (asyncio.TimeoutError, TimeoutError) as e:
+            self.timedOut += 1
+            (result, error) = (None, e if str(e) else TimeoutError('job timed out after {}s'.format(job.timeout)))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            (result, error) = (None, e)
+        job.runTime += time.monotonic() - job.startedAt
+        self._done(job, result, error)
+        return error == None
+
+    def _done(self, job: CrawlJob, result, error) -> None:
+        host = self._hosts.get(job.host)
+        host.running -= 1
+        self._running -= 1
+        if error != None and job.attempts <= self._retries and not self._stopping:
+            delay = min(self._backoff * 2 ** (job.attempts - 1), self._maxBackoff)
+            self.retried += 1
+            self._log.warning('{} failed on attempt {}, retry in {}s: {}'.format(job.url, job.attempts, delay, error))
+            self._delayed += 1
+            EventLoop.loop.call_later(delay, self._retry, job)
+            self._notify()
+            return
+        job.result = result
+        job.error = error
+        job.finishedAt = time.monotonic()
+        if error == None:
+            self.succeeded += 1
+        else:
+            self.failed += 1
+            self._log.error('{} failed after {} attempts: {}'.format(job.url, job.attempts, error))
+        if self._keepFinished:
+            self._finished.append(job)
+        self._latencies.append((job.queueTime, job.runTime, job.finishedAt - job.addedAt))
+        self._recent.append(job.finishedAt)
+        if self._onResult != None:
+            try:
+                self._onResult(job)
+            except Exception as e:
+                self._log.exception(e)
+        self._notify()
+
+    def _retry(self, job: CrawlJob) -> None:
+        self._delayed -= 1
+        self._push(job)
+
+    async def _newPage(self):
+        try:
+            return await self._browser.createPage()
+        except Exception as e:
+            self._log.error('create page failed: {}'.format(e))
+            return None
+
+    async def _recyclePage(self, page):
+        try:
+            await page.reset()
+            return page
+        except Exception as e:
+            self._log.warning('reset page failed, replace it: {}'.format(e))
+            await self._closePage(page)
+            return None
+
+    async def _closePage(self, page):
+        try:
+            await self._browser.closePage(page)
+        except Exception as e:
+            self._log.warning('close page failed: {}'.format(e))
+
+    async def _report(self):
+        while True:
+            await asyncio.sleep(self._reportInterval)
+            self._log.info('crawl progress: {}'.format(self.stats()))
+
+    ################################# run #######################################
+
+    ################################# stats #####################################
+    def stats(self) -> dict:
+        """
+        :return: counters, throughput in jobs per second since run and over the last RATE_WINDOW seconds, and the
+                 queue, run and total seconds of the finished jobs as mean, p50, p95
+        """
+        now = time.monotonic()
+        while self._recent and now - self._recent[0] > RATE_WINDOW:
+            self._recent.popleft()
+        elapsed = now - self._startedAt if self._startedAt != None else 0.0
+        finished = self.succeeded + self.failed
+        stats = dict(queued=self._queued + self._delayed, running=self._running, succeeded=self.succeeded,
+                     failed=self.failed, retried=self.retried, timedOut=self.timedOut,
+                     throughput=finished / elapsed if elapsed else 0.0,
+                     recentThroughput=len(self._recent) / min(RATE_WINDOW, elapsed) if elapsed else 0.0)
+        for index, name in enumerate(('queue', 'run', 'total')):
+            values = sorted(latency[index] for latency in self._latencies)
+            stats[name] = dict(mean=sum(values) / len(values), p50=_percentile(values, 50),
+                               p95=_percentile(values, 95)) if values else None
+        return stats
+
+    def hostStats(self) -> dict:
+        return {host.name: dict(queued=len(host.jobs), running=host.running) for host in self._hosts.values()}
+
+    ################################# stats #####################################
+
+
+def _percentile(values: list, q: float) -> float:
+    """
+    :param values: sorted list
+    """
+    index = min(len(values) - 1, int(round(q / 100.0 * (len(values) - 1))))
+    return values[index]
@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import re
+
+__all__ = ['DomSnapshot']
+
+ELEMENT_NODE = 1
+TEXT_NODE = 3
+
+# text inside these elements is not rendered, so it is not part of innerText
+_NO_TEXT_TAGS = {'script', 'style', 'noscript', 'template', 'head', 'title'}
+
+_tokenPattern = re.compile(r'''
+    (?P<comma>\s*,\s*)
+  | \s*(?P<comb>[>+~])\s*
+  | (?P<ws>\s+)
+  | (?P<tag>\*|[a-zA-Z][\w-]*)
+  | \#(?P<id>[\w-]+)
+  | \.(?P<cls>[\w-]+)
+  | \[\s*(?P<attr>[\w:-]+)\s*(?:(?P<op>[~|^$*]?=)\s*(?:"(?P<dq>[^"]*)"|'(?P<sq>[^']*)'|(?P<uq>[^\]\s]+))\s*)?\]
+  | (?P<pseudo>:[\w-]+)
+''', re.X)
+
+_selectorCache = {}
+
+
+def compileSelector(selector: str) -> list:
+    """
+    Compile a css selector list to [[(combinator, compound), ...], ...]
+
+    supported: type, *, #id, .class, [attr], [attr=v], [attr~=v], [attr|=v], [attr^=v], [attr$=v], [attr*=v],
+    and the ' ', '>', '+', '~' combinators, a compound is (tag, ids, classes, attrs)
+    :param selector: css selector string
+    :return: list of complex selectors
+    """
+    compiled = _selectorCache.get(selector)
+    if compiled != None:
+        return compiled
+
+    complexes = []
+    current = []
+    combinator = None
+    compound = None
+    pos = 0
+    text = selector.strip()
+    while pos < len(text):
+        match = _tokenPattern.match(text, pos)
+        if not match:
+            raise ValueError('unsupported selector {} at {}'.format(selector, pos))
+        pos = match.end()
+        kind = match.lastgroup if match.lastgroup not in ('dq', 'sq', 'uq', 'op') else 'attr'
+        if kind in ('comma', 'comb', 'ws'):
+            if compound == None:
+                raise ValueError('unexpected combinator in selector {}'.format(selector))
+            current.append((combinator, compound))
+            compound = None
+            if kind == 'comma':
+                complexes.append(current)
+                current = []
+                combinator = None
+            else:
+                combinator = match.group('comb') or ' '
+            continue
+        if kind == 'pseudo':
+            raise ValueError('pseudo class {} is not supported in snapshot selectors'.format(match.group('pseudo')))
+        if compound == None:
+            compound = ['*', [], [], []]
+        if kind == 'tag':
+            compound[0] = match.group('tag').lower()
+        elif kind == 'id':
+            compound[1].append(match.group('id'))
+        elif kind == 'cls':
+            compound[2].append(match.group('cls'))
+        elif kind == 'attr':
+            value = match.group('dq')
+            if value == None:
+                value = match.group('sq')
+            if value == None:
+                value = match.group('uq')
+            compound[3].append((match.group('attr').lower(), match.group('op'), value))
+    if compound == None:
+        raise ValueError('selector {} ends with a combinator'.format(selector))
+    current.append((combinator, compound))
+    complexes.append(current)
+
+    compiled = [[(comb, (tag, tuple(ids), tuple(classes), tuple(attrs))) for comb, (tag, ids, classes, attrs) in
+                 complex] for complex in complexes]
+    _selectorCache[selector] = compiled
+    return compiled
+
+
+class DomSnapshot(object):
+    """
+    Flat view of a document captured once by DOMSnapshot.captureSnapshot, selectors are resolved in python over the
+    arrays, so any number of selectors and schemas can be run against one capture without extra round trips
+    """
+
+    def __init__(self, snapshot: dict, documentIndex: int = 0):
+        """
+        :param snapshot: result of DOMSnapshot.captureSnapshot, {'documents': [...], 'strings': [...]}
+        :param documentIndex: index of the document to use, 0 is the main frame
+        """
+        self._log = logging.getLogger('DomSnapshot.DomSnapshot')
+        strings = snapshot.get('strings')
+        nodes = snapshot.get('documents')[documentIndex].get('nodes')
+
+        self._parent = nodes.get('parentIndex')
+        self._type = nodes.get('nodeType')
+        count = len(self._type)
+        self._name = [strings[index].lower() if index >= 0 else '' for index in nodes.get('nodeName')]
+        self._value = [strings[index] if index >= 0 else '' for index in nodes.get('nodeValue', [-1] * count)]
+
+        self._attrs = [None] * count
+        self._children = [[] for _ in range(count)]
+        self._prevElement = [-1] * count
+        lastElementChild = {}
+        attributes = nodes.get('attributes', [])
+        for node in range(count):
+            parent = self._parent[node]
+            if parent >= 0:
+                self._children[parent].append(node)
+            if self._type[node] != ELEMENT_NODE:
+                continue
+            if parent >= 0:
+                self._prevElement[node] = lastElementChild.get(parent, -1)
+                lastElementChild[parent] = node
+            pairs = attributes[node] if node < len(attributes) else []
+            self._attrs[node] = {strings[pairs[i]].lower(): strings[pairs[i + 1]] for i in range(0, len(pairs) - 1, 2)}
+
+        self._root = self._parent.index(-1) if count else -1
+        self._classes = {}
+
+    ################################# query #####################################
+    def querySelectorAll(self, selector: str, root: int = None) -> list:
+        """
+        Find the elements under root matching selector, in document order
+        :param selector: css selector
+        :param root: node index, default the document
+        :return: list of node index
+        """
+        complexes = compileSelector(selector)
+        return [node for node in self._descendants(self._root if root == None else root)
+                if self._type[node] == ELEMENT_NODE and any(self._matches(node, complex, len(complex) - 1)
+                                                            for complex in complexes)]
+
+    def querySelector(self, selector: str, root: int = None):
+        """
+        Find the first element under root matching selector
+        :param selector: css selector
+        :param root: node index, default the document
+        :return: node index or None
+        """
+        complexes = compileSelector(selector)
+        for node in self._descendants(self._root if root == None else root):
+            if self._type[node] == ELEMENT_NODE and any(self._matches(node, complex, len(complex) - 1)
+                                                        for complex in complexes):
+                return node
+        return None
+
+    def extract(self, list_selector: str, itemDict: dict) -> list:
+        """
+        Same result as Page.evalateFromList, computed from the snapshot
+
+        :param list_selector: selector to the rows
+        :param itemDict: dict, selector dict, {'key1':selectorValue, 'key2': selectorValue}
+        :return: [{'key1': value, 'key2': value}], value is None when the field is not found
+        """
+        result = []
+        for row in self.querySelectorAll(list_selector):
+            item = {}
+            for key, selector in itemDict.items():
+                node = self.querySelector(selector, row)
+                item[key] = self.innerText(node) if node != None else None
+            result.append(item)
+        return result
+
+    ################################# query #####################################
+
+    ################################# node ######################################
+    def nodeName(self, node: int) -> str:
+        return self._name[node]
+
+    def attribute(self, node: int, name: str):
+        attrs = self._attrs[node]
+        return attrs.get(name.lower()) if attrs else None
+
+    def innerText(self, node: int) -> str:
+        """
+        Text of the node and its descendants with whitespace collapsed, script and style excluded, an approximation
+        of innerText since the snapshot is taken without layout
+        """
+        parts = []
+        stack = [node]
+        while stack:
+            current = stack.pop()
+            if self._type[current] == TEXT_NODE:
+                parts.append(self._value[current])
+            elif self._name[current] not in _NO_TEXT_TAGS:
+                stack.extend(reversed(self._children[current]))
+        return ' '.join(''.join(parts).split())
+
+    ################################# node ######################################
+
+    def _descendants(self, root: int):
+        stack = list(reversed(self._children[root]))
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(reversed(self._children[node]))
+
+    def _classList(self, node: int) -> set:
+        classes = self._classes.get(node)
+        if classes == None:
+            classes = set(self._attrs[node].get('class', '').split())
+            self._classes[node] = classes
+        return classes
+
+    def _matchCompound(self, node: int, compound: tuple) -> bool:
+        if node < 0 or self._type[node] != ELEMENT_NODE:
+            return False
+        (tag, ids, classes, attrs) = compound
+        if tag != '*' and self._name[node] != tag:
+            return False
+        nodeAttrs = self._attrs[node]
+        for id in ids:
+            if nodeAttrs.get('id') != id:
+                return False
+        if classes and not self._classList(node).issuperset(classes):
+            return False
+        for (name, op, value) in attrs:
+            actual = nodeAttrs.get(name)
+            if actual == None:
+                return False
+            if op == None:
+                continue
+            if op == '=' and actual != value:
+                return False
+            if op == '~=' and value not in actual.split():
+                return False
+            if op == '|=' and actual != value and not actual.startswith(value + '-'):
+                return False
+            if op == '^=' and not (value and actual.startswith(value)):
+                return False
+            if op == '$=' and not (value and actual.endswith(value)):
+                return False
+            if op == '*=' and not (value and value in actual):
+                return False
+        return True
+
+    def _matches(self, node: int, complex: list, index: int) -> bool:
+        (combinator, compound) = complex[index]
+        if not self._matchCompound(node, compound):
+            return False
+        if index == 0:
+            return True
+        if combinator == '>':
+            return self._matches(self._parent[node], complex, index - 1)
+        if combinator == ' ':
+            ancestor = self._parent[node]
+            while ancestor >= 0:
+                if self._matches(ancestor, complex, index - 1):
+                    return True
+                ancestor = self._parent[ancestor]
+            return False
+        if combinator == '+':
+            return self._matches(self._prevElement[node], complex, index - 1)
+        if combinator == '~':
+            sibling = self._prevElement[node]
+            while sibling >= 0:
+                if self._matches(sibling, complex, index - 1):
+                    return True
+                sibling = self._prevElement[sibling]
+            return False
+        return False
@@ -10,6 +10,15 @@ from MBrowser.Session import Session
 
 __all__ = ['ElementHandle']
 
+_scrollIntoViewIfNeededJS = r"""element => {
+            if (!element.ownerDocument.contains(element))
+                return 'Node is detached from document';
+            if (element.nodeType !== Node.ELEMENT_NODE)
+                return 'Node is not of type HTMLElement';
+            element.scrollIntoViewIfNeeded();
+            return false;
+            }"""
+
 
 class ElementHandle(JSHandle):
     def __init__(self, context: ExecutionContext, client: Session, remoteObject: dict, page: object):
@@ -19,6 +28,7 @@ class ElementHandle(JSHandle):
         self._remoteObject = remoteObject
         self._page = page
         self._disposed = False
+        self._scope = None
 
     def asElement(self):
         return self
@@ -27,11 +37,20 @@ class ElementHandle(JSHandle):
         if self._disposed:
             return
         self._disposed = True
+        if self._scope and self._scope.active:
+            return
         await helper.releaseObject(self._client, self._remoteObject)
 
     async def _visibleCenter(self):
-        await self._scrollIntoViewIfNeeded()
-        box = await self.boundingBox()
+        # scroll and box model are pipelined, the session runs them in order so the box is taken after scrolling
+        scrollCommand = await self._context._functionCommand(_scrollIntoViewIfNeededJS, self)
+        (scrolled, model) = await self._client.sendMany([
+            scrollCommand,
+            ('DOM.getBoxModel', dict(objectId=self._remoteObjectId()))])
+        if not isinstance(scrolled, dict) or scrolled.get(ERROR) or scrolled.get(RESULT).get('exceptionDetails') \
+                or scrolled.get(RESULT).get(RESULT).get('value'):
+            raise RuntimeError("ERROR when run _scrollIntoViewIfNeeded")
+        box = self._boxFromModel(model)
         return {
             'x': box.get('x') + box.get('width') / 2,
             'y': box.get('y') + box.get('height') / 2
@@ -65,17 +84,10 @@ class ElementHandle(JSHandle):
             return await self._page._touchscreen.tap(result.get('x'), result.get('y'))
 
     async def focus(self):
-        await self.executionContext().evaluate(r'element= > element.focus()', self)
+        await self.executionContext().evaluate(r'element => element.focus()', self)
 
     async def _scrollIntoViewIfNeeded(self):
-        error = await self.executionContext().evaluate(r"""element => {
-            if (!element.ownerDocument.contains(element))
-                return 'Node is detached from document';
-            if (element.nodeType !== Node.ELEMENT_NODE)
-                return 'Node is not of type HTMLElement';
-            element.scrollIntoViewIfNeeded();
-            return false;
-            }""", self)
+        error = await self.executionContext().evaluate(_scrollIntoViewIfNeededJS, self)
         if error:
             raise RuntimeError("ERROR when run _scrollIntoViewIfNeeded")
 
@@ -83,7 +95,10 @@ class ElementHandle(JSHandle):
         model = await self._client.send('DOM.getBoxModel', dict(
             objectId=self._remoteObject.get(OBID)
         ))
-        if not model:
+        return self._boxFromModel(model)
+
+    def _boxFromModel(self, model):
+        if not isinstance(model, dict) or not model.get(RESULT):
             raise RuntimeError('Node is detached from document')
 
         quad = model.get(RESULT).get('model').get('border')
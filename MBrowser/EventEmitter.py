@@ -1,21 +1,44 @@
 # -*- coding: utf-8 -*-
 
 import logging
-from asyncio import iscoroutine, ensure_future, Future, wait_for
+from asyncio import iscoroutine, ensure_future, Future, wait_for, get_event_loop
 from typing import Any
 
 from MBrowser.Const import TIMEOUT_S
 
-__all__ = ['EventEmitter']
+__all__ = ['EventEmitter', 'EventRegistry']
 
-_eventCallbacks = {}
-_allEventCallback = []
+
+class EventRegistry(object):
+    """
+    Listeners of one scope, indexed by event name
+
+    callbacks: {eventName: {callback: once}}, dicts keep the register order and give O(1) add/remove
+    allCallbacks: {callback: None}
+    """
+
+    def __init__(self):
+        self.callbacks = {}
+        self.allCallbacks = {}
 
 
 class EventEmitter(object):
+    """
+    Emitters talking to the same Session (self._client) share the registry of that Session, so events of one
+    tab only reach the listeners of that tab, emitters without a Session get a registry of their own
+    """
+
     def __init__(self):
         pass
 
+    def _registry(self) -> EventRegistry:
+        registry = self.__dict__.get('_eventRegistry')
+        if registry is None:
+            client = self.__dict__.get('_client')
+            registry = client._registry() if isinstance(client, EventEmitter) else EventRegistry()
+            self._eventRegistry = registry
+        return registry
+
     #################################### register ###############################
     def onAll(self, callback):
         """
@@ -23,7 +46,7 @@ class EventEmitter(object):
         :param callback: event listener, function to receive Events
         :return: None
         """
-        _allEventCallback.append(callback)
+        self._registry().allCallbacks[callback] = None
 
     def onece(self, eventName: str, callback):
         """
@@ -37,7 +60,7 @@ class EventEmitter(object):
 
     def on(self, events: list, callback, once: bool = False):
         """
-        Register event listener(callback) to receive events
+        Register event listener(callback) to receive events, registering the same callback again only updates once
         :param events: list of event names
         :param callback: event listener, function to receive event
         :param once: once tag for receive event only, default False
@@ -47,12 +70,7 @@ class EventEmitter(object):
             for event in events:
                 self.on(event, callback, once)
         else:
-            callbacks = _eventCallbacks.get(events)
-            if not callbacks:
-                _eventCallbacks[events] = [(callback, once)]
-            else:
-                callbacks.append((callback, once))
-            pass
+            self._registry().callbacks.setdefault(events, {})[callback] = once
 
     #################################### register ###############################
 
@@ -60,33 +78,34 @@ class EventEmitter(object):
     def removeEvent(self, eventName: str, callback=None):
         """
         Remove event listener(callback) for event(eventName)
-        :param eventName: event name, string
-        :param callback: event listener, function
+        :param eventName: event name, string, None with a callback to remove a listener registered by onAll
+        :param callback: event listener, function, None to remove all listeners of eventName
         :return: None
         """
-        if eventName == None and callback == None:
-            return
-        if eventName == None and callback != None and callback in _allEventCallback:
-            _allEventCallback.pop(callback)
+        registry = self._registry()
+        if eventName == None:
+            if callback != None:
+                registry.allCallbacks.pop(callback, None)
             return
 
-        callbacks = _eventCallbacks.get(eventName)
-
-        if callbacks and callback == None:
-            _eventCallbacks.pop(eventName)
+        if callback == None:
+            registry.callbacks.pop(eventName, None)
+            return
+        callbacks = registry.callbacks.get(eventName)
         if callbacks:
-            for cb in [(cb, once) for cb, once in callbacks if cb == callback]:
-                callbacks.pop(cb)
-        pass
+            callbacks.pop(callback, None)
+            if len(callbacks) == 0:
+                registry.callbacks.pop(eventName)
 
-    def removeEvents(self, events: list):
+    def removeEvents(self, events: list, callback=None):
         """
         Remove events(list) and related callbacks
         :param events: list of Event name
+        :param callback: only remove this listener, default None to remove all listeners of the events
         :return: None
         """
         for event in events:
-            self.removeEvent(event)
+            self.removeEvent(event, callback)
 
     #################################### remove #################################
 
@@ -112,7 +131,8 @@ class EventEmitter(object):
         :return: object, if waitRspAndReturn is True, the return would be a coroutine(_waitForResponse), you need to
                 await it to get final result
         """
-        for callback in _allEventCallback:
+        registry = self._registry()
+        for callback in list(registry.allCallbacks):
             result = callback(*args, **kwargs)
             if iscoroutine(result):
                 futreult = ensure_future(result)
@@ -122,10 +142,12 @@ class EventEmitter(object):
                 if waitRspAndReturn:
                     return result
 
-        callbacks = _eventCallbacks.get(eventName)
-        if callbacks and len(callbacks) > 0:
-            for cb in callbacks:
-                (fun, once) = cb
+        callbacks = registry.callbacks.get(eventName)
+        if callbacks:
+            # iterate a snapshot, listeners may register or remove listeners
+            for (fun, once) in list(callbacks.items()):
+                if once:
+                    self.removeEvent(eventName, fun)
                 try:
                     result = fun(*args, **kwargs)
                     if iscoroutine(result):
@@ -139,14 +161,69 @@ class EventEmitter(object):
                     logging.error('fun {} type Error: {}'.format(fun.__name__, e))
                 except Exception as e:
                     logging.exception(e)
-                if once:
-                    callbacks.pop(cb)
-                if len(callbacks) == 0:
-                    _eventCallbacks.pop(eventName)
         else:
             logging.debug('no cb for event: {}'.format(eventName))
             # self._log.info('no cb for event: {} {}'.format(event.get(METHOD),event))
             #################################### Emit ###################################
 
+    def dispatch(self, eventName: str, *args: Any, **kwargs: Any) -> None:
+        """
+        Deliver an event like emit, every listener is guarded so a failing one neither stops the others nor the
+        caller, a listener returning a coroutine runs as a task like with emit, so it may wait for a later event of
+        the same Session, used by the dispatcher of Session
+        :param eventName: event Name, string
+        :return: None
+        """
+        registry = self._registry()
+        for callback in list(registry.allCallbacks):
+            try:
+                result = callback(*args, **kwargs)
+                if iscoroutine(result):
+                    ensure_future(result)
+            except Exception as e:
+                logging.exception(e)
+
+        callbacks = registry.callbacks.get(eventName)
+        if not callbacks:
+            return
+        for (fun, once) in list(callbacks.items()):
+            if once:
+                self.removeEvent(eventName, fun)
+            try:
+                result = fun(*args, **kwargs)
+                if iscoroutine(result):
+                    ensure_future(result)
+            except Exception as e:
+                logging.exception(e)
+
+    #################################### Wait ###################################
+    async def waitForEvent(self, events, predicate=None, timeout: int = TIMEOUT_S):
+        """
+        Wait for an event, the listener is registered right away and removed once done, so no polling is involved
+        :param events: event name or list of event names
+        :param predicate: function called with the event args, the wait ends on the first event it returns True for,
+                          default None to end on the first event
+        :param timeout: seconds, raise TimeoutError when reached
+        :return: tuple, the args of the event
+        """
+        future = get_event_loop().create_future()
+
+        def listener(*args: Any, **kwargs: Any):
+            if future.done():
+                return
+            try:
+                if predicate == None or predicate(*args, **kwargs):
+                    future.set_result(args)
+            except Exception as e:
+                future.set_exception(e)
+
+        self.on(events, listener)
+        try:
+            return await wait_for(future, timeout)
+        finally:
+            self.removeEvents(events if type(events) is list else [events], listener)
+
+    #################################### Wait ###################################
+
     async def _waitForResponse(self, future: Future):
         return await wait_for(future, TIMEOUT_S)
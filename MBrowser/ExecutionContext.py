@@ -1,15 +1,85 @@
 # -*- coding: utf-8 -*-
 
-import json
+import contextvars
+import hashlib
 import logging
 import math
 from typing import Any
 
-from MBrowser import helper
+from MBrowser import EventLoop, helper
 from MBrowser.Const import *
 from MBrowser.EventEmitter import EventEmitter
 
-__all__ = ['ExecutionContext', 'JSHandle']
+__all__ = ['ExecutionContext', 'JSHandle', 'HandleScope']
+
+# called on the cached function object, this is the page function
+_callCachedFunctionJS = 'function(...args) { return this(...args); }'
+
+# next chunk of a cursor made by evaluateChunks
+_cursorSliceJS = '(cursor, start, count) => cursor.items.slice(start, start + count)' \
+                 '.map(item => cursor.map(item, ...cursor.args))'
+
+_currentScope = contextvars.ContextVar('HandleScope', default=None)
+
+
+def currentHandleScope():
+    """
+    Get the innermost HandleScope of the running task, None outside of any scope
+    """
+    return _currentScope.get()
+
+
+def currentObjectGroup() -> str:
+    """
+    Get the object group new remote objects are tagged with, the one of the innermost HandleScope of the running
+    task, HANDLE_GROUP outside of any scope
+    """
+    scope = _currentScope.get()
+    return scope.group if scope else HANDLE_GROUP
+
+
+class HandleScope(object):
+    """
+    Tag every remote object created inside the scope with one object group, all of them are released with a single
+    Runtime.releaseObjectGroup on exit, eg:
+
+            async with page.handleScope():
+                handle = await page.S(selector)
+                ...
+
+    handles disposed inside the scope are only marked disposed, the scope releases them on exit
+    """
+    _groupid = 0
+
+    def __init__(self, client):
+        HandleScope._groupid += 1
+        self._client = client
+        self._log = logging.getLogger('ExecutionContext.HandleScope')
+        self.group = 'MBrowser.scope.{}'.format(HandleScope._groupid)
+        self.active = False
+        self._handles = []
+        self._token = None
+
+    def _track(self, handle) -> None:
+        handle._scope = self
+        self._handles.append(handle)
+
+    async def __aenter__(self):
+        self.active = True
+        self._token = _currentScope.set(self)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        _currentScope.reset(self._token)
+        self.active = False
+        for handle in self._handles:
+            handle._disposed = True
+        self._handles.clear()
+        try:
+            await self._client.send('Runtime.releaseObjectGroup', dict(objectGroup=self.group))
+        except Exception as e:
+            self._log.exception(e)
+        return False
 
 
 class ExecutionContext(EventEmitter):
@@ -18,63 +88,211 @@ class ExecutionContext(EventEmitter):
         self._contextId = contextId
         self._objectHandleFactory = objectHandleFactory
         self._log = logging.getLogger('ExecutionContext.ExecutionContext')
+        self._scriptCache = {}
+        self._scriptCacheHits = 0
+        self._scriptCacheMisses = 0
+
+    async def evaluate(self, pageFunction: str, *args: Any, awaitPromise: bool = True):
+        """
+        Evaluate pageFunction in this context and get the result by value with a single round trip, no remote object
+        is created
+        :param pageFunction: js function source called with args, or an expression when there are no args
+        :param args: arguments, JSHandle of this context or json serializable values
+        :param awaitPromise: wait for the promise returned
+        :return: the json value of the result
+        """
+        resp = await self._evaluate(pageFunction, *args, returnByValue=True, awaitPromise=awaitPromise)
+        return self._valueFromResponse(resp)
 
-    async def evaluate(self, pageFunction: str, *args: Any):
-        handle = await self.evaluateHandle(pageFunction, *args)
-        result = await handle.jsonValue()
-        await handle.dispose()
+    async def _evaluate(self, pageFunction: str, *args: Any, returnByValue: bool = True, awaitPromise: bool = True,
+                        objectGroup: str = None):
+        """
+        Run pageFunction as a function or as an expression as helper.isFunction guesses, a source taken for an
+        expression which evaluates to a function is called with args instead, as the function it is
+        :return: response of the command
+        """
+        function = helper.isFunction(pageFunction)
+        if function:
+            (method, params) = await self._functionCommand(pageFunction, *args, returnByValue=returnByValue,
+                                                           awaitPromise=awaitPromise)
+        else:
+            (method, params) = await self._expressionCommand(pageFunction, returnByValue=returnByValue,
+                                                             awaitPromise=awaitPromise)
+        if objectGroup:
+            params['objectGroup'] = objectGroup
+        resp = await self.emit(SE, method, params, waitRspAndReturn=True)
+        if function or not resp or resp.get(ERROR) or resp.get(RESULT).get('exceptionDetails'):
+            return resp
+        if resp.get(RESULT).get(RESULT).get('type') != 'function':
+            return resp
+        self._log.debug('expression is a function, call it: {}'.format(pageFunction[:100]))
+        if resp.get(RESULT).get(RESULT).get(OBID):
+            await self.emit(SE, 'Runtime.releaseObject', dict(objectId=resp.get(RESULT).get(RESULT).get(OBID)),
+                            waitRspAndReturn=True)
+        (method, params) = await self._functionCommand(pageFunction, *args, returnByValue=returnByValue,
+                                                       awaitPromise=awaitPromise)
+        if objectGroup:
+            params['objectGroup'] = objectGroup
+        return await self.emit(SE, method, params, waitRspAndReturn=True)
+
+    ################################ script cache ###############################
+    async def _functionCommand(self, pageFunction: str, *args: Any, returnByValue: bool = True,
+                               awaitPromise: bool = True) -> tuple:
+        """
+        Build the command calling pageFunction with args by value, a long function is compiled once in this context
+        and called through its cached handle afterwards, so its source is only shipped and parsed once
+        :return: (method, params)
+        """
+        params = dict(arguments=[self.convertArgument(arg) for arg in args],
+                      returnByValue=returnByValue,
+                      awaitPromise=awaitPromise)
+        functionId = None
+        if len(pageFunction) >= SCRIPT_CACHE_MIN_SIZE:
+            functionId = await self._cachedScript('function', pageFunction)
+        if functionId:
+            params.update(functionDeclaration=_callCachedFunctionJS, objectId=functionId)
+        else:
+            params.update(functionDeclaration=pageFunction, executionContextId=self._contextId)
+        return ('Runtime.callFunctionOn', params)
+
+    async def _expressionCommand(self, expression: str, returnByValue: bool = True,
+                                 awaitPromise: bool = True) -> tuple:
+        """
+        Build the command evaluating expression by value, a long expression is compiled once in this context and run
+        by its scriptId afterwards
+        :return: (method, params)
+        """
+        scriptId = None
+        if len(expression) >= SCRIPT_CACHE_MIN_SIZE:
+            scriptId = await self._cachedScript('expression', expression)
+        if scriptId:
+            return ('Runtime.runScript', dict(scriptId=scriptId, executionContextId=self._contextId,
+                                              returnByValue=returnByValue, awaitPromise=awaitPromise))
+        return ('Runtime.evaluate', dict(expression=expression, contextId=self._contextId,
+                                         returnByValue=returnByValue, awaitPromise=awaitPromise))
+
+    async def _cachedScript(self, kind: str, source: str):
+        key = (kind, hashlib.sha1(source.encode('utf-8')).hexdigest())
+        task = self._scriptCache.get(key)
+        if task:
+            self._scriptCacheHits += 1
+        else:
+            self._scriptCacheMisses += 1
+            compiler = self._compileFunction if kind == 'function' else self._compileExpression
+            # cache the task, concurrent misses of the same source wait for one compile
+            task = EventLoop.create_task(compiler(source))
+            self._scriptCache[key] = task
+        result = await task
+        if not result and self._scriptCache.get(key) is task:
+            # not compilable, let the plain command report the error
+            self._scriptCache.pop(key)
         return result
 
-    async def _funEvaluate(self, pageFunction: str, returnByValue: bool = False, awaitPromise: bool = True):
-        contextId = self._contextId
-        expression = pageFunction
-        resp = await self.emit(SE, 'Runtime.evaluate', dict(expression=expression, contextId=contextId,
-                                                            returnByValue=returnByValue,
-                                                            awaitPromise=awaitPromise), waitRspAndReturn=True)
+    async def _compileFunction(self, source: str):
+        resp = await self.emit(SE, 'Runtime.evaluate', dict(expression='(' + source + ')',
+                                                            contextId=self._contextId,
+                                                            objectGroup=SCRIPT_CACHE_GROUP), waitRspAndReturn=True)
+        if not resp or resp.get(ERROR) or resp.get(RESULT).get('exceptionDetails'):
+            return None
+        result = resp.get(RESULT).get(RESULT)
+        return result.get(OBID) if result.get('type') == 'function' else None
 
-        if resp.get(RESULT).get('exceptionDetails'):
-            self._log.error('get a ERROR rsp {}'.format(resp.get(RESULT).get('exceptionDetails')))
-            raise RuntimeError('get a ERROR rsp {}'.format(resp.get(RESULT).get('exceptionDetails')))
-        return resp.get(RESULT).get(RESULT)
-
-    async def _callFunctionOn(self, pageFunction: str, objectid: str, *args: Any, returnByValue: bool = False,
-                              awaitPromise: bool = True):
-        arglist = [self.convertArgument(arg) for arg in args]
-        result = await self.emit(SE, 'Runtime.callFunctionOn', dict(functionDeclaration=str(pageFunction),
-                                                                    objectId=objectid,
-                                                                    arguments=arglist,
-                                                                    returnByValue=returnByValue,
-                                                                    awaitPromise=awaitPromise), waitRspAndReturn=True)
-
-        if result.get(RESULT).get('exceptionDetails'):
-            self._log.error('get a ERROR rsp {}'.format(result.get(RESULT).get('exceptionDetails')))
+    async def _compileExpression(self, source: str):
+        resp = await self.emit(SE, 'Runtime.compileScript', dict(expression=source,
+                                                                 sourceURL='',
+                                                                 persistScript=True,
+                                                                 executionContextId=self._contextId),
+                               waitRspAndReturn=True)
+        if not resp or resp.get(ERROR) or resp.get(RESULT).get('exceptionDetails'):
             return None
-        return result.get(RESULT).get(RESULT)
+        return resp.get(RESULT).get('scriptId')
+
+    def scriptCacheStats(self) -> dict:
+        """
+        Get the compiled script cache counters of this context
+        :return: dict, {'hits': int, 'misses': int, 'size': int}
+        """
+        return dict(hits=self._scriptCacheHits, misses=self._scriptCacheMisses, size=len(self._scriptCache))
+
+    def _invalidate(self) -> None:
+        """
+        Drop the compiled script cache, called when the context is destroyed or cleared
+        """
+        for task in self._scriptCache.values():
+            task.cancel()
+        self._scriptCache.clear()
+
+    ################################ script cache ###############################
+
+    def _valueFromResponse(self, resp):
+        if not resp or resp.get(ERROR):
+            self._log.error('get a ERROR rsp {}'.format(resp))
+            raise RuntimeError('get a ERROR rsp {}'.format(resp))
+        if resp.get(RESULT).get('exceptionDetails'):
+            message = helper.getExceptionMessage(resp.get(RESULT).get('exceptionDetails'))
+            self._log.error('Evaluation failed: {}'.format(message))
+            raise RuntimeError('Evaluation failed: {}'.format(message))
+        return helper.valueFromRemoteObject(resp.get(RESULT).get(RESULT))
 
     async def evaluateHandle(self, pageFunction: str, *args: Any, returnByValue: bool = False,
                              awaitPromise: bool = True):
-        result = await self._funEvaluate(pageFunction, returnByValue=returnByValue, awaitPromise=awaitPromise)
-        self._log.info('Evaluate result was {}'.format(result))
-
-        if result.get(OBID) and result.get('type') == 'function':
-            result = await self._callFunctionOn(pageFunction, result.get(OBID),
-                                                *args, returnByValue=returnByValue, awaitPromise=awaitPromise)
-            self._log.info('CallFunctionOn result {}'.format(result))
-            return self._objectHandleFactory(self._contextId, result)
-        else:
-            return result
+        """
+        Evaluate pageFunction in this context and get a handle to the result, the remote object is tagged with the
+        object group of the current HandleScope
+        :param pageFunction: js function source called with args, or an expression when there are no args
+        :param args: arguments, JSHandle of this context or json serializable values
+        :return: JSHandle or ElementHandle
+        """
+        resp = await self._evaluate(pageFunction, *args, returnByValue=returnByValue, awaitPromise=awaitPromise,
+                                    objectGroup=currentObjectGroup())
+        self._valueFromResponse(resp)
+        result = resp.get(RESULT).get(RESULT)
+        self._log.debug('Evaluate result was {}'.format(result))
+        return self._objectHandleFactory(self._contextId, result)
+
+    async def evaluateChunks(self, pageFunction: str, *args: Any, mapFunction: str = None, chunkSize: int = 100):
+        """
+        Async generator pulling the array returned by pageFunction in bounded chunks, eg:
+
+                async for rows in context.evaluateChunks('sel => document.querySelectorAll(sel)', selector,
+                                                         mapFunction='(item, sel) => item.innerText'):
+                    process(rows)
+
+        pageFunction runs once and its result is kept in the page as a cursor, each chunk maps the next chunkSize
+        items with mapFunction(item, *args) and returns them by value, so no single message has to carry the whole
+        result and rows can be processed before the extraction finishes
+
+        :param pageFunction: js function called with args, returns an array like
+        :param args: arguments of pageFunction and mapFunction
+        :param mapFunction: js function (item, *args) => json value, default the item itself
+        :param chunkSize: number of items per chunk
+        :return: async generator of lists
+        """
+        cursorFunction = '(...args) => ({items: Array.from((' + pageFunction + ')(...args)), map: (' + (
+            mapFunction or 'item => item') + '), args: args})'
+        cursor = await self.evaluateHandle(cursorFunction, *args)
+        try:
+            start = 0
+            while True:
+                chunk = await self.evaluate(_cursorSliceJS, cursor, start, chunkSize)
+                if chunk:
+                    yield chunk
+                start += chunkSize
+                if not chunk or len(chunk) < chunkSize:
+                    break
+        finally:
+            await cursor.dispose()
 
     def convertArgument(self, arg: Any):
-        if arg is 0:
-            return {'unserializableValue': '-0'}
-        if arg == -0:
-            return {'unserializableValue': '-0'}
-        if arg == math.inf:
-            return {'unserializableValue': 'Infinity'}
-        if arg == -math.inf:
-            return {'unserializableValue': '-Infinity'}
-        if arg == None:
-            return {'unserializableValue': 'NaN'}
+        if isinstance(arg, float):
+            if arg == 0 and math.copysign(1, arg) < 0:
+                return {'unserializableValue': '-0'}
+            if arg == math.inf:
+                return {'unserializableValue': 'Infinity'}
+            if arg == -math.inf:
+                return {'unserializableValue': '-Infinity'}
+            if math.isnan(arg):
+                return {'unserializableValue': 'NaN'}
         if isinstance(arg, JSHandle):
             if arg._disposed:
                 raise RuntimeError('JSHandle has disposed')
@@ -90,9 +308,10 @@ class ExecutionContext(EventEmitter):
         assert not prototypeHandle._disposed, 'Prototype JSHandle is disposed!'
         assert prototypeHandle._remoteObject.get(OBID), 'Prototype JSHandle must not be referencing primitive value'
         response = await self._client.send('Runtime.queryObjects', {
-            'prototypeObjectId': prototypeHandle._remoteObject.get(OBID)
+            'prototypeObjectId': prototypeHandle._remoteObject.get(OBID),
+            'objectGroup': currentObjectGroup()
         })
-        return self._objectHandleFactory(self._contextId, response.get('objects'))
+        return self._objectHandleFactory(self._contextId, response.get(RESULT).get('objects'))
 
 
 class JSHandle(object):
@@ -103,6 +322,7 @@ class JSHandle(object):
         self._remoteObject = remoteObject
         self._disposed = False
         self._page = page
+        self._scope = None
 
     def executionContext(self):
         return self._context
@@ -124,17 +344,17 @@ class JSHandle(object):
             ownProperties=True
         ))
         result = {}
-        for property in response.get(RESULT):
-            if not property.enumerable:
+        for property in response.get(RESULT).get(RESULT):
+            if not property.get('enumerable'):
                 continue
-            result[property.name] = self._context._objectHandleFactory(self._context, property.value)
+            result[property.get('name')] = self._context._objectHandleFactory(self._context._contextId,
+                                                                              property.get('value'))
 
         return result
 
     async def jsonValue(self):
         if self._remoteObject.get(OBID):
-            jsonString = await self._context.evaluate(r'object => JSON.stringify(object)', self)
-            return json.loads(jsonString)
+            return await self._context.evaluate(r'object => object', self)
         return helper.valueFromRemoteObject(self._remoteObject)
 
     def asElement(self):
@@ -144,8 +364,27 @@ class JSHandle(object):
         if self._disposed:
             return None
         self._disposed = True
+        if self._scope and self._scope.active:
+            # released together with the object group of the scope
+            return None
         await helper.releaseObject(self._client, self._remoteObject)
 
+    @staticmethod
+    async def disposeAll(handles: list) -> None:
+        """
+        Dispose many handles, e.g. the elements of Frame.SS, with one pipelined batch per session
+        """
+        remoteObjects = {}
+        for handle in handles:
+            if handle._disposed:
+                continue
+            handle._disposed = True
+            if handle._scope and handle._scope.active:
+                continue
+            remoteObjects.setdefault(handle._client, []).append(handle._remoteObject)
+        for client, objects in remoteObjects.items():
+            await helper.releaseObjects(client, objects)
+
     def toString(self):
         if self._remoteObject.get(OBID):
             type = self._remoteObject.get('subtype') or self._remoteObject.get('type')
@@ -5,7 +5,7 @@ import logging
 from MBrowser.Const import *
 from MBrowser.ElementHandle import ElementHandle
 from MBrowser.EventEmitter import EventEmitter
-from MBrowser.ExecutionContext import ExecutionContext, JSHandle
+from MBrowser.ExecutionContext import ExecutionContext, JSHandle, currentHandleScope
 
 __all__ = ['FrameManager', 'Frame']
 
@@ -21,7 +21,9 @@ class FrameManager(EventEmitter):
         self._events = [Page_frameAttached,
                         Page_frameNavigated,
                         Page_frameDetached,
-                        Runtime_executionContextCreated]
+                        Runtime_executionContextCreated,
+                        Runtime_executionContextDestroyed,
+                        Runtime_executionContextsCleared]
         self.on(self._events, self._processEvent)
         self._mainFrame = None
 
@@ -43,6 +45,10 @@ class FrameManager(EventEmitter):
             self._onFrameDetached(event.frame.id)
         if event_name == Runtime_executionContextCreated:
             self._onExecutionContextCreated(event.get('context'))
+        if event_name == Runtime_executionContextDestroyed:
+            self._onExecutionContextDestroyed(event.get('executionContextId'))
+        if event_name == Runtime_executionContextsCleared:
+            self._onExecutionContextsCleared()
 
     def _onFrameAttached(self, frameId, parentFrameId):
         if self._frames.get(frameId):
@@ -92,8 +98,15 @@ class FrameManager(EventEmitter):
         for waitTask in frame._waitTasks:
             waitTask.rerun()
 
-    def _onExecutionContextDestroyed(self, contextPayload):
-        self._contextIdToContext.pop(contextPayload.get(ID))
+    def _onExecutionContextDestroyed(self, contextId):
+        context = self._contextIdToContext.pop(contextId, None)
+        if context:
+            context._invalidate()
+
+    def _onExecutionContextsCleared(self):
+        for context in self._contextIdToContext.values():
+            context._invalidate()
+        self._contextIdToContext.clear()
 
     def _removeFramesRecursively(self, frame):
         if frame == None:
@@ -108,11 +121,16 @@ class FrameManager(EventEmitter):
 
     def createJSHandle(self, contextId, remoteObject):
         context = self._contextIdToContext.get(contextId)
-        assert context, 'INTERNAL ERROR: missing context with id = ' + contextId
+        assert context, 'INTERNAL ERROR: missing context with id = {}'.format(contextId)
 
         if remoteObject and remoteObject.get('subtype') == 'node':
-            return ElementHandle(context, self._client, remoteObject, self._page)
-        return JSHandle(self._log, context, self._client, remoteObject, self._page)
+            handle = ElementHandle(context, self._client, remoteObject, self._page)
+        else:
+            handle = JSHandle(self._log, context, self._client, remoteObject, self._page)
+        scope = currentHandleScope()
+        if scope:
+            scope._track(handle)
+        return handle
 
 
 class Frame():
@@ -144,7 +162,7 @@ class Frame():
         self._log.debug('elementHanlder was {}'.format(elementHanlder))
         if elementHanlder:
             return elementHanlder
-        await elementHanlder.dispose()
+        await handle.dispose()
         return None
 
     async def eval(self, selector, pageFunction, *args):
@@ -157,6 +175,9 @@ class Frame():
         return result
 
     async def SS(self, selector):
+        """
+        :return: list of ElementHandle matching selector, dispose them together with JSHandle.disposeAll
+        """
         arrayHandle = await self._context.evaluateHandle(r'selector => Array.from(document.querySelectorAll(selector))',
                                                          selector)
 
@@ -167,16 +188,27 @@ class Frame():
         for property in properties.values():
             elementHandle = property.asElement()
             if elementHandle:
-                result.push(elementHandle)
+                result.append(elementHandle)
         return result
 
     async def Seval(self, selector, pageFunction, *args):
         arrayHandle = await  self._context.evaluateHandle(
-            r'selector= > Array.from(document.querySelectorAll(selector))', selector)
+            r'selector => Array.from(document.querySelectorAll(selector))', selector)
         result = await self.evaluate(pageFunction, arrayHandle, *args)
         await arrayHandle.dispose()
         return result
 
+    def SevalChunks(self, selector, pageFunction, *args, chunkSize: int = 100):
+        """
+        Async generator running pageFunction(element, *args) on the elements matching selector, chunkSize elements per
+        round trip, for results too large for one message
+        :return: async generator of lists
+        """
+        return self._context.evaluateChunks(r'selector => document.querySelectorAll(selector)', selector, *args,
+                                            mapFunction='(element, selector, ...args) => (' + pageFunction +
+                                                        ')(element, ...args)',
+                                            chunkSize=chunkSize)
+
     def name(self):
         return self._name if self._name else ''
 
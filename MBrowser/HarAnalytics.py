@@ -0,0 +1,413 @@
+# -*- coding: utf-8 -*-
+
+import logging
+from datetime import datetime
+from urllib.parse import urlsplit
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from MBrowser.HarIO import HarReader
+
+__all__ = ['HarTable']
+
+# entry fields kept as float columns, -1 (not applicable in HAR) is stored as nan
+NUMERIC = ('started', 'time', 'blocked', 'dns', 'connect', 'ssl', 'send', 'wait', 'receive', 'status', 'headersSize',
+           'bodySize', 'transferSize', 'contentSize')
+# entry fields kept as int codes into a label list
+CATEGORICAL = ('page', 'host', 'mimeType', 'type', 'method')
+TIMINGS = ('blocked', 'dns', 'connect', 'ssl', 'send', 'wait', 'receive')
+
+# resource type guessed from the mime type when the entry has no _resourceType
+_MIME_TYPES = (('document', ('text/html', 'application/xhtml')),
+               ('stylesheet', ('text/css',)),
+               ('script', ('javascript', 'ecmascript')),
+               ('image', ('image/',)),
+               ('font', ('font', 'woff')),
+               ('media', ('video/', 'audio/')),
+               ('xhr', ('json', 'xml', 'text/plain')))
+
+
+def _resourceType(mimeType: str) -> str:
+    for name, parts in _MIME_TYPES:
+        for part in parts:
+            if part in mimeType:
+                return name
+    return 'other'
+
+
+class _Labels(object):
+    """
+    Intern strings to int codes for one categorical column
+    """
+
+    def __init__(self, labels: list = None):
+        self.labels = list(labels or [])
+        self._codes = {label: code for code, label in enumerate(self.labels)}
+
+    def code(self, label) -> int:
+        code = self._codes.get(label)
+        if code == None:
+            code = len(self.labels)
+            self._codes[label] = code
+            self.labels.append(label)
+        return code
+
+
+class HarTable(object):
+    """
+    HAR entries stored as columns of numpy arrays, so percentiles, timing breakdowns and group-bys over millions of
+    entries run as a few vectorized passes instead of walking the nested entry dicts
+
+    numpy is optional for MBrowser, it is only needed by this module
+    """
+
+    def __init__(self, columns: dict, codes: dict, labels: dict, urls: list, parents):
+        """
+        Use fromHar, fromEntries, fromFiles or concat to build a table
+        :param columns: dict, {name: float64 array} for NUMERIC
+        :param codes: dict, {name: int32 array} for CATEGORICAL
+        :param labels: dict, {name: list of labels} for CATEGORICAL
+        :param urls: list of request urls
+        :param parents: int64 array, index of the initiator entry, -1 for none
+        """
+        if np == None:
+            raise ImportError('HarTable needs numpy, install it by pip install numpy')
+        self._columns = columns
+        self._codes = codes
+        self._labels = labels
+        self._urls = urls
+        self._parents = parents
+        self._log = logging.getLogger('HarAnalytics.HarTable')
+
+    ################################# build #####################################
+    @staticmethod
+    def fromHar(har: dict):
+        """
+        :param har: HAR dict, from HarParser.getHAR or json.load of a HAR file
+        :return: HarTable
+        """
+        return HarTable.fromEntries(har.get('log').get('entries'))
+
+    @staticmethod
+    def fromFiles(filenames: list):
+        """
+        :param filenames: list of HAR files
+        :return: HarTable of all their entries, page labels are prefixed by the file name
+        """
+        tables = []
+        for filename in filenames:
+            # the entries are streamed into the columns, the decoded file is never held in memory as a whole
+            with open(filename, encoding='utf-8') as fileHandler:
+                tables.append(HarTable.fromEntries(HarReader(fileHandler).entries(), pagePrefix=filename + ':'))
+        return HarTable.concat(tables)
+
+    @staticmethod
+    def fromEntries(entries: list, pagePrefix: str = ''):
+        """
+        :param entries: list or iterator of HAR entry dicts, read once
+        :param pagePrefix: prepended to the pageref labels, keeps pages of different files apart
+        :return: HarTable
+        """
+        if np == None:
+            raise ImportError('HarTable needs numpy, install it by pip install numpy')
+        values = {name: [] for name in NUMERIC}
+        labels = {name: _Labels() for name in CATEGORICAL}
+        codes = {name: [] for name in CATEGORICAL}
+        started = []
+        urls = []
+        initiators = []
+        for entry in entries:
+            request = entry.get('request') or {}
+            response = entry.get('response') or {}
+            content = response.get('content') or {}
+            timings = entry.get('timings') or {}
+            url = request.get('url') or ''
+            mimeType = (content.get('mimeType') or '').split(';')[0].strip().lower()
+
+            started.append(entry.get('startedDateTime'))
+            values['time'].append(entry.get('time'))
+            for name in TIMINGS:
+                values[name].append(timings.get(name))
+            values['status'].append(response.get('status'))
+            values['headersSize'].append(response.get('headersSize'))
+            values['bodySize'].append(response.get('bodySize'))
+            values['transferSize'].append(response.get('_transferSize'))
+            values['contentSize'].append(content.get('size'))
+
+            codes['page'].append(labels['page'].code(pagePrefix + str(entry.get('pageref') or '')))
+            codes['host'].append(labels['host'].code(urlsplit(url).netloc))
+            codes['mimeType'].append(labels['mimeType'].code(mimeType))
+            codes['type'].append(labels['type'].code(entry.get('_resourceType') or _resourceType(mimeType)))
+            codes['method'].append(labels['method'].code(request.get('method') or ''))
+            urls.append(url)
+            initiators.append((entry.get('initiator') or {}).get('url'))
+
+        columns = {name: HarTable._floatColumn(column) for name, column in values.items() if name != 'started'}
+        columns['started'] = HarTable._parseDates(started)
+        codes = {name: np.asarray(column, dtype=np.int32) for name, column in codes.items()}
+        parents = HarTable._linkInitiators(urls, initiators, codes['page'], columns['started'])
+        return HarTable(columns, codes, {name: label.labels for name, label in labels.items()}, urls, parents)
+
+    @staticmethod
+    def concat(tables: list):
+        """
+        :param tables: list of HarTable
+        :return: HarTable with the entries of all tables, categorical codes are remapped to one label list
+        """
+        if not tables:
+            return HarTable.fromEntries([])
+        labels = {name: _Labels() for name in CATEGORICAL}
+        codes = {name: [] for name in CATEGORICAL}
+        parents = []
+        offset = 0
+        for table in tables:
+            for name in CATEGORICAL:
+                mapping = np.asarray([labels[name].code(label) for label in table._labels[name]], dtype=np.int32)
+                codes[name].append(mapping[table._codes[name]] if len(mapping) else table._codes[name])
+            parents.append(np.where(table._parents >= 0, table._parents + offset, -1))
+            offset += len(table)
+        columns = {name: np.concatenate([table._columns[name] for table in tables]) for name in NUMERIC}
+        urls = [url for table in tables for url in table._urls]
+        return HarTable(columns, {name: np.concatenate(column) for name, column in codes.items()},
+                        {name: label.labels for name, label in labels.items()}, urls, np.concatenate(parents))
+
+    @staticmethod
+    def _floatColumn(values: list):
+        column = np.asarray([value if value != None else np.nan for value in values], dtype=np.float64)
+        column[column < 0] = np.nan
+        return column
+
+    @staticmethod
+    def _parseDates(values: list):
+        """
+        ISO dates to ms since epoch, vectorized by numpy for the UTC 'Z' dates HarParser writes
+        """
+        try:
+            dates = np.asarray([value[:-1] if value.endswith('Z') else value for value in values],
+                               dtype='datetime64[us]')
+            return dates.astype(np.int64) / 1000.0
+        except (ValueError, AttributeError, TypeError):
+            return np.asarray([datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp() * 1000
+                               if value else np.nan for value in values], dtype=np.float64)
+
+    @staticmethod
+    def _linkInitiators(urls: list, initiators: list, pages, started):
+        """
+        Index of the entry which initiated each entry, the first entry of the same page with the initiator url that
+        started no later, -1 for none
+        """
+        first = {}
+        for index, url in enumerate(urls):
+            first.setdefault((pages[index], url), index)
+        parents = np.full(len(urls), -1, dtype=np.int64)
+        for index, initiator in enumerate(initiators):
+            if not initiator:
+                continue
+            parent = first.get((pages[index], initiator), -1)
+            if parent != index and parent >= 0 and not started[parent] > started[index]:
+                parents[index] = parent
+        return parents
+
+    ################################# build #####################################
+
+    ################################# access ####################################
+    def __len__(self):
+        return len(self._urls)
+
+    def labels(self, name: str) -> list:
+        return list(self._labels[name])
+
+    def column(self, name: str):
+        """
+        :param name: one of NUMERIC, CATEGORICAL or 'url'
+        :return: float64 array for numeric columns, object array of labels otherwise
+        """
+        if name in self._columns:
+            return self._columns[name]
+        if name in self._codes:
+            return np.asarray(self._labels[name], dtype=object)[self._codes[name]]
+        if name == 'url':
+            return np.asarray(self._urls, dtype=object)
+        raise KeyError('no column {}'.format(name))
+
+    def mask(self, **conditions):
+        """
+        :param conditions: categorical column=label or column=list of labels, numeric column=(min, max)
+        :return: bool array of the entries matching all conditions
+        """
+        mask = np.ones(len(self), dtype=bool)
+        for name, condition in conditions.items():
+            if name in self._codes:
+                wanted = condition if isinstance(condition, (list, tuple, set)) else [condition]
+                mask &= np.isin(self._codes[name], [self._labelCode(name, label) for label in wanted])
+            else:
+                (low, high) = condition
+                column = self._columns[name]
+                mask &= (column >= low) & (column <= high)
+        return mask
+
+    def select(self, mask):
+        """
+        :param mask: bool array or index array
+        :return: HarTable with the selected entries, initiator links outside the selection are dropped
+        """
+        index = np.flatnonzero(mask) if np.asarray(mask).dtype == bool else np.asarray(mask, dtype=np.int64)
+        remap = np.full(len(self), -1, dtype=np.int64)
+        remap[index] = np.arange(len(index))
+        parents = self._parents[index]
+        parents = np.where(parents >= 0, remap[np.maximum(parents, 0)], -1)
+        return HarTable({name: column[index] for name, column in self._columns.items()},
+                        {name: codes[index] for name, codes in self._codes.items()},
+                        dict(self._labels), [self._urls[i] for i in index], parents)
+
+    def where(self, **conditions):
+        return self.select(self.mask(**conditions))
+
+    def _labelCode(self, name, label):
+        try:
+            return self._labels[name].index(label)
+        except ValueError:
+            return -1
+
+    ################################# access ####################################
+
+    ################################# aggregate #################################
+    def percentiles(self, name: str = 'time', q: tuple = (50, 90, 95, 99)) -> dict:
+        """
+        :param name: numeric column
+        :param q: percentiles to compute
+        :return: dict, {q: value}, nan values are ignored
+        """
+        column = self._columns[name]
+        column = column[~np.isnan(column)]
+        if not len(column):
+            return {p: None for p in q}
+        return dict(zip(q, np.percentile(column, q).tolist()))
+
+    def timingBreakdown(self, by: str = None) -> dict:
+        """
+        Mean of each timing phase, phases which do not apply to an entry (-1) are not counted
+        :param by: categorical column to group by, default None for all entries
+        :return: {phase: mean} or {label: {phase: mean}}
+        """
+        if by == None:
+            return {name: self._nanMean(self._columns[name]) for name in TIMINGS}
+        result = {label: {} for label in self._labels[by]}
+        for name in TIMINGS:
+            (sums, counts) = self._groupSums(by, self._columns[name])
+            means = np.divide(sums, counts, out=np.full(len(sums), np.nan), where=counts > 0)
+            for label, mean in zip(self._labels[by], means.tolist()):
+                result[label][name] = None if mean != mean else mean
+        return result
+
+    def bytesBy(self, by: str = 'mimeType', name: str = 'transferSize') -> dict:
+        """
+        :param by: categorical column, e.g. 'mimeType', 'host', 'type', 'page'
+        :param name: size column, 'transferSize', 'bodySize', 'contentSize' or 'headersSize'
+        :return: dict, {label: bytes}, largest first
+        """
+        (sums, _) = self._groupSums(by, self._columns[name])
+        order = np.argsort(-sums, kind='stable')
+        return {self._labels[by][i]: float(sums[i]) for i in order.tolist()}
+
+    def groupBy(self, by: str, name: str = 'time', q: tuple = (50, 95)) -> dict:
+        """
+        Count, sum, mean, min, max and percentiles of a numeric column for each label of a categorical column, all
+        groups are computed together from one sort
+        :param by: categorical column
+        :param name: numeric column
+        :param q: percentiles to compute
+        :return: dict, {label: {'count':, 'sum':, 'mean':, 'min':, 'max':, 'p50':, ...}}
+        """
+        codes = self._codes[by]
+        values = self._columns[name]
+        keep = ~np.isnan(values)
+        codes = codes[keep]
+        values = values[keep]
+        order = np.lexsort((values, codes))
+        codes = codes[order]
+        values = values[order]
+
+        groups = len(self._labels[by])
+        counts = np.bincount(codes, minlength=groups)
+        sums = np.bincount(codes, weights=values, minlength=groups)
+        starts = np.cumsum(counts) - counts
+        nonEmpty = counts > 0
+        last = np.where(nonEmpty, starts + counts - 1, 0)
+        first = np.where(nonEmpty, starts, 0)
+
+        stats = dict(count=counts.astype(np.float64), sum=sums,
+                     mean=np.divide(sums, counts, out=np.full(groups, np.nan), where=nonEmpty))
+        if len(values):
+            stats['min'] = np.where(nonEmpty, values[first], np.nan)
+            stats['max'] = np.where(nonEmpty, values[last], np.nan)
+            for p in q:
+                position = starts + (counts - 1) * (p / 100.0)
+                low = np.where(nonEmpty, np.floor(position), 0).astype(np.int64)
+                high = np.where(nonEmpty, np.ceil(position), 0).astype(np.int64)
+                fraction = position - np.floor(position)
+                stats['p{}'.format(p)] = np.where(nonEmpty,
+                                                  values[low] + (values[high] - values[low]) * fraction, np.nan)
+        else:
+            for key in ['min', 'max'] + ['p{}'.format(p) for p in q]:
+                stats[key] = np.full(groups, np.nan)
+
+        result = {}
+        for index, label in enumerate(self._labels[by]):
+            if not nonEmpty[index]:
+                continue
+            result[label] = {key: float(stat[index]) for key, stat in stats.items()}
+            result[label]['count'] = int(counts[index])
+        return result
+
+    def criticalPath(self, page: str = None) -> list:
+        """
+        The waterfall chain which ends last: start from the entry finishing last and follow the initiators back
+        to the root request
+        :param page: page label, default None for every page
+        :return: list of dict(url, started, end, time), root first, started and end in ms since the page start,
+                 or {page: list} when page is None
+        """
+        if page == None:
+            return {self._labels['page'][code]: self.criticalPath(self._labels['page'][code])
+                    for code in np.unique(self._codes['page']).tolist()}
+        index = np.flatnonzero(self._codes['page'] == self._labelCode('page', page))
+        if not len(index):
+            return []
+        started = self._columns['started']
+        ends = started[index] + np.nan_to_num(self._columns['time'][index])
+        # no entry of the page has a start time, there is no waterfall to follow
+        if np.isnan(ends).all():
+            return []
+        pageStart = np.nanmin(started[index])
+
+        path = []
+        seen = set()
+        current = int(index[int(np.nanargmax(ends))])
+        while current >= 0 and current not in seen:
+            seen.add(current)
+            time = self._columns['time'][current]
+            path.append(dict(url=self._urls[current],
+                             started=float(started[current] - pageStart),
+                             end=float(started[current] - pageStart + np.nan_to_num(time)),
+                             time=None if time != time else float(time)))
+            current = int(self._parents[current])
+        path.reverse()
+        return path
+
+    def _groupSums(self, by: str, values):
+        codes = self._codes[by]
+        keep = ~np.isnan(values)
+        groups = len(self._labels[by])
+        sums = np.bincount(codes[keep], weights=values[keep], minlength=groups)
+        counts = np.bincount(codes[keep], minlength=groups)
+        return (sums, counts)
+
+    def _nanMean(self, values):
+        values = values[~np.isnan(values)]
+        return float(values.mean()) if len(values) else None
+
+    ################################# aggregate #################################
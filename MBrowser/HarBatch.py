@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+
+"""
+Summarize a batch of HAR files in a process pool and write one report
+
+    python -m MBrowser.HarBatch /data/hars/2018-07-01 'other/*.har' -o report.csv -j 8
+
+each file is read as a stream, entries are decoded one by one so a HAR is never loaded whole, the numbers are the
+ones HarParser writes: timings from computeTimings where -1 means the phase does not apply, sizes from
+computePayload where -1 means unknown
+"""
+
+import argparse
+import csv
+import glob
+import json
+import logging
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from MBrowser.HarIO import HarReader
+
+__all__ = ['HarSummary', 'expandInputs', 'summarizeFile', 'runBatch', 'writeReport', 'main']
+
+# the phases computeTimings writes, ssl is also counted inside connect
+PHASES = ('blocked', 'dns', 'connect', 'ssl', 'send', 'wait', 'receive')
+SIZES = ('headersSize', 'bodySize', '_transferSize')
+
+# entry times are bucketed by powers of HIST_BASE, so summaries of different files merge into approximate percentiles
+HIST_BASE = 1.05
+
+
+class HarSummary(object):
+    """
+    Counters of one HAR file or of a merged batch, picklable so workers can return it
+    """
+
+    def __init__(self, name: str = ''):
+        self.name = name
+        self.files = 0
+        self.pages = 0
+        self.entries = 0
+        self.failed = 0
+        self.errors = 0
+        self.time = 0.0
+        self.timeCount = 0
+        self.onLoad = 0.0
+        self.onLoadCount = 0
+        self.phaseSums = dict.fromkeys(PHASES, 0.0)
+        self.phaseCounts = dict.fromkeys(PHASES, 0)
+        self.sizeSums = dict.fromkeys(SIZES, 0)
+        self.histogram = {}
+        self.error = ''
+
+    def addPage(self, page: dict) -> None:
+        self.pages += 1
+        onLoad = (page.get('pageTimings') or {}).get('onLoad')
+        if onLoad != None and onLoad >= 0:
+            self.onLoad += onLoad
+            self.onLoadCount += 1
+
+    def addEntry(self, entry: dict) -> None:
+        self.entries += 1
+        response = entry.get('response') or {}
+        status = response.get('status') or 0
+        if status == 0 or status >= 400:
+            self.failed += 1
+        time = entry.get('time')
+        if time != None and time >= 0:
+            self.time += time
+            self.timeCount += 1
+            bucket = int(math.log(time + 1, HIST_BASE))
+            self.histogram[bucket] = self.histogram.get(bucket, 0) + 1
+        timings = entry.get('timings') or {}
+        for phase in PHASES:
+            value = timings.get(phase)
+            if value != None and value >= 0:
+                self.phaseSums[phase] += value
+                self.phaseCounts[phase] += 1
+        for size in SIZES:
+            value = response.get(size)
+            if value != None and value >= 0:
+                self.sizeSums[size] += value
+
+    def merge(self, other) -> None:
+        self.files += other.files
+        self.pages += other.pages
+        self.entries += other.entries
+        self.failed += other.failed
+        self.errors += other.errors
+        self.time += other.time
+        self.timeCount += other.timeCount
+        self.onLoad += other.onLoad
+        self.onLoadCount += other.onLoadCount
+        for phase in PHASES:
+            self.phaseSums[phase] += other.phaseSums[phase]
+            self.phaseCounts[phase] += other.phaseCounts[phase]
+        for size in SIZES:
+            self.sizeSums[size] += other.sizeSums[size]
+        for bucket, count in other.histogram.items():
+            self.histogram[bucket] = self.histogram.get(bucket, 0) + count
+
+    def percentile(self, q: float):
+        """
+        Approximate entry time percentile from the histogram, within HIST_BASE of the exact value
+        """
+        total = sum(self.histogram.values())
+        if not total:
+            return None
+        rank = q / 100.0 * total
+        seen = 0
+        for bucket in sorted(self.histogram):
+            seen += self.histogram[bucket]
+            if seen >= rank:
+                return HIST_BASE ** (bucket + 0.5) - 1
+        return None
+
+    def row(self) -> dict:
+        row = dict(name=self.name, files=self.files, pages=self.pages, entries=self.entries, failed=self.failed,
+                   errors=self.errors, transferBytes=self.sizeSums['_transferSize'],
+                   bodyBytes=self.sizeSums['bodySize'], headersBytes=self.sizeSums['headersSize'],
+                   timeMean=self.time / self.timeCount if self.timeCount else None,
+                   timeP50=self.percentile(50), timeP95=self.percentile(95),
+                   onLoadMean=self.onLoad / self.onLoadCount if self.onLoadCount else None)
+        for phase in PHASES:
+            row[phase + 'Mean'] = self.phaseSums[phase] / self.phaseCounts[phase] if self.phaseCounts[phase] else None
+        row['error'] = self.error
+        return row
+
+
+def summarizeFile(filename: str) -> HarSummary:
+    """
+    Summarize one HAR file, run in the worker processes, a broken file gives a summary with error set
+    """
+    summary = HarSummary(filename)
+    try:
+        with open(filename, encoding='utf-8') as fileHandler:
+            reader = HarReader(fileHandler)
+            for entry in reader.entries():
+                summary.addEntry(entry)
+        for page in reader.meta.get('pages') or []:
+            summary.addPage(page)
+    except Exception as e:
+        # a partly read file is not counted, a malformed entry (KeyError, TypeError...) fails its file only
+        summary = HarSummary(filename)
+        summary.errors = 1
+        summary.error = '{}: {}'.format(type(e).__name__, e)
+    summary.files = 1
+    return summary
+
+
+def expandInputs(inputs: list) -> list:
+    """
+    :param inputs: list of HAR files, directories (searched recursively for *.har) and glob patterns
+    :return: sorted list of files
+    """
+    files = set()
+    for path in inputs:
+        if os.path.isdir(path):
+            files.update(glob.glob(os.path.join(path, '**', '*.har'), recursive=True))
+        elif os.path.isfile(path):
+            files.add(path)
+        else:
+            files.update(name for name in glob.glob(path, recursive=True) if os.path.isfile(name))
+    return sorted(files)
+
+
+def runBatch(files: list, jobs: int = None) -> tuple:
+    """
+    :param files: list of HAR files
+    :param jobs: worker processes, default os.cpu_count()
+    :return: (list of per file HarSummary in files order, merged HarSummary)
+    """
+    log = logging.getLogger('HarBatch.runBatch')
+    total = HarSummary('total')
+    summaries = {}
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(summarizeFile, filename): filename for filename in files}
+        for done, future in enumerate(as_completed(futures), 1):
+            summary = future.result()
+            summaries[futures[future]] = summary
+            total.merge(summary)
+            if summary.error:
+                log.warning('{} failed: {}'.format(summary.name, summary.error))
+            if done % 100 == 0:
+                log.info('{}/{} files done'.format(done, len(files)))
+    return ([summaries[filename] for filename in files], total)
+
+
+def writeReport(filename: str, summaries: list, total: HarSummary, format: str = None) -> None:
+    """
+    :param format: 'csv' or 'json', default from the file extension
+    """
+    format = format or ('csv' if filename.lower().endswith('.csv') else 'json')
+    rows = [summary.row() for summary in summaries]
+    if format == 'csv':
+        with open(filename, 'w', newline='', encoding='utf-8') as fileHandler:
+            writer = csv.DictWriter(fileHandler, fieldnames=list(total.row().keys()))
+            writer.writeheader()
+            writer.writerows(rows)
+            writer.writerow(total.row())
+    else:
+        with open(filename, 'w', encoding='utf-8') as fileHandler:
+            json.dump(dict(total=total.row(), files=rows), fileHandler, indent=4)
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(description='Summarize HAR files in parallel into one CSV or JSON report')
+    parser.add_argument('inputs', nargs='+', help='HAR files, directories or glob patterns')
+    parser.add_argument('-o', '--output', default='har_report.json', help='report file, .csv or .json')
+    parser.add_argument('-f', '--format', choices=['csv', 'json'], help='report format, default from --output')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='worker processes, default cpu count')
+    args = parser.parse_args(argv)
+
+    log = logging.getLogger('HarBatch.main')
+    files = expandInputs(args.inputs)
+    if not files:
+        log.error('no HAR file found in {}'.format(args.inputs))
+        return 1
+    log.info('summarize {} HAR files'.format(len(files)))
+    (summaries, total) = runBatch(files, args.jobs)
+    writeReport(args.output, summaries, total, args.format)
+    log.info('{} files, {} pages, {} entries, {} errors, report written to {}'.format(
+        total.files, total.pages, total.entries, total.errors, args.output))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+__all__ = ['HarReader']
+
+CHUNK_SIZE = 1 << 16
+
+
+class HarReader(object):
+    """
+    Decode a HAR file incrementally, entries are yielded one at a time, the other members of log (pages, creator,
+    version) are kept in meta whether they come before or after the entries
+    """
+
+    def __init__(self, filehandler, chunkSize: int = CHUNK_SIZE):
+        self._file = filehandler
+        self._chunkSize = chunkSize
+        self._decoder = json.JSONDecoder()
+        self._buffer = ''
+        self._pos = 0
+        self._eof = False
+        self.meta = {}
+
+    def entries(self):
+        self._expect('{')
+        for key in self._members():
+            if key != 'log':
+                self._value()
+                continue
+            self._expect('{')
+            for logKey in self._members():
+                if logKey != 'entries':
+                    self.meta[logKey] = self._value()
+                    continue
+                self._expect('[')
+                if self._peek() == ']':
+                    self._pos += 1
+                    continue
+                while True:
+                    yield self._value()
+                    if self._next(',]') == ']':
+                        break
+
+    def _members(self):
+        if self._peek() == '}':
+            self._pos += 1
+            return
+        while True:
+            key = self._value()
+            self._expect(':')
+            yield key
+            if self._next(',}') == '}':
+                return
+
+    def _fill(self, size: int = None) -> bool:
+        if self._eof:
+            return False
+        chunk = self._file.read(size or self._chunkSize)
+        if not chunk:
+            self._eof = True
+            return False
+        self._buffer = self._buffer[self._pos:] + chunk
+        self._pos = 0
+        return True
+
+    def _peek(self) -> str:
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos].isspace():
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                raise ValueError('unexpected end of HAR')
+
+    def _next(self, chars: str) -> str:
+        char = self._peek()
+        if char not in chars:
+            raise ValueError('expect one of {} but got {} in HAR'.format(chars, char))
+        self._pos += 1
+        return char
+
+    def _expect(self, char: str) -> None:
+        self._next(char)
+
+    def _value(self):
+        self._peek()
+        while True:
+            try:
+                (value, end) = self._decoder.raw_decode(self._buffer, self._pos)
+                # a number at the end of the buffer may continue in the next chunk
+                if end < len(self._buffer) or self._eof:
+                    self._pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+            # grow the reads so a large entry is not decoded again for every chunk
+            self._fill(max(self._chunkSize, len(self._buffer) - self._pos))
@@ -4,90 +4,176 @@ import asyncio
 import json
 import logging
 import re
-import urllib
+import urllib.parse
+from collections import namedtuple
 from datetime import datetime
 
+from MBrowser import EventLoop, helper
+from MBrowser.BodyCapture import BodyCapture, BodyCapturePolicy
 from MBrowser.Const import *
 from MBrowser.EventEmitter import EventEmitter
 
+__all__ = ['HarEntry', 'HarHandler', 'HarParser', 'HarWriter']
+
+HAR_CREATOR = {'name': 'Chrome HAR Capturer', 'version': '537.36'}
+
+
+HarTiming = namedtuple('HarTiming', ['requestTime', 'dnsStart', 'connectStart', 'sslStart', 'sslEnd', 'sendStart',
+                                     'sendEnd', 'receiveHeadersEnd'])
+
+
+class HarEntry(object):
+    """
+    Compact record of one request, built from the CDP events when they arrive and keeping only the fields
+    HarParser.parseEntry reads, the raw events are not kept
+    """
+    __slots__ = ('url', 'method', 'requestHeaders', 'wallTime', 'initiatorType', 'initiatorUrl', 'priority',
+                 'newPriority', 'status', 'statusText', 'protocol', 'responseHeaders', 'headersText', 'timing',
+                 'remoteIPAddress', 'connectionId', 'mimeType', 'responseLength', 'encodedResponseLength',
+                 'responseFinishedS', 'responseBody', 'responseBodyIsBase64', 'responseBodyFile', 'hasResponse',
+                 'pageref', 'postData', 'incomplete')
+
+    def __init__(self, event: dict, pageref: str):
+        """
+        :param event: params of Network.requestWillBeSent
+        :param pageref: id of the harinfo page the request belongs to
+        """
+        self.pageref = pageref
+        request = event.get('request')
+        initiator = event.get('initiator') or {}
+        self.url = request.get('url')
+        self.method = request.get('method')
+        self.requestHeaders = request.get('headers') or {}
+        self.postData = request.get('postData')
+        self.wallTime = event.get('wallTime')
+        self.initiatorType = initiator.get('type')
+        self.initiatorUrl = initiator.get('url')
+        self.priority = request.get('initialPriority')
+        self.newPriority = None
+        self.status = None
+        self.statusText = None
+        self.protocol = None
+        self.responseHeaders = None
+        self.headersText = None
+        self.timing = None
+        self.remoteIPAddress = None
+        self.connectionId = None
+        self.mimeType = None
+        self.responseLength = 0
+        self.encodedResponseLength = None
+        self.responseFinishedS = None
+        self.responseBody = ''
+        self.responseBodyIsBase64 = None
+        self.responseBodyFile = None
+        self.hasResponse = False
+        # still in flight when the HAR was written
+        self.incomplete = False
+
+    def setResponse(self, response: dict) -> None:
+        """
+        :param response: Network.Response of responseReceived or of a redirect
+        """
+        self.hasResponse = True
+        self.status = response.get('status')
+        self.statusText = response.get('statusText')
+        self.protocol = response.get('protocol')
+        self.responseHeaders = response.get('headers') or {}
+        if response.get('requestHeaders'):
+            self.requestHeaders = response.get('requestHeaders')
+        self.headersText = response.get('headersText')
+        timing = response.get('timing')
+        self.timing = HarTiming(*[timing.get(name, -1) for name in HarTiming._fields]) if timing else None
+        self.remoteIPAddress = response.get('remoteIPAddress')
+        self.connectionId = response.get('connectionId')
+        self.mimeType = response.get('mimeType')
 
-class harinfo(object):
-    def __init__(self):
-        self._url = ''
-        self._user = ''
-        self._firstRequestId = None
-        self._firstRequestMs = None
-        self._domContentEventFiredMs = None
-        self._loadEventFiredMs = None
-        self._entries = {}
-        pass
-
-    @property
-    def url(self):
-        return self._url
-
-    @url.setter
-    def url(self, url):
-        self._url = url
-
-    @property
-    def user(self):
-        return self._user
-
-    @url.setter
-    def user(self, user):
-        self._user = user
-
-    @property
-    def firstRequestId(self):
-        return self._firstRequestId
-
-    @firstRequestId.setter
-    def firstRequestId(self, firstRequestId):
-        self._firstRequestId = firstRequestId
-
-    @property
-    def firstRequestMs(self):
-        return self._firstRequestMs
-
-    @firstRequestMs.setter
-    def firstRequestMs(self, firstRequestMs):
-        self._firstRequestMs = firstRequestMs
-
-    @property
-    def domContentEventFiredMs(self):
-        return self._domContentEventFiredMs
 
-    @domContentEventFiredMs.setter
-    def domContentEventFiredMs(self, domContentEventFiredMs):
-        self._domContentEventFiredMs = domContentEventFiredMs
+class harinfo(object):
+    """
+    One HAR page, opened by a main frame navigation and identified by its loaderId
+    """
+    __slots__ = ('id', 'loaderId', 'frameId', 'url', 'user', 'firstRequestId', 'firstRequestMs',
+                 'firstRequestWallTime', 'domContentEventFiredMs', 'loadEventFiredMs')
+
+    def __init__(self, id: str = 'page_1', loaderId: str = None, frameId: str = None):
+        self.id = id
+        self.loaderId = loaderId
+        self.frameId = frameId
+        self.url = ''
+        self.user = ''
+        self.firstRequestId = None
+        self.firstRequestMs = None
+        self.firstRequestWallTime = None
+        self.domContentEventFiredMs = None
+        self.loadEventFiredMs = None
+
+
+class HarWriter(object):
+    """
+    Write a HAR file incrementally, each entry is serialized as soon as it completes so the whole log never has to be
+    kept in memory, the pages are written by close() once their timings are known
+    """
+
+    def __init__(self, filehandler, compact: bool = True):
+        """
+        :param filehandler: text file object, closed by close()
+        :param compact: no indent and no spaces between tokens, default True
+        """
+        self._file = filehandler
+        self._dumpArgs = dict(separators=(',', ':')) if compact else dict(indent=4)
+        self._count = 0
+        self._file.write('{"log":{"version":"1.2","creator":' +
+                         json.dumps(HAR_CREATOR, **self._dumpArgs) + ',"entries":[')
 
     @property
-    def loadEventFiredMs(self):
-        return self._loadEventFiredMs
+    def count(self):
+        return self._count
 
-    @loadEventFiredMs.setter
-    def loadEventFiredMs(self, loadEventFiredMs):
-        self._loadEventFiredMs = loadEventFiredMs
+    def writeEntry(self, entry: dict) -> None:
+        if self._count:
+            self._file.write(',')
+        self._file.write('\n')
+        self._file.write(json.dumps(entry, **self._dumpArgs))
+        self._count += 1
 
-    @property
-    def entries(self):
-        return self._entries
-
-    @entries.setter
-    def entries(self, entries):
-        self._entries = entries
+    def close(self, pages: list) -> None:
+        self._file.write('\n],"pages":')
+        self._file.write(json.dumps(pages, **self._dumpArgs))
+        self._file.write('}}\n')
+        self._file.close()
 
 
 class HarHandler(EventEmitter):
-    def __init__(self):
-        self._harinfo = harinfo()
+    def __init__(self, writer: HarWriter = None, bodyPolicy: BodyCapturePolicy = None):
+        """
+        Record every main frame navigation of a session as its own HAR page, entries are attached to the page of
+        their loaderId, so one recording covers a whole multi step flow
+
+        :param writer: HarWriter, stream each entry to it once complete and drop it from memory, default None to
+                       keep all entries until getHar
+        :param bodyPolicy: BodyCapturePolicy, which response bodies are fetched and how, default BodyCapturePolicy()
+        """
+        self._pages = []
+        self._pagesByLoader = {}
+        self._entries = {}
+        self._childFrames = set()
+        # DOMContentLoaded and load of each navigation come keyed by loaderId once lifecycle events arrive
+        self._lifecycle = False
+        self._seeding = None
+        self._writer = writer
+        self._bodyPolicy = bodyPolicy
+        self._bodyCapture = None
+        self._parser = HarParser()
         self._stopMsg = False
         self._log = logging.getLogger('HarHandler.HarHandler')
         self._client = None
+        self._inflight = set()
         self._events = [Network_loadingFinished,
                         Page_domContentEventFired,
                         Page_loadEventFired,
+                        Page_lifecycleEvent,
+                        Page_frameAttached,
+                        Page_frameDetached,
                         Network_requestWillBeSent,
                         Network_dataReceived,
                         Network_responseReceived,
@@ -96,87 +182,217 @@ class HarHandler(EventEmitter):
                         Network_loadingFailed]
         pass
 
-    async def getHar(self, filehandler):
+    @property
+    def pages(self) -> list:
+        return list(self._pages)
+
+    async def getHar(self, filehandler, timeout: int = TIMEOUT_S, compact: bool = False):
         if self._client == None:
             return None
-        await self._checkFinsh()
-        har = await HarParser().getHAR(self._harinfo)
-        json.dump(har, filehandler, indent=4)
+        await self._waitForDone(timeout)
+        har = await self._parser.getHAR(self._pages, self._entries)
+        json.dump(har, filehandler, **(dict(separators=(',', ':')) if compact else dict(indent=4)))
+
+    def streaming(self) -> bool:
+        return self._writer != None
+
+    async def finish(self, timeout: int = TIMEOUT_S):
+        """
+        Wait for the last page and the pending entries to complete, then write the pages and close the HarWriter
+        """
+        if self._client == None or self._writer == None:
+            return None
+        try:
+            await self._waitForDone(timeout)
+            for requestId in list(self._entries.keys()):
+                self._writeEntry(requestId)
+        finally:
+            # close the file even when the wait failed, the entries streamed so far stay readable
+            self._writer.close([self._parser.parsePageInfo(page) for page in self._pages])
+        self._log.info('{} pages, {} entries written'.format(len(self._pages), self._writer.count))
+
+    async def _waitForDone(self, timeout: int = TIMEOUT_S):
+        """
+        Wait for the load of the last page and for network idle, pages which never get there (long polling, beacons,
+        websockets) are written anyway, the requests still in flight as incomplete entries
+        """
+        try:
+            await self._checkFinsh(timeout)
+        except TimeoutError as e:
+            self._log.warning('last page not loaded, write the har anyway: {}'.format(e))
+        if not await self._waitForNetworkIdle(timeout=timeout):
+            self._log.warning('network not idle after {}s, {} requests in flight written as incomplete'.format(
+                timeout, len(self._inflight)))
+            self._markIncomplete()
+        if self._bodyCapture:
+            await self._bodyCapture.join()
+
+    def _markIncomplete(self):
+        for requestId in self._inflight:
+            entry = self._entries.get(requestId)
+            if entry != None:
+                entry.incomplete = True
 
     def start(self, client):
         self._client = client
+        self._bodyCapture = BodyCapture(client, self._onBody, self._bodyPolicy)
+        self._bodyCapture.start()
         self.on(self._events, self._processEvents)
+        self._seeding = EventLoop.create_task(self._seedFrames())
+
+    async def _seedFrames(self):
+        """
+        Learn the child frames attached before the recording started, their navigations must not open pages, and
+        turn the lifecycle events on so the page timings of each navigation are known by its loaderId
+        """
+        (tree, _) = await self._client.sendMany([('Page.getFrameTree', {}),
+                                                 ('Page.setLifecycleEventsEnabled', dict(enabled=True))])
+        frameTree = tree.get(RESULT, {}).get('frameTree') if isinstance(tree, dict) else None
+        if not frameTree:
+            self._log.warning('get frame tree failed: {}'.format(tree))
+            return
+        children = list(frameTree.get('childFrames') or [])
+        while children:
+            child = children.pop()
+            self._childFrames.add(child.get('frame').get('id'))
+            children.extend(child.get('childFrames') or [])
 
     def stop(self):
-        if self._client == None:
-            self._client.removeAllEvents(self._events)
-
-    async def _processEvents(self, *arg, **kargs):
-        if self._harinfo != None and not self._stopMsg:
+        if self._seeding != None:
+            self._seeding.cancel()
+            self._seeding = None
+        if self._client != None:
+            self.removeEvents(self._events, self._processEvents)
+            self._bodyCapture.stop()
+            self._log.info('body capture: {}'.format(self._bodyCapture.stats()))
+
+    def abort(self):
+        """
+        Stop recording without waiting for the pending entries, a streamed HAR file is closed with the entries and
+        pages written so far, so it stays valid
+        """
+        writer = self._writer
+        self._writer = None
+        try:
+            self.stop()
+        finally:
+            if writer != None:
+                # a page cut before its first request has no start to write
+                writer.close([self._parser.parsePageInfo(page) for page in self._pages
+                              if page.firstRequestWallTime != None])
+                self._log.info('recording aborted, {} entries written'.format(writer.count))
+
+    def _currentPage(self):
+        return self._pages[-1] if self._pages else None
+
+    def _openPage(self, loaderId, frameId):
+        page = harinfo('page_{}'.format(len(self._pages) + 1), loaderId, frameId)
+        self._pages.append(page)
+        if loaderId:
+            self._pagesByLoader[loaderId] = page
+        self._log.debug('open {} for loader {} frame {}'.format(page.id, loaderId, frameId))
+        return page
+
+    def _pageOf(self, event):
+        """
+        Find the page of a request, a main frame navigation opens a new page, the other requests belong to the page
+        of their loader, or to the current page when the loader is not a main frame one
+        """
+        loaderId = event.get('loaderId')
+        frameId = event.get('frameId')
+        page = self._pagesByLoader.get(loaderId)
+        if page != None:
+            return page
+        isNavigation = event.get(RID) == loaderId and event.get('type') == 'Document'
+        if isNavigation and frameId not in self._childFrames:
+            return self._openPage(loaderId, frameId)
+        return self._currentPage() or self._openPage(None, frameId)
+
+    def _processEvents(self, *arg, **kargs):
+        if not self._stopMsg:
             (event_name, event) = arg
 
+            if event_name == Page_lifecycleEvent:
+                self._lifecycle = True
+                page = self._pagesByLoader.get(event.get('loaderId'))
+                if page == None and self._currentPage() != None and self._currentPage().loaderId == None:
+                    # the page opened without a navigation request when the recording started mid-load
+                    page = self._currentPage()
+                if page == None or page.frameId != event.get('frameId'):
+                    return
+                if event.get('name') == 'DOMContentLoaded':
+                    page.domContentEventFiredMs = event.get('timestamp') * 1000
+                elif event.get('name') == 'load':
+                    page.loadEventFiredMs = event.get('timestamp') * 1000
+                return
+            # without lifecycle events the timings can only go to the latest page
             if event_name == Page_domContentEventFired:
-                self._harinfo.domContentEventFiredMs = event.get('timestamp') * 1000
+                page = self._currentPage()
+                if page != None and not self._lifecycle:
+                    page.domContentEventFiredMs = event.get('timestamp') * 1000
                 return
             if event_name == Page_loadEventFired:
-                self._harinfo.loadEventFiredMs = event.get('timestamp') * 1000
+                page = self._currentPage()
+                if page != None and not self._lifecycle:
+                    page.loadEventFiredMs = event.get('timestamp') * 1000
+                return
+            if event_name == Page_frameAttached:
+                self._childFrames.add(event.get('frameId'))
+                return
+            if event_name == Page_frameDetached:
+                self._childFrames.discard(event.get('frameId'))
                 return
             if event_name == Network_requestWillBeSent:
 
                 requestId = event.get(RID)
-                initiator = event.get('initiator')
                 timestamp = event.get('timestamp')
                 redirectResponse = event.get('redirectResponse')
 
                 if event.get('request').get('url').startswith('data'):
                     return
-                if self._harinfo.entries.get(requestId) != None:
-                    return
-                if not self._harinfo.firstRequestId and initiator.get('type') == 'other':
-                    self._harinfo.firstRequestId = requestId
-                    self._harinfo.firstRequestMs = timestamp * 1000
 
                 if redirectResponse:
-                    redirectEntry = self._harinfo.entries.get(requestId)
-                    if not redirectEntry:
-                        redirectEntry = {}
-                    redirectEntry['responseParams'] = {'response': redirectResponse}
-                    redirectEntry['responseFinishedS'] = timestamp
-                    redirectEntry['encodedResponseLength'] = redirectResponse.encodedDataLength
-                    newId = str(requestId) + '_redirect_' + str(timestamp)
-                    self._harinfo.entries[newId] = redirectEntry
-
-                self._log.debug('new entry with id {}'.format(requestId))
-
-                self._harinfo.entries[requestId] = {
-                    REQPARAM: event,
-                    RESPPRAM: None,
-                    'responseLength': 0,
-                    'encodedResponseLength': None,
-                    'responseFinishedS': None,
-                    'responseBody': '',
-                    'responseBodyIsBase64': None,
-                    'newPriority': None
-                }
+                    redirectEntry = self._entries.pop(requestId, None)
+                    if redirectEntry:
+                        redirectEntry.setResponse(redirectResponse)
+                        redirectEntry.responseFinishedS = timestamp
+                        redirectEntry.encodedResponseLength = redirectResponse.get('encodedDataLength')
+                        newId = str(requestId) + '_redirect_' + str(timestamp)
+                        self._entries[newId] = redirectEntry
+                        if self._writer:
+                            self._writeEntry(newId)
+
+                page = self._pageOf(event)
+                if not page.firstRequestId:
+                    page.firstRequestId = requestId
+                    page.firstRequestMs = timestamp * 1000
+                    page.firstRequestWallTime = event.get('wallTime')
+                    page.url = event.get('request').get('url')
+
+                self._log.debug('new entry with id {} on {}'.format(requestId, page.id))
+                self._inflight.add(requestId)
+
+                self._entries[requestId] = HarEntry(event, page.id)
 
                 return
             if event_name == Network_dataReceived:
-                entry = self._harinfo.entries.get(event.get(RID))
+                entry = self._entries.get(event.get(RID))
                 if not entry:
                     return
-                entry['responseLength'] = entry.get('responseLength') + int(event.get('dataLength'))
+                entry.responseLength += int(event.get('dataLength'))
             if event_name == Network_responseReceived:
-                entry = self._harinfo.entries.get(event.get(RID))
+                entry = self._entries.get(event.get(RID))
                 if not entry:
                     return
-                entry[RESPPRAM] = event
+                entry.setResponse(event.get('response'))
             if event_name == Network_resourceChangedPriority:
-                entry = self._harinfo.entries.get(event.get(RID))
+                entry = self._entries.get(event.get(RID))
                 if not entry:
                     return
-                entry['newPriority'] = event.get('newPriority')
+                entry.newPriority = event.get('newPriority')
             if event_name == Network_loadingFailed:
-                entry = self._harinfo.entries.get(event.get(RID))
+                self._inflight.discard(event.get(RID))
+                entry = self._entries.get(event.get(RID))
                 if not entry:
                     return
                 self._log.error(
@@ -185,35 +401,18 @@ class HarHandler(EventEmitter):
                                                                                                  event.get('canceled'),
                                                                                                  event.get(
                                                                                                      'blockedReason')))
-                self._harinfo.entries.pop(event.get(RID))
+                self._entries.pop(event.get(RID))
             if event_name == Network_loadingFinished:
                 self._log.debug('get FinishedEvent entry {}'.format(event.get(RID)))
-                entry = self._harinfo.entries.get(event.get(RID))
+                self._inflight.discard(event.get(RID))
+                entry = self._entries.get(event.get(RID))
                 if not entry:
                     return
-                entry['encodedResponseLength'] = event.get('encodedDataLength')
-                entry['responseFinishedS'] = event.get('timestamp')
-
-                url = entry.get(REQPARAM).get('request').get('url')
-
-                result = await self._client.send('Network.getResponseBody', dict(requestId=event.get(RID)))
-                if result:
-                    if result.get('result') and result.get('result').get('cookies'):
-                        cookies = result.get('result').get('cookies')
-                        if cookies:
-                            entry['cookies'] = cookies
-                            return
-                    if result.get('result') and result.get('result').get('body'):
-                        body = result.get('result').get('body')
-                        if body:
-                            entry['responseBody'] = body
-                            entry['responseBodyIsBase64'] = result.get('result').get('base64Encoded')
-                            return
-                        else:
-                            entry['responseBody'] = ''
-                            return
-                else:
-                    self._log.error('Error: result was: {}'.format(result))
+                entry.encodedResponseLength = event.get('encodedDataLength')
+                entry.responseFinishedS = event.get('timestamp')
+
+                self._bodyCapture.submit(event.get(RID), entry.url, entry.mimeType,
+                                         max(entry.responseLength or 0, event.get('encodedDataLength') or 0))
             if event_name == Security_securityStateChanged:
                 if event.get('securityState') == 'secure' and len(event.get('explanations')) > 0:
                     for cer in [ex.get('certificate') for ex in event.get('explanations') if ex.get('certificate')]:
@@ -221,12 +420,60 @@ class HarHandler(EventEmitter):
 
         pass
 
-    async def _checkFinsh(self):
+    def _onBody(self, requestId, body, base64Encoded, bodyFile):
+        entry = self._entries.get(requestId)
+        if not entry:
+            return
+        entry.responseBody = body
+        entry.responseBodyIsBase64 = base64Encoded
+        entry.responseBodyFile = bodyFile
+        if self._writer:
+            self._writeEntry(requestId)
+
+    def _writeEntry(self, requestId):
+        entry = self._entries.pop(requestId, None)
+        if not entry:
+            return
+        result = self._parser.parseEntry(requestId, entry.pageref, entry)
+        if result == None:
+            self._log.error('parseEntry failed for {} None'.format(requestId))
+            return
+        self._writer.writeEntry(result)
+
+    async def _checkFinsh(self, timeout: int = TIMEOUT_S):
+        def finished():
+            page = self._currentPage()
+            return bool(page and page.firstRequestMs and page.domContentEventFiredMs and page.loadEventFiredMs)
+
+        await helper.waitFor(finished, timeout, self, [Network_requestWillBeSent,
+                                                       Page_domContentEventFired,
+                                                       Page_loadEventFired,
+                                                       Page_lifecycleEvent])
+
+    async def _waitForNetworkIdle(self, idleTime: float = 0.5, timeout: int = TIMEOUT_S):
+        """
+        Wait until no request is in flight and no new request starts for idleTime seconds
+        :param idleTime: seconds
+        :param timeout: seconds
+        :return: True when the network got idle, False when timeout was reached first
+        """
+        loop = asyncio.get_event_loop()
+        end_time = loop.time() + timeout
         while True:
-            if self._harinfo.firstRequestMs and self._harinfo.domContentEventFiredMs and self._harinfo.loadEventFiredMs:
-                break
-            else:
-                await asyncio.sleep(0.3)
+            left = end_time - loop.time()
+            if left <= 0:
+                return False
+            if self._inflight:
+                try:
+                    await helper.waitFor(lambda: not self._inflight, left, self, [Network_loadingFinished,
+                                                                                  Network_loadingFailed])
+                except TimeoutError:
+                    return False
+                continue
+            try:
+                await self.waitForEvent(Network_requestWillBeSent, timeout=min(idleTime, left))
+            except asyncio.TimeoutError:
+                return True
 
 
 class HarParser(object):
@@ -235,121 +482,108 @@ class HarParser(object):
         self._timeformat = '%Y-%m-%dT%H:%M:%S.%fZ'
         pass
 
-    async def getHAR(self, harinfo):
+    async def getHAR(self, pages: list, entries: dict):
+        """
+        :param pages: list of harinfo, in navigation order
+        :param entries: dict, {requestId: HarEntry}
+        """
         har = {
             'log': {
                 'version': '1.2',
-                'creator': {
-                    'name': 'Chrome HAR Capturer',
-                    'version': '537.36'
-                },
-                'pages': [],
+                'creator': dict(HAR_CREATOR),
+                'pages': [self.parsePageInfo(page) for page in pages],
                 'entries': []
             }
         }
-        pageId = 'page_1'
-        result = self.parsePage(pageId, harinfo)
-        har['log']['pages'].append(result['pages'])
-        har['log']['entries'] = result['entries']
+        for ereqid, entry in entries.items():
+            result = self.parseEntry(ereqid, entry.pageref, entry)
+            if result == None:
+                self._log.error('parseEntry failed for {} None'.format(ereqid))
+                continue
+            har['log']['entries'].append(result)
 
         return har
 
-    def parsePage(self, pageid, page):
-        firstRequest = page.entries.get(page.firstRequestId).get(REQPARAM)
-        wallTimeMs = firstRequest.get('wallTime')
-
-        startedDateTime = datetime.fromtimestamp(wallTimeMs).strftime(self._timeformat)
+    def parsePageInfo(self, page):
+        startedDateTime = datetime.fromtimestamp(page.firstRequestWallTime).strftime(self._timeformat)
 
-        onContentLoad = int(page.domContentEventFiredMs) - int(page.firstRequestMs)
-        onLoad = int(page.loadEventFiredMs) - int(page.firstRequestMs)
+        # -1 when the page was left before the event fired
+        onContentLoad = -1
+        if page.domContentEventFiredMs:
+            onContentLoad = int(page.domContentEventFiredMs) - int(page.firstRequestMs)
+        onLoad = -1
+        if page.loadEventFiredMs:
+            onLoad = int(page.loadEventFiredMs) - int(page.firstRequestMs)
 
-        entries = []
-        for ereqid, entry in page.entries.items():
-            result = self.parseEntry(ereqid, pageid, entry)
-            if result == None:
-                self._log.error('parseEntry failed for {} None'.format(ereqid))
-                continue
-            entries.append(result)
         return dict(
-            pages=dict(
-                id=pageid,
-                title=page.url,
-                startedDateTime=startedDateTime,
-                pageTimings=dict(
-                    onContentLoad=onContentLoad,
-                    onLoad=onLoad)),
-            entries=entries
-        )
+            id=page.id,
+            title=page.url,
+            startedDateTime=startedDateTime,
+            pageTimings=dict(
+                onContentLoad=onContentLoad,
+                onLoad=onLoad))
 
     def parseEntry(self, ereqid, pageref, entry):
-        # skip requests without response (requestParams is always present)
-        if not entry.get(RESPPRAM) or not entry.get('responseFinishedS'):
+        # requests still in flight when the recording ended
+        if entry.incomplete and (not entry.hasResponse or not entry.timing):
+            return self.parseIncompleteEntry(pageref, entry)
+        if entry.incomplete and not entry.responseFinishedS:
+            # the headers are in, the body is not, end the entry at the headers
+            entry.responseFinishedS = entry.timing.requestTime + entry.timing.receiveHeadersEnd / 1000.0
+        # skip requests without response
+        if not entry.hasResponse or not entry.responseFinishedS:
             return None
         # skip entries without timing information (doc says optional)
-        if not entry.get(RESPPRAM).get('response').get('timing'):
+        if not entry.timing:
             return None
 
-        # // extract common fields
-        reqParams = entry.get(REQPARAM)
-        resParams = entry.get(RESPPRAM)
-
-        request = reqParams.get('request')
-        response = resParams.get('response')
         # entry started
-        wallTimeMs = reqParams.get('wallTime')
-
-        startedDateTime = datetime.fromtimestamp(wallTimeMs).strftime(self._timeformat)
+        startedDateTime = datetime.fromtimestamp(entry.wallTime).strftime(self._timeformat)
 
-        httpVersion = response.get('protocol') if response.get('protocol') else ' '
-
-        method = request.get('method')
-        url = request.get('url')
-        status = response.get('status')
-        statusText = response.get('statusText')
+        httpVersion = entry.protocol if entry.protocol else ' '
 
         # // parse and measure headers
-        headers = self.parseHeaders(httpVersion, request, response)
-
-        # self._log.info('header is {}'.format(headers))
+        headers = self.parseHeaders(httpVersion, entry)
 
         # // check for redirections
-        redirectURL = self.getHeaderValue(response.get('headers'), 'location', '')
-        queryString = self.parseQueryString(request.get('url'))
+        redirectURL = self.getHeaderValue(entry.responseHeaders, 'location', '')
+        queryString = self.parseQueryString(entry.url)
         (times, timings) = self.computeTimings(entry)
 
-        serverIPAddress = response.get('remoteIPAddress')
-
-        connection = str(response.get('connectionId'))
-        initiator = reqParams.get('initiator')
-        changedPriority = entry.get('changedPriority')
-        newPriority = changedPriority and changedPriority.get('newPriority')
-        _priority = newPriority or request.get('initialPriority')
+        _priority = entry.newPriority or entry.priority
 
         payload = self.computePayload(entry, headers)
 
-        mimeType = response.get('mimeType')
-
-        encoding = 'base64' if response.get('responseBodyIsBase64') else ''
-
-        scookies = entry.get('cookies') if entry.get('cookies') else []
+        encoding = 'base64' if entry.responseBodyIsBase64 else ''
+
+        initiator = {'type': entry.initiatorType}
+        if entry.initiatorUrl:
+            initiator['url'] = entry.initiatorUrl
+
+        request = {
+            'method': entry.method,
+            'url': entry.url,
+            'httpVersion': httpVersion,
+            'cookies': [],
+            'headers': headers.get('request').get('pairs'),
+            'queryString': queryString,
+            'headersSize': headers.get('request').get('size'),
+            'bodySize': payload.get('request').get('bodySize')
+        }
+        if entry.postData != None:
+            request['postData'] = {
+                'mimeType': self.getHeaderValue(entry.requestHeaders, 'content-type', ''),
+                'text': entry.postData
+            }
 
-        return {
+        result = {
             'pageref': pageref,
             'startedDateTime': startedDateTime,
             'time': times,
-            'request': {
-                'method': method,
-                'url': url,
-                'httpVersion': httpVersion,
-                'cookies': scookies,
-                'headers': headers.get('request').get('pairs'),
-                'queryString': queryString,
-                'headersSize': headers.get('request').get('size'),
-                'bodySize': payload.get('request').get('bodySize')
-            },
+            'request': request,
             'response': {
-                'status': status,
-                'statusText': statusText,
+                'status': entry.status,
+                'statusText': entry.statusText,
                 'httpVersion': httpVersion,
                 'cookies': [],
                 'headers': headers.get('response').get('pairs'),
@@ -357,24 +591,73 @@ class HarParser(object):
                 'headersSize': headers.get('response').get('size'),
                 'bodySize': payload.get('response').get('bodySize'),
                 '_transferSize': payload.get('response').get('transferSize'),
-                'content': {
-                    'size': entry.get('responseLength'),
-                    'mimeType': mimeType,
-                    'compression': payload.get('response').get('compression'),
-                    'text': entry.get('responseBody')
-                }
+                'content': self.parseContent(entry, encoding, payload)
             },
             'cache': {},
             'timings': timings,
-            'serverIPAddress': serverIPAddress,
-            'connection': connection,
+            'serverIPAddress': entry.remoteIPAddress,
+            'connection': str(entry.connectionId),
             'initiator': initiator,
             'priority': _priority,
         }
+        if entry.incomplete:
+            result['_incomplete'] = True
+        return result
+
+    def parseIncompleteEntry(self, pageref, entry):
+        """
+        Entry of a request which got no response before the recording ended, status 0 like the browsers write it
+        """
+        return {
+            'pageref': pageref,
+            'startedDateTime': datetime.fromtimestamp(entry.wallTime).strftime(self._timeformat),
+            'time': 0,
+            'request': {
+                'method': entry.method,
+                'url': entry.url,
+                'httpVersion': '',
+                'cookies': [],
+                'headers': self.zipNameValue(entry.requestHeaders),
+                'queryString': self.parseQueryString(entry.url),
+                'headersSize': -1,
+                'bodySize': -1
+            },
+            'response': {
+                'status': 0,
+                'statusText': '',
+                'httpVersion': '',
+                'cookies': [],
+                'headers': [],
+                'redirectURL': '',
+                'headersSize': -1,
+                'bodySize': -1,
+                'content': {'size': 0, 'mimeType': ''}
+            },
+            'cache': {},
+            'timings': {'blocked': -1, 'dns': -1, 'connect': -1, 'send': 0, 'wait': 0, 'receive': 0, 'ssl': -1},
+            'initiator': {'type': entry.initiatorType},
+            'priority': entry.newPriority or entry.priority,
+            '_incomplete': True
+        }
 
-    def parseHeaders(self, httpVersion, request, response):
-        requestHeaders = response.get('requestHeaders') if response.get('requestHeaders') else request.get('headers')
-        responseHeaders = response.get('headers')
+    def parseContent(self, entry, encoding, payload):
+        content = {
+            'size': entry.responseLength,
+            'mimeType': entry.mimeType,
+            'compression': payload.get('response').get('compression')
+        }
+        # text is optional, left out when the body is not captured or stored to _file
+        if entry.responseBody != None:
+            content['text'] = entry.responseBody
+        if encoding:
+            content['encoding'] = encoding
+        if entry.responseBodyFile:
+            content['_file'] = entry.responseBodyFile
+        return content
+
+    def parseHeaders(self, httpVersion, entry):
+        requestHeaders = entry.requestHeaders
+        responseHeaders = entry.responseHeaders
         headers = {
             'request': {
                 'map': requestHeaders,
@@ -388,30 +671,28 @@ class HarParser(object):
             }
         }
         if httpVersion.startswith('http/'):
-            requestText = self.getRawRequest(request, headers.get('request').get('pairs'))
-            responseText = response.get('headersText') if response.get('headersText') else self.getRawResponse(response,
-                                                                                                               headers.get(
-                                                                                                                   'response').get(
-                                                                                                                   'pairs'))
+            requestText = self.getRawRequest(entry, headers.get('request').get('pairs'))
+            responseText = entry.headersText if entry.headersText else self.getRawResponse(
+                entry, headers.get('response').get('pairs'))
             headers['request']['size'] = len(requestText)
             headers['response']['size'] = len(responseText)
 
         return headers
 
     def computeTimings(self, entry):
-        timing = entry.get(RESPPRAM).get('response').get('timing')
+        timing = entry.timing
         if timing == None:
             return (0,
                     {'blocked': -1, 'dns': -1, 'connect': -1, 'send': -1, 'wait': -1, 'receive': -1, 'ssl': -1})
-        times = self.toMilliseconds(entry.get('responseFinishedS') - timing.get('requestTime'))
-
-        dnsStart = timing.get('dnsStart')
-        sendStart = timing.get('sendStart')
-        connectStart = timing.get('connectStart')
-        sendEnd = timing.get('sendEnd')
-        receiveHeadersEnd = timing.get('receiveHeadersEnd')
-        sslStart = timing.get('sslStart')
-        sslEnd = timing.get('sslEnd')
+        times = self.toMilliseconds(entry.responseFinishedS - timing.requestTime)
+
+        dnsStart = timing.dnsStart
+        sendStart = timing.sendStart
+        connectStart = timing.connectStart
+        sendEnd = timing.sendEnd
+        receiveHeadersEnd = timing.receiveHeadersEnd
+        sslStart = timing.sslStart
+        sslEnd = timing.sslEnd
         blocked = self.firstNonNegative([
             dnsStart, connectStart, sendStart
         ])
@@ -437,14 +718,18 @@ class HarParser(object):
     def computePayload(self, entry, headers):
         bodySize = 0
         compression = ''
-        transferSize = entry.get('encodedResponseLength')
+        transferSize = entry.encodedResponseLength
         respsize = headers.get('response').get('size')
-        if respsize == -1:
+        if entry.encodedResponseLength == None:
+            # incomplete entry, the body never finished
+            bodySize = -1
+            transferSize = -1
+        elif respsize == -1:
             bodySize = -1
             compression = ''
         else:
-            bodySize = entry.get('encodedResponseLength') - respsize
-            compression = entry.get('responseLength') - bodySize
+            bodySize = entry.encodedResponseLength - respsize
+            compression = entry.responseLength - bodySize
 
         return dict(
             request=dict(
@@ -464,10 +749,10 @@ class HarParser(object):
                 pairs.append({'name': k, 'value': v1})
         return pairs
 
-    def getRawRequest(self, request, headerPairs):
-        method = request.get('request')
-        url = request.get('url')
-        protocol = request.get('protocol')
+    def getRawRequest(self, entry, headerPairs):
+        method = entry.method
+        url = entry.url
+        protocol = entry.protocol
 
         lines = '{} {} {},'.format(method, url, protocol)
         for kv in headerPairs:
@@ -476,10 +761,10 @@ class HarParser(object):
         lines += ','
         return lines
 
-    def getRawResponse(self, response, headerPairs):
-        status = response.get('status')
-        statusText = response.get('statusText')
-        protocol = response.get('protocol')
+    def getRawResponse(self, entry, headerPairs):
+        status = entry.status
+        statusText = entry.statusText
+        protocol = entry.protocol
 
         lines = '{} {} {},'.format(protocol, status, statusText)
         for kv in headerPairs:
@@ -501,8 +786,10 @@ class HarParser(object):
         return self.zipNameValue(result)
 
     def firstNonNegative(self, values):
-        value = [value for value in values if value > 0]
-        return value[0]
+        for value in values:
+            if value >= 0:
+                return value
+        return -1
 
     def toMilliseconds(self, time):
         return time * 1000 if not time == -1 else -1
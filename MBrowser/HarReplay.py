@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import base64
+import hashlib
+import logging
+from http.client import responses
+
+from MBrowser.HarIO import HarReader
+
+__all__ = ['HarArchive', 'HarReplayServer', 'RecordedResponse', 'replayHandler']
+
+# the body of a recorded response is served decoded, so these headers of the recording no longer apply
+_DROP_HEADERS = {'content-encoding', 'content-length', 'transfer-encoding', 'connection', 'keep-alive'}
+# phases adding up to the recorded time of an entry, ssl is counted inside connect
+_LATENCY_PHASES = ('blocked', 'dns', 'connect', 'send', 'wait', 'receive')
+
+
+def bodyHash(body) -> str:
+    """
+    :param body: request body, str or bytes, None for no body
+    :return: sha1 hex of the body, '' for no body
+    """
+    if not body:
+        return ''
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    return hashlib.sha1(body).hexdigest()
+
+
+class RecordedResponse(object):
+    """
+    Response of one HAR entry, ready to be served
+    """
+    __slots__ = ('status', 'statusText', 'headers', 'timings', '_text', '_base64', '_file')
+
+    def __init__(self, entry: dict):
+        response = entry.get('response') or {}
+        content = response.get('content') or {}
+        self.status = response.get('status') or 200
+        self.statusText = response.get('statusText') or responses.get(self.status, '')
+        # one header per value, a header repeated in the response may be recorded as one value joined by '\n'
+        self.headers = [(header.get('name'), value) for header in response.get('headers') or []
+                        if header.get('name') and header.get('name').lower() not in _DROP_HEADERS
+                        and not header.get('name').startswith(':')
+                        for value in str(header.get('value') or '').split('\n')]
+        self.timings = entry.get('timings') or {}
+        self._text = content.get('text') or ''
+        self._base64 = content.get('encoding') == 'base64'
+        self._file = content.get('_file')
+
+    def body(self) -> bytes:
+        if self._file:
+            with open(self._file, 'rb') as fileHandler:
+                return fileHandler.read()
+        if self._base64:
+            return base64.b64decode(self._text)
+        return self._text.encode('utf-8')
+
+    def latency(self, scale: float = 1.0) -> float:
+        """
+        :param scale: 1.0 for the recorded time, 0 for none
+        :return: seconds to wait before answering
+        """
+        if not scale:
+            return 0.0
+        recorded = sum(value for value in (self.timings.get(phase) for phase in _LATENCY_PHASES)
+                       if value != None and value > 0)
+        return recorded * scale / 1000.0
+
+
+class HarArchive(object):
+    """
+    Recorded responses of HAR files indexed by (method, url, body hash), a request made several times is answered
+    with its recordings in the recorded order, the last one is repeated after that
+    """
+
+    def __init__(self, entries: list = None):
+        self._log = logging.getLogger('HarReplay.HarArchive')
+        self._exact = {}
+        self._byUrl = {}
+        self._served = {}
+        self.hits = 0
+        self.misses = 0
+        for entry in entries or []:
+            self.add(entry)
+
+    @staticmethod
+    def fromFiles(filenames: list):
+        """
+        :param filenames: list of HAR files, e.g. written by Page.getHar or goto(harFile=...)
+        :return: HarArchive
+        """
+        archive = HarArchive()
+        for filename in filenames:
+            with open(filename, encoding='utf-8') as fileHandler:
+                for entry in HarReader(fileHandler).entries():
+                    archive.add(entry)
+        return archive
+
+    def __len__(self):
+        return sum(len(responses) for responses in self._exact.values())
+
+    def add(self, entry: dict) -> None:
+        request = entry.get('request') or {}
+        method = (request.get('method') or 'GET').upper()
+        url = request.get('url')
+        if not url:
+            return
+        recorded = RecordedResponse(entry)
+        postData = (request.get('postData') or {}).get('text')
+        self._exact.setdefault((method, url, bodyHash(postData)), []).append(recorded)
+        self._byUrl.setdefault((method, url), []).append(recorded)
+
+    def match(self, method: str, url: str, postData=None):
+        """
+        :param postData: request body, str or bytes
+        :return: RecordedResponse, None when nothing was recorded for the request
+        """
+        method = (method or 'GET').upper()
+        key = (method, url, bodyHash(postData))
+        recorded = self._exact.get(key)
+        if recorded == None:
+            # same request with another body, e.g. a timestamp in the payload
+            key = (method, url)
+            recorded = self._byUrl.get(key)
+        if recorded == None:
+            self.misses += 1
+            self._log.debug('no recording for {} {}'.format(method, url))
+            return None
+        self.hits += 1
+        served = self._served.get(key, 0)
+        self._served[key] = served + 1
+        return recorded[min(served, len(recorded) - 1)]
+
+    def rewind(self) -> None:
+        """
+        Serve the recordings from the first one again, call it between two replayed runs
+        """
+        self._served = {}
+
+    def stats(self) -> dict:
+        return dict(hits=self.hits, misses=self.misses)
+
+
+def replayHandler(archive: HarArchive, latencyScale: float = 0.0, passthrough: bool = False):
+    """
+    Interceptor handler answering requests from archive, see Page.replayHar
+    :param latencyScale: wait the recorded timings times latencyScale before answering, 0 for no wait
+    :param passthrough: let requests without recording go to the network, default False to fail them
+    :return: async function(InterceptedRequest) -> bool
+    """
+
+    async def handler(request) -> bool:
+        recorded = archive.match(request.method, request.url, request.postData)
+        if recorded == None:
+            if passthrough:
+                return False
+            await request.fail('InternetDisconnected')
+            return True
+        delay = recorded.latency(latencyScale)
+        if delay:
+            await asyncio.sleep(delay)
+        await request.fulfill(recorded.status, recorded.headers, recorded.body(), recorded.statusText)
+        return True
+
+    return handler
+
+
+class HarReplayServer(object):
+    """
+    Local HTTP proxy answering every request from a HarArchive, no request reaches the network, start Chrome with
+    proxyArgument() as command line switch, eg:
+
+            server = HarReplayServer(HarArchive.fromFiles(['jd.har']), latencyScale=1.0)
+            await server.start()
+            browser = Launcher.startBrowser({BROWSEPATH: BROWSER,
+                                             ARGS: [server.proxyArgument(), '--ignore-certificate-errors']})
+
+    https is answered when an ssl.SSLContext with a certificate is given, the CONNECT tunnels are terminated with it
+    so Chrome needs --ignore-certificate-errors or a trusted certificate
+    """
+
+    def __init__(self, archive: HarArchive, host: str = '127.0.0.1', port: int = 0, latencyScale: float = 0.0,
+                 sslContext=None):
+        """
+        :param archive: HarArchive
+        :param host: address to listen on
+        :param port: port to listen on, 0 for any free port
+        :param latencyScale: wait the recorded timings times latencyScale before answering, 0 for no wait
+        :param sslContext: ssl.SSLContext with certificate chain loaded, None to refuse https
+        """
+        self._archive = archive
+        self._host = host
+        self._port = port
+        self._latencyScale = latencyScale
+        self._sslContext = sslContext
+        self._server = None
+        self._log = logging.getLogger('HarReplay.HarReplayServer')
+        self.requests = 0
+        self.bytesServed = 0
+
+    @property
+    def port(self) -> int:
+        return self._port
+
+    def proxyArgument(self) -> str:
+        return '--proxy-server={}:{}'.format(self._host, self._port)
+
+    async def start(self) -> int:
+        """
+        :return: port the server listens on
+        """
+        self._server = await asyncio.start_server(self._serve, self._host, self._port)
+        self._port = self._server.sockets[0].getsockname()[1]
+        self._log.info('replay server listening on {}:{}, {} recordings'.format(self._host, self._port,
+                                                                               len(self._archive)))
+        return self._port
+
+    async def stop(self) -> None:
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    def stats(self) -> dict:
+        stats = self._archive.stats()
+        stats.update(requests=self.requests, bytesServed=self.bytesServed)
+        return stats
+
+    async def _serve(self, reader, writer):
+        origin = ''
+        try:
+            while True:
+                line = await reader.readline()
+                if not line.strip():
+                    break
+                (method, target, _) = line.decode('latin-1').split(' ', 2)
+                headers = await self._readHeaders(reader)
+                if method == 'CONNECT':
+                    if self._sslContext == None:
+                        await self._write(writer, 501, 'Not Implemented', [], b'')
+                        break
+                    writer.write(b'HTTP/1.1 200 Connection Established\r\n\r\n')
+                    await writer.drain()
+                    await writer.start_tls(self._sslContext)
+                    host = target[:-4] if target.endswith(':443') else target
+                    origin = 'https://' + host
+                    continue
+                length = int(headers.get('content-length') or 0)
+                body = await reader.readexactly(length) if length else None
+                url = target if target.startswith('http') else (origin or 'http://' + headers.get('host', '')) + target
+                self.requests += 1
+                await self._answer(writer, method, url, body)
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError) as e:
+            self._log.debug('replay connection closed: {}'.format(e))
+        finally:
+            writer.close()
+
+    async def _readHeaders(self, reader) -> dict:
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode('latin-1').strip()
+            if not line:
+                return headers
+            (name, _, value) = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+    async def _answer(self, writer, method, url, body):
+        recorded = self._archive.match(method, url, body)
+        if recorded == None:
+            await self._write(writer, 404, 'Not Found', [('x-mbrowser-replay', 'miss')], b'')
+            return
+        delay = recorded.latency(self._latencyScale)
+        if delay:
+            await asyncio.sleep(delay)
+        await self._write(writer, recorded.status, recorded.statusText, recorded.headers,
+                          b'' if method == 'HEAD' else recorded.body())
+
+    async def _write(self, writer, status, statusText, headers, body):
+        lines = ['HTTP/1.1 {} {}'.format(status, statusText)]
+        lines.extend('{}: {}'.format(name, value) for (name, value) in headers)
+        lines.append('Content-Length: {}'.format(len(body)))
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1', 'replace') + body)
+        await writer.drain()
+        self.bytesServed += len(body)
@@ -0,0 +1,325 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+
+from MBrowser import EventLoop
+
+__all__ = ['HttpCache']
+
+INDEX_FILE = 'index.json'
+# the body is served decoded and in one piece, so these headers of the stored response no longer apply
+_DROP_HEADERS = {'content-encoding', 'content-length', 'transfer-encoding', 'connection', 'keep-alive'}
+_CACHEABLE_STATUS = {200, 203}
+# static assets, the same across navigations and worth keeping
+CACHED_TYPES = ('Script', 'Stylesheet', 'Image', 'Font')
+
+
+def _headerDict(headers) -> dict:
+    """
+    :param headers: list of {'name':, 'value':} as Fetch gives them, or dict
+    :return: dict with lower case names
+    """
+    if isinstance(headers, dict):
+        return {name.lower(): value for name, value in headers.items()}
+    return {header.get('name').lower(): header.get('value') for header in headers or []}
+
+
+def _parseDate(value):
+    try:
+        return parsedate_to_datetime(value).timestamp() if value else None
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def _cacheControl(value: str) -> dict:
+    directives = {}
+    for part in (value or '').split(','):
+        (name, _, arg) = part.strip().partition('=')
+        if name:
+            directives[name.lower()] = arg.strip('"')
+    return directives
+
+
+class HttpCache(object):
+    """
+    Disk cache of static responses shared by any number of pages, answered through Fetch interception
+
+    bodies are stored once per content (sha1) however many urls return them, the index is kept in memory in LRU
+    order and evicts the least recently used urls once the bodies exceed maxBytes, freshness follows Cache-Control,
+    Expires and a Last-Modified heuristic, stale responses with ETag or Last-Modified are revalidated with a
+    conditional request and a 304 is answered from the cache
+
+    use it by Page.useCache, call save() to keep the index for the next run
+    """
+
+    def __init__(self, directory: str, maxBytes: int = 2 ** 29, resourceTypes: list = CACHED_TYPES,
+                 defaultTtl: float = 0, maxHeuristicTtl: float = 86400):
+        """
+        :param directory: cache directory, created when missing, an index saved there before is loaded
+        :param maxBytes: max size of the stored bodies, default 512MB
+        :param resourceTypes: Network.ResourceType answered from the cache, default static assets
+        :param defaultTtl: seconds a response without any freshness information stays fresh, default 0 to store
+                           only responses with freshness or validators
+        :param maxHeuristicTtl: cap of the freshness guessed from Last-Modified, seconds
+        """
+        self._directory = directory
+        self._maxBytes = maxBytes
+        self._resourceTypes = list(resourceTypes)
+        self._defaultTtl = defaultTtl
+        self._maxHeuristicTtl = maxHeuristicTtl
+        self._log = logging.getLogger('HttpCache.HttpCache')
+        # url -> dict(body, size, status, headers, expires, etag, lastModified)
+        self._index = OrderedDict()
+        # body sha1 -> number of urls using it
+        self._bodies = {}
+        self._bytes = 0
+        # requestId of the requests sent on with conditional headers, their response is a 304 or a miss
+        self._revalidating = set()
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self.stored = 0
+        self.evicted = 0
+        self.bytesSaved = 0
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    ################################# interception ##############################
+    def patterns(self) -> list:
+        """
+        :return: list of Fetch.RequestPattern, the cached types paused at the request and at the response stage
+        """
+        return [dict(urlPattern='*', resourceType=name, requestStage=stage)
+                for name in self._resourceTypes for stage in ('Request', 'Response')]
+
+    async def onRequest(self, request) -> bool:
+        """
+        Interceptor handler of the request stage, answer fresh responses, add validators to stale ones
+        """
+        if request.method != 'GET' or request.resourceType not in self._resourceTypes:
+            return False
+        record = self._index.get(request.url)
+        if record == None:
+            self.misses += 1
+            return False
+        if record.get('expires') > time.time():
+            body = await self._readBody(record)
+            if body != None:
+                self._hit(request.url, record)
+                await request.fulfill(record.get('status'), record.get('headers'), body)
+                return True
+            # a 304 could not be answered without the body either
+            self._remove(request.url)
+            self.misses += 1
+            return False
+        conditions = {}
+        if record.get('etag'):
+            conditions['If-None-Match'] = record.get('etag')
+        if record.get('lastModified'):
+            conditions['If-Modified-Since'] = record.get('lastModified')
+        if not conditions:
+            self.misses += 1
+            return False
+        headers = dict(request.headers)
+        headers.update(conditions)
+        self._revalidating.add(request.requestId)
+        await request.continueRequest(headers=[dict(name=name, value=value) for name, value in headers.items()])
+        return True
+
+    async def onResponse(self, request) -> bool:
+        """
+        Interceptor handler of the response stage, answer 304 from the cache, store cacheable responses
+        """
+        if request.method != 'GET' or request.resourceType not in self._resourceTypes:
+            return False
+        headers = _headerDict(request.responseHeaders)
+        record = self._index.get(request.url)
+        revalidating = request.requestId in self._revalidating
+        self._revalidating.discard(request.requestId)
+        if request.responseStatusCode == 304 and record != None:
+            body = await self._readBody(record)
+            if body != None:
+                record['expires'] = self._expires(headers) or record.get('expires')
+                self._hit(request.url, record, revalidated=True)
+                await request.fulfill(record.get('status'), record.get('headers'), body)
+                return True
+        if revalidating:
+            # onRequest counted nothing for it, the server sent a new response instead of a 304
+            self.misses += 1
+        if request.responseStatusCode not in _CACHEABLE_STATUS:
+            return False
+        expires = self._expires(headers)
+        if expires == None:
+            return False
+        if expires <= time.time() and not (headers.get('etag') or headers.get('last-modified')):
+            return False
+        body = await request.getResponseBody()
+        if body == None:
+            return False
+        try:
+            # hashing and writing a large body would stall the loop, they run in a thread
+            digest = await EventLoop.loop.run_in_executor(None, self._writeBody, body)
+        except OSError as e:
+            self._log.error('store {} failed: {}'.format(request.url, e))
+            return False
+        self._store(request.url, request.responseStatusCode, request.responseHeaders, headers, digest, len(body),
+                    expires)
+        return False
+
+    ################################# interception ##############################
+
+    ################################# store #####################################
+    def _expires(self, headers: dict):
+        """
+        :param headers: response headers, lower case names
+        :return: timestamp the response stays fresh until, None when it must not be stored
+        """
+        control = _cacheControl(headers.get('cache-control'))
+        if 'no-store' in control or 'private' in control:
+            return None
+        vary = [name.strip().lower() for name in (headers.get('vary') or '').split(',') if name.strip()]
+        if [name for name in vary if name != 'accept-encoding']:
+            return None
+        now = time.time()
+        date = _parseDate(headers.get('date')) or now
+        age = float(headers.get('age') or 0) if (headers.get('age') or '').isdigit() else 0
+        if 'no-cache' in control:
+            ttl = 0
+        elif control.get('s-maxage', '').isdigit():
+            ttl = int(control.get('s-maxage'))
+        elif control.get('max-age', '').isdigit():
+            ttl = int(control.get('max-age'))
+        elif _parseDate(headers.get('expires')) != None:
+            ttl = _parseDate(headers.get('expires')) - date
+        elif _parseDate(headers.get('last-modified')) != None:
+            ttl = min(0.1 * (date - _parseDate(headers.get('last-modified'))), self._maxHeuristicTtl)
+        else:
+            ttl = self._defaultTtl
+        return now + ttl - age
+
+    def _writeBody(self, body: bytes) -> str:
+        """
+        Runs in a thread, the index is only changed on the loop by _store
+        :return: sha1 of body, the name of its file
+        """
+        digest = hashlib.sha1(body).hexdigest()
+        path = self._bodyPath(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp = path + '.tmp'
+            with open(temp, 'wb') as fileHandler:
+                fileHandler.write(body)
+            os.replace(temp, path)
+        return digest
+
+    def _store(self, url, status, responseHeaders, headers, digest, size, expires):
+        self._remove(url)
+        self._index[url] = dict(body=digest, size=size, status=status, expires=expires,
+                                etag=headers.get('etag'), lastModified=headers.get('last-modified'),
+                                headers=[(header.get('name'), header.get('value')) for header in responseHeaders
+                                         if header.get('name').lower() not in _DROP_HEADERS])
+        self._addBody(digest, size)
+        self.stored += 1
+        self._evict()
+
+    def _hit(self, url, record, revalidated: bool = False):
+        """
+        Count a response served from the cache once, as a fresh hit or as a 304 revalidation
+        """
+        if revalidated:
+            self.revalidated += 1
+        else:
+            self.hits += 1
+        self.bytesSaved += record.get('size')
+        self._index.move_to_end(url)
+
+    def _addBody(self, digest, size):
+        count = self._bodies.get(digest, 0)
+        if count == 0:
+            self._bytes += size
+        self._bodies[digest] = count + 1
+
+    def _remove(self, url):
+        record = self._index.pop(url, None)
+        if record == None:
+            return
+        digest = record.get('body')
+        count = self._bodies.get(digest, 0) - 1
+        if count > 0:
+            self._bodies[digest] = count
+            return
+        self._bodies.pop(digest, None)
+        self._bytes -= record.get('size')
+        try:
+            os.remove(self._bodyPath(digest))
+        except OSError:
+            pass
+
+    def _evict(self):
+        while self._bytes > self._maxBytes and self._index:
+            url = next(iter(self._index))
+            self._remove(url)
+            self.evicted += 1
+
+    def _bodyPath(self, digest: str) -> str:
+        return os.path.join(self._directory, digest[:2], digest)
+
+    async def _readBody(self, record):
+        try:
+            return await EventLoop.loop.run_in_executor(None, self._readFile, self._bodyPath(record.get('body')))
+        except OSError:
+            self._log.warning('cached body {} is gone'.format(record.get('body')))
+            return None
+
+    @staticmethod
+    def _readFile(path: str) -> bytes:
+        with open(path, 'rb') as fileHandler:
+            return fileHandler.read()
+
+    ################################# store #####################################
+
+    ################################# index #####################################
+    def _load(self):
+        path = os.path.join(self._directory, INDEX_FILE)
+        if not os.path.exists(path):
+            return
+        try:
+            with open(path, encoding='utf-8') as fileHandler:
+                records = json.load(fileHandler)
+        except (OSError, ValueError) as e:
+            self._log.warning('cache index {} not loaded: {}'.format(path, e))
+            return
+        for url, record in records:
+            record['headers'] = [tuple(header) for header in record.get('headers')]
+            self._index[url] = record
+            self._addBody(record.get('body'), record.get('size'))
+        self._evict()
+
+    def save(self) -> None:
+        """
+        Write the index, least recently used first, so the next run starts warm
+        """
+        path = os.path.join(self._directory, INDEX_FILE)
+        with open(path + '.tmp', 'w', encoding='utf-8') as fileHandler:
+            json.dump(list(self._index.items()), fileHandler)
+        os.replace(path + '.tmp', path)
+
+    def clear(self) -> None:
+        self._revalidating.clear()
+        for url in list(self._index.keys()):
+            self._remove(url)
+
+    def stats(self) -> dict:
+        """
+        :return: each request counts in one of hits (fresh), revalidated (304) and misses
+        """
+        return dict(hits=self.hits, misses=self.misses, revalidated=self.revalidated, stored=self.stored,
+                    evicted=self.evicted, bytesSaved=self.bytesSaved, bytes=self._bytes, urls=len(self._index))
+
+    ################################# index #####################################
@@ -0,0 +1,360 @@
+# -*- coding: utf-8 -*-
+
+import base64
+import fnmatch
+import logging
+import re
+from urllib.parse import urlsplit
+
+from MBrowser import EventLoop
+from MBrowser.Const import *
+from MBrowser.EventEmitter import EventEmitter
+
+__all__ = ['InterceptedRequest', 'Interceptor', 'RequestRule', 'RequestRules']
+
+# Network.ResourceType values, rules may name them in any case
+RESOURCE_TYPES = {name.lower(): name for name in (
+    'Document', 'Stylesheet', 'Image', 'Media', 'Font', 'Script', 'TextTrack', 'XHR', 'Fetch', 'EventSource',
+    'WebSocket', 'Manifest', 'SignedExchange', 'Ping', 'CSPViolationReport', 'Preflight', 'Other')}
+
+
+class InterceptedRequest(object):
+    """
+    A request paused by Fetch.requestPaused, it stays paused in the browser until one of fulfill, fail or
+    continueRequest is called, at the response stage responseStatusCode and responseHeaders are set as well
+    """
+
+    def __init__(self, client, event: dict):
+        self._client = client
+        self.requestId = event.get(RID)
+        self.request = event.get('request')
+        self.resourceType = event.get('resourceType')
+        self.frameId = event.get('frameId')
+        self.networkId = event.get('networkId')
+        self.responseStatusCode = event.get('responseStatusCode')
+        self.responseHeaders = event.get('responseHeaders')
+        self.responseErrorReason = event.get('responseErrorReason')
+        self.handled = False
+
+    @property
+    def isResponseStage(self) -> bool:
+        return self.responseStatusCode != None or self.responseErrorReason != None
+
+    @property
+    def url(self) -> str:
+        return self.request.get('url')
+
+    @property
+    def method(self) -> str:
+        return self.request.get('method')
+
+    @property
+    def headers(self) -> dict:
+        return self.request.get('headers') or {}
+
+    @property
+    def postData(self) -> str:
+        return self.request.get('postData')
+
+    async def fulfill(self, status: int = 200, headers: list = None, body=b'', statusText: str = None) -> None:
+        """
+        Answer the request without touching the network
+        :param status: http status code
+        :param headers: list of (name, value) or dict, a value holding several lines, e.g. set-cookie headers joined
+                        by '\n' as Network events and HAR files have them, is sent as one header per line
+        :param body: bytes or str
+        :param statusText: default the standard text of status
+        """
+        if isinstance(headers, dict):
+            headers = list(headers.items())
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        params = dict(requestId=self.requestId, responseCode=status,
+                      responseHeaders=[dict(name=name, value=line) for (name, value) in headers or []
+                                       for line in str(value).split('\n')],
+                      body=base64.b64encode(body).decode('ascii'))
+        if statusText:
+            params['responsePhrase'] = statusText
+        await self._send('Fetch.fulfillRequest', params)
+
+    async def fail(self, reason: str = 'BlockedByClient') -> None:
+        """
+        :param reason: Network.ErrorReason, e.g. 'BlockedByClient', 'Failed', 'InternetDisconnected'
+        """
+        await self._send('Fetch.failRequest', dict(requestId=self.requestId, errorReason=reason))
+
+    async def continueRequest(self, **overrides) -> None:
+        """
+        Let the request go to the network
+        :param overrides: url, method, postData or headers to change
+        """
+        params = dict(requestId=self.requestId)
+        params.update(overrides)
+        await self._send('Fetch.continueRequest', params)
+
+    async def getResponseBody(self) -> bytes:
+        """
+        Body of the response at the response stage, the request stays paused
+        :return: bytes, None when the body is not available
+        """
+        resp = await self._client.send('Fetch.getResponseBody', dict(requestId=self.requestId))
+        if not resp or resp.get(ERROR):
+            return None
+        result = resp.get(RESULT)
+        if result.get('base64Encoded'):
+            return base64.b64decode(result.get('body'))
+        return result.get('body').encode('utf-8')
+
+    async def _send(self, method: str, params: dict) -> None:
+        if self.handled:
+            raise RuntimeError('request {} is already handled'.format(self.url))
+        self.handled = True
+        resp = await self._client.send(method, params)
+        if not resp or resp.get(ERROR):
+            logging.getLogger('Interception.InterceptedRequest').error('{} failed for {}: {}'.format(
+                method, self.url, resp))
+
+
+class Interceptor(EventEmitter):
+    """
+    Fetch domain interception of one Page, every paused request is passed to the handlers of its stage in the order
+    they were added until one of them answers it, requests no handler answers continue
+
+    a handler is an async function(request: InterceptedRequest) -> bool, True when it has answered the request
+    """
+    ALL_REQUESTS = dict(urlPattern='*')
+
+    def __init__(self, client):
+        self._client = client
+        self._log = logging.getLogger('Interception.Interceptor')
+        self._handlers = []
+        self._responseHandlers = []
+        self._enabled = False
+        self._patterns = None
+        self.paused = 0
+        self.continued = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self._enabled
+
+    @property
+    def hasHandlers(self) -> bool:
+        return bool(self._handlers or self._responseHandlers)
+
+    def addHandler(self, handler, first: bool = False, stage: str = 'Request') -> None:
+        """
+        :param handler: async function(request: InterceptedRequest) -> bool
+        :param first: try it before the handlers already added, default False to try it after them
+        :param stage: 'Request' or 'Response', the stage the handler gets the paused requests of, the patterns
+                      given to enable decide which requests are paused at the response stage
+        """
+        handlers = self._responseHandlers if stage == 'Response' else self._handlers
+        if handler in handlers:
+            return
+        if first:
+            handlers.insert(0, handler)
+        else:
+            handlers.append(handler)
+
+    def removeHandler(self, handler) -> None:
+        for handlers in (self._handlers, self._responseHandlers):
+            if handler in handlers:
+                handlers.remove(handler)
+
+    async def enable(self, patterns: list = None) -> None:
+        """
+        Pause the requests matching patterns, enabling again widens the paused requests to the union of all the
+        patterns asked for, so handlers added later never lose requests earlier handlers did not need
+        :param patterns: list of Fetch.RequestPattern, default None for every request at the request stage, a
+                         pattern with requestStage='Response' pauses the requests again once their response is in
+        """
+        current = self._patterns or []
+        merged = current + [pattern for pattern in patterns or [self.ALL_REQUESTS] if pattern not in current]
+        if self.ALL_REQUESTS in merged:
+            # every request is paused at the request stage already
+            merged = [pattern for pattern in merged
+                      if pattern == self.ALL_REQUESTS or pattern.get('requestStage', 'Request') != 'Request']
+        if self._enabled:
+            if merged == current:
+                return
+        else:
+            self.on(Fetch_requestPaused, self._onRequestPaused)
+        resp = await self._client.send('Fetch.enable', dict(patterns=merged))
+        if not resp or resp.get(ERROR):
+            if not self._enabled:
+                self.removeEvent(Fetch_requestPaused, self._onRequestPaused)
+            raise RuntimeError('Fetch.enable failed: {}'.format(resp))
+        self._enabled = True
+        self._patterns = merged
+
+    async def disable(self) -> None:
+        if not self._enabled:
+            return
+        self._enabled = False
+        self._patterns = None
+        self.removeEvent(Fetch_requestPaused, self._onRequestPaused)
+        await self._client.send('Fetch.disable', {})
+
+    async def reset(self) -> None:
+        """
+        Remove every handler and stop intercepting
+        """
+        self._handlers = []
+        self._responseHandlers = []
+        await self.disable()
+
+    def stats(self) -> dict:
+        return dict(paused=self.paused, continued=self.continued)
+
+    def _onRequestPaused(self, event_name, event):
+        self.paused += 1
+        EventLoop.create_task(self._handle(InterceptedRequest(self._client, event)))
+
+    async def _handle(self, request: InterceptedRequest):
+        for handler in list(self._responseHandlers if request.isResponseStage else self._handlers):
+            try:
+                if await handler(request):
+                    return
+            except Exception as e:
+                self._log.exception(e)
+            if request.handled:
+                return
+        self.continued += 1
+        await request.continueRequest()
+
+
+class RequestRule(object):
+    """
+    One declarative interception rule, a request matches when it matches every condition given
+    """
+
+    def __init__(self, action: str, resourceTypes: list = None, urlGlob: str = None, urlRegex: str = None,
+                 hosts: list = None, status: int = 200, headers=None, body=b'', bodyFile: str = None,
+                 reason: str = 'BlockedByClient'):
+        """
+        :param action: 'block', 'continue' or 'fulfill'
+        :param resourceTypes: list of Network.ResourceType, e.g. ['Image', 'Font', 'Media'], any case
+        :param urlGlob: shell style pattern of the whole url, e.g. '*.png?*'
+        :param urlRegex: regex searched in the url
+        :param hosts: list of hosts, a host also matches its subdomains
+        :param status: fulfill, http status code
+        :param headers: fulfill, dict or list of (name, value)
+        :param body: fulfill, bytes or str
+        :param bodyFile: fulfill, file to read the body from instead of body
+        :param reason: block, Network.ErrorReason
+        """
+        if action not in ('block', 'continue', 'fulfill'):
+            raise ValueError('unknown rule action {}'.format(action))
+        self.action = action
+        self.resourceTypes = None
+        if resourceTypes:
+            unknown = [name for name in resourceTypes if name.lower() not in RESOURCE_TYPES]
+            if unknown:
+                raise ValueError('unknown resource types {}'.format(unknown))
+            self.resourceTypes = frozenset(RESOURCE_TYPES[name.lower()] for name in resourceTypes)
+        patterns = []
+        if urlGlob:
+            patterns.append('(?={})'.format(fnmatch.translate(urlGlob)))
+        if urlRegex:
+            patterns.append('(?=.*?(?:{}))'.format(urlRegex))
+        self._url = re.compile('^' + ''.join(patterns), re.S) if patterns else None
+        self.hosts = frozenset(host.lower().lstrip('*.') for host in hosts) if hosts else None
+        self.status = status
+        self.headers = list(headers.items()) if isinstance(headers, dict) else list(headers or [])
+        self.reason = reason
+        self._body = body.encode('utf-8') if isinstance(body, str) else body
+        self._bodyFile = bodyFile
+        self.hits = 0
+
+    def body(self) -> bytes:
+        if self._bodyFile:
+            with open(self._bodyFile, 'rb') as fileHandler:
+                self._body = fileHandler.read()
+            self._bodyFile = None
+        return self._body
+
+    def matches(self, url: str, host: str) -> bool:
+        """
+        Url and host conditions, the resource type is checked by RequestRules
+        """
+        if self.hosts != None and not self._matchHost(host):
+            return False
+        if self._url != None and not self._url.match(url):
+            return False
+        return True
+
+    def _matchHost(self, host: str) -> bool:
+        while host:
+            if host in self.hosts:
+                return True
+            host = host.partition('.')[2]
+        return False
+
+    async def apply(self, request: InterceptedRequest) -> None:
+        self.hits += 1
+        if self.action == 'block':
+            await request.fail(self.reason)
+        elif self.action == 'fulfill':
+            await request.fulfill(self.status, self.headers, self.body())
+        else:
+            await request.continueRequest()
+
+
+class RequestRules(object):
+    """
+    Ordered list of RequestRule compiled for matching, the first matching rule is applied, requests no rule matches
+    go to the next Interceptor handler
+
+    the rules are indexed by resource type, so a request is only checked against the rules which can apply to its
+    type, and when every rule names resource types only those types are paused by the browser at all
+    """
+
+    def __init__(self, rules: list):
+        """
+        :param rules: list of RequestRule
+        """
+        self._rules = list(rules)
+        anyType = [rule for rule in self._rules if rule.resourceTypes == None]
+        self._anyType = anyType
+        self._byType = {}
+        for name in RESOURCE_TYPES.values():
+            candidates = [rule for rule in self._rules if rule.resourceTypes == None or name in rule.resourceTypes]
+            if candidates:
+                self._byType[name] = candidates
+        self.unmatched = 0
+
+    def patterns(self) -> list:
+        """
+        :return: list of Fetch.RequestPattern covering the rules, None when every request has to be paused
+        """
+        if self._anyType or not self._rules:
+            return None
+        return [dict(urlPattern='*', resourceType=name) for name in self._byType]
+
+    def match(self, url: str, resourceType: str = None):
+        """
+        :return: the first RequestRule matching, None for no match
+        """
+        candidates = self._byType.get(resourceType, self._anyType)
+        if not candidates:
+            return None
+        host = (urlsplit(url).hostname or '').lower()
+        for rule in candidates:
+            if rule.matches(url, host):
+                return rule
+        return None
+
+    async def __call__(self, request: InterceptedRequest) -> bool:
+        rule = self.match(request.url, request.resourceType)
+        if rule == None:
+            self.unmatched += 1
+            return False
+        await rule.apply(request)
+        return True
+
+    def stats(self) -> dict:
+        stats = dict(unmatched=self.unmatched)
+        for index, rule in enumerate(self._rules):
+            stats['{}:{}'.format(index, rule.action)] = rule.hits
+        return stats
@@ -1,12 +1,14 @@
 # -*- coding: utf-8 -*-
 import logging
 import re
+import shutil
+import tempfile
 from subprocess import Popen, PIPE, STDOUT
 
 from MBrowser.Browser import Browser
-from MBrowser.Const import BROWSEPATH, HEADLESS
+from MBrowser.Const import ARGS, BROWSEPATH, HEADLESS, KILLEXISTING
 
-__all__ = ['Launcher', 'BROWSEPATH', 'HEADLESS']
+__all__ = ['Launcher', 'ARGS', 'BROWSEPATH', 'HEADLESS', 'KILLEXISTING']
 
 CHROMESTARTUPARGS = [
     r'--disable-background-networking',
@@ -38,6 +40,8 @@ class Launcher(object):
     Used to launch the chrome brower
     """
     browserPid = None
+    # profile directory created for the last launch, None when the browser uses the one given in ARGS or the default
+    userDataDir = None
 
     @classmethod
     def startBrowser(cls, options):
@@ -46,19 +50,37 @@ class Launcher(object):
 
         cls._log = logging.getLogger('Launcher.Launcher')
 
-        cls.killBrowser()
+        # other browsers are killed unless asked not to, keep them when they run other jobs, use
+        # Browser.createContext to isolate identities inside one browser instead of starting one per identity
+        keepExisting = isinstance(options, dict) and options.get(KILLEXISTING) == False
+        if not keepExisting:
+            cls.killBrowser()
+        startArgs = list(CHROMESTARTUPARGS)
         if isinstance(options, dict) and options.get(HEADLESS) == True:
-            CHROMESTARTUPARGS.extend(CHROMESHEADLESS)
+            startArgs.extend(CHROMESHEADLESS)
+
+        if isinstance(options, dict) and options.get(ARGS):
+            startArgs.extend(options.get(ARGS))
+
+        cls.userDataDir = None
+        if keepExisting and not [arg for arg in startArgs if arg.startswith('--user-data-dir')]:
+            # a chrome started on a profile already in use hands over to the running one and exits without an
+            # endpoint, so every browser kept side by side gets a profile of its own, removed by closeBrowser
+            cls.userDataDir = tempfile.mkdtemp(prefix='MBrowser-')
+            startArgs.append('--user-data-dir={}'.format(cls.userDataDir))
 
         if isinstance(options, dict) and options.get(BROWSEPATH):
             BROWSER = options.get(BROWSEPATH)
 
-        CHROMESTARTUPARGS.insert(0, BROWSER)
+        startArgs.insert(0, BROWSER)
 
-        # cls._log.info(CHROMESTARTUPARGS)
         browserWSEndpoint = ''
-        cls._log.info('start paramters: {}'.format(CHROMESTARTUPARGS))
-        cls.browserPid = Popen(CHROMESTARTUPARGS, stdout=PIPE, stderr=STDOUT)
+        cls._log.info('start paramters: {}'.format(startArgs))
+        try:
+            cls.browserPid = Popen(startArgs, stdout=PIPE, stderr=STDOUT)
+        except OSError:
+            cls.closeBrowser(None, cls.userDataDir)
+            raise
 
         while cls.browserPid.poll() is None:
             line = cls.browserPid.stdout.readline()
@@ -72,11 +94,31 @@ class Launcher(object):
 
         cls._log.info('browserWSEndpoint {}'.format(browserWSEndpoint))
         if (browserWSEndpoint == ''):
+            cls.closeBrowser(cls.browserPid, cls.userDataDir)
             return None
 
         browser = Browser(browserWSEndpoint=browserWSEndpoint)
         return browser
 
+    @staticmethod
+    def closeBrowser(process, userDataDir: str = None, timeout: float = 10) -> None:
+        """
+        Stop a browser started by startBrowser and remove the profile created for it
+        :param process: Launcher.browserPid of the launch
+        :param userDataDir: Launcher.userDataDir of the launch
+        :param timeout: seconds to wait for the process to exit before the profile is removed
+        """
+        if process != None and process.poll() is None:
+            process.terminate()
+            try:
+                process.wait(timeout)
+            except Exception as e:
+                logging.getLogger('Launcher.Launcher').warning('browser {} still running: {}'.format(process.pid, e))
+        if process != None and process.stdout != None:
+            process.stdout.close()
+        if userDataDir:
+            shutil.rmtree(userDataDir, ignore_errors=True)
+
     @classmethod
     def killBrowser(cls):
         p1 = Popen(r'TASKLIST /FI "IMAGENAME eq chrome.exe"', stdin=PIPE, stdout=PIPE)
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import logging
+from collections import deque
+
+from MBrowser import EventLoop
+from MBrowser.Const import *
+
+__all__ = ['PagePool']
+
+
+class _Pooled(object):
+    __slots__ = ('page', 'uses', 'idleSince')
+
+    def __init__(self, page):
+        self.page = page
+        self.uses = 0
+        self.idleSince = 0.0
+
+
+class PagePool(object):
+    """
+    Pre-created, pre-enabled pages handed out to jobs and reset to about:blank when given back, so a job does not
+    pay for target creation, session attach and domain enabling, eg:
+
+            pool = await browser.createPagePool(size=4, maxSize=8)
+            async with pool.page() as page:
+                await page.goto(URL)
+
+    at most maxSize pages exist, idle pages over size are closed after idleTimeout, a page is closed instead of reused
+    once it served maxUses jobs, so the page list of the browser stays bounded
+    """
+
+    def __init__(self, browser, size: int = 2, maxSize: int = 8, idleTimeout: float = 60, maxUses: int = 50,
+                 clearCookies: bool = False, pageFactory=None, clearStorage: bool = False, clearCache: bool = False):
+        """
+        :param browser: Browser
+        :param size: pages kept ready, created by start
+        :param maxSize: max pages in the pool, idle and borrowed
+        :param idleTimeout: seconds an idle page over size is kept
+        :param maxUses: jobs a page serves before it is closed and replaced, None for no limit
+        :param clearCookies: clear the cookies when a page is given back
+        :param pageFactory: async function() -> Page, default browser.createPage
+        :param clearStorage: clear the storage of the origins a page visited when it is given back, see Page.reset
+        :param clearCache: clear the http cache when a page is given back
+        """
+        if size > maxSize:
+            raise ValueError('size {} is larger than maxSize {}'.format(size, maxSize))
+        self._browser = browser
+        self._size = size
+        self._maxSize = maxSize
+        self._idleTimeout = idleTimeout
+        self._maxUses = maxUses
+        self._clearCookies = clearCookies
+        self._clearStorage = clearStorage
+        self._clearCache = clearCache
+        self._pageFactory = pageFactory or browser.createPage
+        self._log = logging.getLogger('PagePool.PagePool')
+        self._idle = deque()
+        self._borrowed = {}
+        self._creating = 0
+        self._changed = asyncio.Condition()
+        self._reaper = None
+        self._closed = False
+        self.created = 0
+        self.recycled = 0
+        self.evicted = 0
+        self.acquired = 0
+
+    ################################# lifecycle #################################
+    async def start(self):
+        """
+        Create the size pages and start evicting idle ones
+        :return: self
+        """
+        await asyncio.gather(*[self._addIdle() for _ in range(self._size - self.total)])
+        if self._reaper == None and self._idleTimeout:
+            self._reaper = EventLoop.create_task(self._reap())
+        return self
+
+    async def close(self) -> None:
+        """
+        Close the idle pages, borrowed pages are closed when given back
+        """
+        self._closed = True
+        if self._reaper != None:
+            self._reaper.cancel()
+            self._reaper = None
+        while self._idle:
+            await self._closePage(self._idle.popleft().page)
+        async with self._changed:
+            self._changed.notify_all()
+
+    @property
+    def total(self) -> int:
+        return len(self._idle) + len(self._borrowed) + self._creating
+
+    def stats(self) -> dict:
+        return dict(idle=len(self._idle), borrowed=len(self._borrowed), created=self.created,
+                    recycled=self.recycled, evicted=self.evicted, acquired=self.acquired)
+
+    ################################# lifecycle #################################
+
+    ################################# borrow ####################################
+    async def acquire(self, timeout: float = TIMEOUT_S):
+        """
+        Borrow a page, a blank one when idle pages exist, a new one while the pool is below maxSize, otherwise wait
+        for a page to be given back
+        :param timeout: seconds, raise TimeoutError when reached
+        :return: Page, give it back by release
+        """
+        loop = asyncio.get_event_loop()
+        endTime = loop.time() + timeout
+        while True:
+            if self._closed:
+                raise RuntimeError('page pool is closed')
+            if self._idle:
+                pooled = self._idle.pop()
+                return self._lend(pooled)
+            if self.total < self._maxSize:
+                self._creating += 1
+                try:
+                    pooled = _Pooled(await self._pageFactory())
+                    self.created += 1
+                finally:
+                    self._creating -= 1
+                return self._lend(pooled)
+            left = endTime - loop.time()
+            if left <= 0:
+                raise TimeoutError('no page free in the pool after {}s'.format(timeout))
+            async with self._changed:
+                try:
+                    await asyncio.wait_for(self._changed.wait(), left)
+                except asyncio.TimeoutError:
+                    continue
+
+    async def release(self, page) -> None:
+        """
+        Give a borrowed page back, it is reset to about:blank, or closed when it served maxUses jobs or the reset
+        fails
+        """
+        pooled = self._borrowed.pop(id(page), None)
+        if pooled == None:
+            self._log.warning('release a page which is not borrowed from the pool')
+            return
+        reuse = not self._closed and (self._maxUses == None or pooled.uses < self._maxUses)
+        if reuse:
+            try:
+                await page.reset(self._clearCookies, clearStorage=self._clearStorage, clearCache=self._clearCache)
+            except Exception as e:
+                self._log.warning('reset page failed, close it: {}'.format(e))
+                reuse = False
+        if reuse:
+            pooled.idleSince = asyncio.get_event_loop().time()
+            self._idle.append(pooled)
+        else:
+            self.recycled += 1
+            await self._closePage(page)
+            if not self._closed and self.total < self._size:
+                EventLoop.create_task(self._addIdle())
+        async with self._changed:
+            self._changed.notify()
+
+    def page(self, timeout: float = TIMEOUT_S):
+        """
+        :return: async context manager borrowing a page and giving it back on exit
+        """
+        return _Borrow(self, timeout)
+
+    def _lend(self, pooled):
+        pooled.uses += 1
+        self._borrowed[id(pooled.page)] = pooled
+        self.acquired += 1
+        return pooled.page
+
+    ################################# borrow ####################################
+
+    async def _addIdle(self):
+        self._creating += 1
+        try:
+            pooled = _Pooled(await self._pageFactory())
+            self.created += 1
+        except Exception as e:
+            self._log.error('create page for the pool failed: {}'.format(e))
+            return
+        finally:
+            self._creating -= 1
+        pooled.idleSince = asyncio.get_event_loop().time()
+        self._idle.append(pooled)
+        async with self._changed:
+            self._changed.notify()
+
+    async def _closePage(self, page):
+        try:
+            await self._browser.closePage(page)
+        except Exception as e:
+            self._log.warning('close page failed: {}'.format(e))
+
+    async def _reap(self):
+        while True:
+            await asyncio.sleep(self._idleTimeout / 2)
+            now = asyncio.get_event_loop().time()
+            # oldest idle pages are at the left, the most recently given back are lent first
+            while len(self._idle) + len(self._borrowed) > self._size and self._idle and \
+                    now - self._idle[0].idleSince > self._idleTimeout:
+                self.evicted += 1
+                await self._closePage(self._idle.popleft().page)
+
+
+class _Borrow(object):
+    def __init__(self, pool: PagePool, timeout: float):
+        self._pool = pool
+        self._timeout = timeout
+        self._page = None
+
+    async def __aenter__(self):
+        self._page = await self._pool.acquire(self._timeout)
+        return self._page
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self._pool.release(self._page)
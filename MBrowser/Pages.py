@@ -4,13 +4,19 @@ import asyncio
 import logging
 from typing import Any
 
-from MBrowser import helper
+from MBrowser import EventLoop, helper
+from MBrowser.BodyCapture import BodyCapturePolicy
 from MBrowser.Const import *
+from MBrowser.DomSnapshot import DomSnapshot
 from MBrowser.EventEmitter import EventEmitter
+from MBrowser.ExecutionContext import HandleScope
 from MBrowser.FrameManager import Frame
 from MBrowser.FrameManager import FrameManager
-from MBrowser.HarParser import HarHandler
+from MBrowser.HarParser import HarHandler, HarWriter
+from MBrowser.HarReplay import HarArchive, replayHandler
+from MBrowser.HttpCache import HttpCache
 from MBrowser.Input import Keyboard, Mouse, Touchscreen
+from MBrowser.Interception import Interceptor, RequestRules
 from MBrowser.Session import Session
 
 __all__ = ['Page']
@@ -18,6 +24,10 @@ __all__ = ['Page']
 
 class Page(EventEmitter):
     def __init__(self, client: Session):
+        """
+        The domains the page relies on are enabled in the background, like before Page.create existed, goto waits for
+        them; use Page.create to have them enabled on return
+        """
         self._client = client
         self._log = logging.getLogger('Page.Page')
 
@@ -34,22 +44,129 @@ class Page(EventEmitter):
         self._mouse = Mouse(self._client, self._keyboard, self._log)
         self._touchscreen = Touchscreen(self._client, self._keyboard, self._log)
         self._frameManager = FrameManager(self._client, self)
+        self._interceptor = Interceptor(self._client)
+        self._replayHandler = None
+        self._requestRules = None
+        self._cache = None
 
         self._pageDone = False
         self._contextCreated = False
-        self._enable()
+        self.on(self._events, self._processPageEvent)
+        self._enabling = EventLoop.create_task(self._enable())
+
+    @staticmethod
+    async def create(client: Session):
+        """
+        Create a Page for a session and enable the domains it relies on
+        :param client: Session
+        :return: Page
+        """
+        page = Page(client)
+        await page._enabling
+        return page
 
-    def _enable(self) -> None:
-        self.emit(SE, 'Network.enable', {}),
-        self.emit(SE, 'Security.enable', {}),
-        self.emit(SE, 'Page.enable', {}),
-        self.emit(SE, 'Runtime.enable', {})
+    async def _enable(self) -> None:
+        results = await self._client.sendMany([('Network.enable', {}),
+                                               ('Security.enable', {}),
+                                               ('Page.enable', {}),
+                                               ('Runtime.enable', {})])
+        for result in results:
+            if not isinstance(result, dict) or result.get(ERROR):
+                self._log.error('enable domain failed: {}'.format(result))
 
-    def _startHar(self) -> None:
-        self._harhandler = HarHandler()
+    def _startHar(self, harFile: str = None, compact: bool = True, bodyPolicy: BodyCapturePolicy = None) -> None:
+        if self._harhandler != None:
+            self._log.debug('har recording already running, keep it')
+            return
+        writer = HarWriter(open(harFile, 'w', encoding='utf-8'), compact) if harFile else None
+        self._harhandler = HarHandler(writer, bodyPolicy)
         self._harhandler.start(self._client)
 
-    async def _processPageEvent(self, *arg: Any, **kargs: Any) -> None:
+    @property
+    def interceptor(self) -> Interceptor:
+        """
+        Fetch interception of this page, handlers added to it answer, block or continue the requests once enabled
+        """
+        return self._interceptor
+
+    async def setRequestRules(self, rules: list) -> RequestRules:
+        """
+        Block, continue or fulfill requests by declarative rules, the first matching rule wins and runs before the
+        other interception handlers, eg:
+
+                await page.setRequestRules([RequestRule('block', resourceTypes=['Image', 'Font', 'Media']),
+                                            RequestRule('block', hosts=['doubleclick.net']),
+                                            RequestRule('fulfill', urlGlob='*/api/ads*', body='{}')])
+
+        :param rules: list of RequestRule, replaces the rules set before, empty to remove them
+        :return: RequestRules, with the hit count of each rule in stats()
+        """
+        if self._requestRules != None:
+            self._interceptor.removeHandler(self._requestRules)
+            self._requestRules = None
+            await self._releaseInterception()
+        if not rules:
+            return None
+        self._requestRules = RequestRules(rules)
+        self._interceptor.addHandler(self._requestRules, first=True)
+        await self._interceptor.enable(self._requestRules.patterns())
+        return self._requestRules
+
+    async def useCache(self, cache: HttpCache) -> None:
+        """
+        Answer the cacheable requests of this page from a disk cache, one HttpCache can be shared by every page so
+        fresh tabs load the static assets other tabs already downloaded, eg:
+
+                cache = HttpCache('/data/mbrowser-cache')
+                await page.useCache(cache)
+                ...
+                cache.save()
+
+        :param cache: HttpCache, None to stop using the cache
+        """
+        if self._cache != None:
+            self._interceptor.removeHandler(self._cache.onRequest)
+            self._interceptor.removeHandler(self._cache.onResponse)
+            self._cache = None
+            await self._releaseInterception()
+        self._cache = cache
+        if cache == None:
+            return
+        self._interceptor.addHandler(cache.onRequest)
+        self._interceptor.addHandler(cache.onResponse, stage='Response')
+        await self._interceptor.enable(cache.patterns())
+
+    async def replayHar(self, archive: HarArchive, latencyScale: float = 0.0, passthrough: bool = False) -> None:
+        """
+        Answer the requests of this page from recorded HARs instead of the network, eg:
+
+                await page.replayHar(HarArchive.fromFiles(['jd.har']), latencyScale=1.0)
+                await page.goto(URL)
+
+        :param archive: HarArchive
+        :param latencyScale: wait the recorded timings times latencyScale before answering, 0 for no wait
+        :param passthrough: let requests without recording go to the network, default False to fail them
+        """
+        await self.stopReplay()
+        self._replayHandler = replayHandler(archive, latencyScale, passthrough)
+        self._interceptor.addHandler(self._replayHandler)
+        await self._interceptor.enable()
+
+    async def stopReplay(self) -> None:
+        if self._replayHandler != None:
+            self._interceptor.removeHandler(self._replayHandler)
+            self._replayHandler = None
+            await self._releaseInterception()
+
+    async def _releaseInterception(self) -> None:
+        """
+        Stop pausing requests once the last handler is gone, the browser would otherwise pause every request only to
+        continue it, handlers added later enable it again with their own patterns only
+        """
+        if not self._interceptor.hasHandlers:
+            await self._interceptor.disable()
+
+    def _processPageEvent(self, *arg: Any, **kargs: Any) -> None:
         (event_name, event) = arg
         if event_name == Page_frameStartedLoading:
             self._startFrameId = event.get('frameId')
@@ -77,25 +194,51 @@ class Page(EventEmitter):
 
     async def waitForPageLoadFinish(self, timeout: int = TIMEOUT_S) -> None:
         breakFunction = lambda: self._pageDone == True
-        await helper.waitFor(breakFunction, timeout)
+        await helper.waitFor(breakFunction, timeout, self, [Page_frameStoppedLoading])
 
-    async def getHar(self, filename: str) -> None:
+    async def getHar(self, filename: str = None, compact: bool = False) -> None:
+        """
+        Write the HAR of the recording started by goto and stop the recording, every main frame navigation since
+        the start is a page of the HAR
+        :param filename: file to write, not needed when goto was given a harFile, the entries are already streamed
+                         there and only the pages are left to write
+        :param compact: write without indent
+        :return: None
+        """
         self._log.info('Get har started')
-        await asyncio.sleep(3)
-        with open(filename, 'w') as fileHanlder:
-            if self._harhandler != None:
-                await self._harhandler.getHar(fileHanlder)
-                self._harhandler.stop()
-                self._log.info('Get Har done')
+        if self._harhandler == None:
+            self._log.error('Harhandler not started, so get har failed.')
+            return
+        try:
+            if self._harhandler.streaming():
+                await self._harhandler.finish()
             else:
-                self._log.error('Harhandler not started, so get har failed.')
+                with open(filename, 'w') as fileHanlder:
+                    await self._harhandler.getHar(fileHanlder, compact=compact)
+        finally:
+            self._harhandler.stop()
+            self._harhandler = None
+        self._log.info('Get Har done')
 
     async def goto(self, url: str, transitionType: str = 'https', referrer: str = None, startHarRecord: bool = False,
-                   waitFinish: bool = True) -> None:
+                   waitFinish: bool = True, harFile: str = None, compactHar: bool = True,
+                   harBodyPolicy: BodyCapturePolicy = None) -> None:
+        """
+        Navigate to url
+        :param startHarRecord: start recording a HAR, it keeps running over the following navigations, clicks and
+                               goto calls until getHar, each main frame navigation becomes its own page
+        :param harFile: with startHarRecord, stream each entry to this file once complete instead of keeping the
+                        whole log in memory, getHar finishes the file
+        :param compactHar: write harFile without indent
+        :param harBodyPolicy: BodyCapturePolicy, which response bodies the recording fetches, by mime type, size and
+                              url, with how many workers and where they are stored
+        """
+        if not self._enabling.done():
+            # a Page built directly, the navigation must not overtake the enable commands
+            await self._enabling
         if startHarRecord:
-            self._startHar()
+            self._startHar(harFile, compactHar, harBodyPolicy)
         self._pageDone = False
-        self.on(self._events, self._processPageEvent)
 
         if referrer == None:
             self.emit(SE, "Page.navigate", dict(url=url, transitionType=transitionType))
@@ -105,6 +248,60 @@ class Page(EventEmitter):
         if waitFinish:
             await self.waitForPageLoadFinish()
 
+    async def reset(self, clearCookies: bool = False, timeout: int = TIMEOUT_S, clearStorage: bool = False,
+                    clearCache: bool = False) -> None:
+        """
+        Bring the page back to a blank state so it can be reused for another job: stop the HAR recording, the
+        interception handlers, request rules, replay and cache, then navigate to about:blank
+        :param clearCookies: also clear the cookies, they are shared by every page of the browser context
+        :param timeout: seconds to wait for about:blank
+        :param clearStorage: also clear the sessionStorage of the page and the localStorage, IndexedDB, Cache Storage
+                             and service workers of the origins of its frames, shared by the browser context too
+        :param clearCache: also clear the http cache of the browser
+        """
+        if self._harhandler != None:
+            if self._harhandler.streaming():
+                self._log.warning('reset drops the unfinished har recording')
+            self._harhandler.abort()
+            self._harhandler = None
+        self._requestRules = None
+        self._replayHandler = None
+        self._cache = None
+        await self._interceptor.reset()
+        commands = []
+        if clearCookies:
+            commands.append(('Network.clearBrowserCookies', {}))
+        if clearStorage:
+            commands.extend(await self._clearStorageCommands())
+        if clearCache:
+            commands.append(('Network.clearBrowserCache', {}))
+        for result in await self._client.sendMany(commands) if commands else []:
+            if not isinstance(result, dict) or result.get(ERROR):
+                self._log.warning('clear page state failed: {}'.format(result))
+        self._pageDone = False
+        self.emit(SE, 'Page.navigate', dict(url=BLACKPAGE))
+        await self.waitForPageLoadFinish(timeout)
+
+    async def _clearStorageCommands(self) -> list:
+        """
+        :return: commands clearing the storage of the origins of every frame, sessionStorage is per tab and only
+                 cleared from the page itself
+        """
+        (tree, _) = await self._client.sendMany([
+            ('Page.getFrameTree', {}),
+            ('Runtime.evaluate', dict(expression='try { sessionStorage.clear() } catch (e) {}'))])
+        frameTree = tree.get(RESULT, {}).get('frameTree') if isinstance(tree, dict) else None
+        origins = set()
+        frames = [frameTree] if frameTree else []
+        while frames:
+            frame = frames.pop()
+            origin = frame.get('frame').get('securityOrigin')
+            if origin and origin != '://' and origin != 'null':
+                origins.add(origin)
+            frames.extend(frame.get('childFrames') or [])
+        return [('Storage.clearDataForOrigin', dict(origin=origin, storageTypes=STORAGE_TYPES))
+                for origin in sorted(origins)]
+
     async def types(self, text: str, options: dict = {}) -> None:
         delay = 0
         if options and options.get('delay'):
@@ -153,22 +350,59 @@ class Page(EventEmitter):
         return await self._frameManager.mainFrame().evaluate(pageFunction, *args)
 
     async def evaluateHandle(self, pageFunction, *args):
-        return self.mainFrame().executionContext().evaluateHandle(pageFunction, *args)
+        return await self.mainFrame().executionContext().evaluateHandle(pageFunction, *args)
 
     async def queryObjects(self, prototypeHandle):
-        return self.mainFrame().executionContext().queryObjects(prototypeHandle)
+        return await self.mainFrame().executionContext().queryObjects(prototypeHandle)
+
+    def handleScope(self) -> HandleScope:
+        """
+        Create a scope releasing every handle created inside it with one call on exit, eg:
+
+                async with page.handleScope():
+                    await page.click(selector)
+                    handle = await page.S(selector)
+
+        :return: HandleScope, an async context manager
+        """
+        return HandleScope(self._client)
 
     def url(self):
         return self.mainFrame().url()
 
-    async def evalateFromList(self, list_selector: str, itemDict: dict):
+    @property
+    def targetId(self) -> str:
+        return self._client.targetId
+
+    async def captureSnapshot(self) -> DomSnapshot:
+        """
+        Capture the document once as flat arrays, selectors are then resolved in python without round trips, eg:
+
+                snapshot = await page.captureSnapshot()
+                goods = snapshot.extract(list_selector, itemDict)
+                links = snapshot.querySelectorAll('a[href]')
+
+        :return: DomSnapshot
+        """
+        resp = await self._client.send('DOMSnapshot.captureSnapshot', dict(computedStyles=[]))
+        if not resp or resp.get(ERROR):
+            raise RuntimeError('captureSnapshot failed: {}'.format(resp))
+        return DomSnapshot(resp.get(RESULT))
+
+    async def evalateFromList(self, list_selector: str, itemDict: dict, useSnapshot: bool = False):
         """
         get item attubutes from a form of the page
 
         :param list_selector: selector to form of the page
         :param itemDict: dict, selector dict, {'key1':selectorValue, 'key2': selectorValue}
+        :param useSnapshot: resolve the selectors over a DOMSnapshot capture in python instead of running
+                            querySelector in the page, no layout is forced, text is whitespace collapsed textContent,
+                            and missing fields are None
         :return: [{'key1': value, 'key2': value}]
         """
+        if useSnapshot:
+            snapshot = await self.captureSnapshot()
+            return snapshot.extract(list_selector, itemDict)
         return await self.evaluate(r'''(slist, optionsDict) => {
                 return Array.prototype.slice.apply(document.querySelectorAll(slist))
                 .map($itemoflist => {
@@ -180,3 +414,26 @@ class Page(EventEmitter):
         			}
         			return result;
                 })}''', list_selector, itemDict)
+
+    def evalateFromListChunks(self, list_selector: str, itemDict: dict, chunkSize: int = 100):
+        """
+        Same rows as evalateFromList, pulled from the page chunkSize rows per round trip, eg:
+
+                async for rows in page.evalateFromListChunks(list_selector, itemDict):
+                    save(rows)
+
+        :param list_selector: selector to form of the page
+        :param itemDict: dict, selector dict, {'key1':selectorValue, 'key2': selectorValue}
+        :param chunkSize: rows per chunk
+        :return: async generator of [{'key1': value, 'key2': value}]
+        """
+        return self.mainFrame().executionContext().evaluateChunks(
+            r'slist => document.querySelectorAll(slist)', list_selector, itemDict,
+            mapFunction=r'''($itemoflist, slist, optionsDict) => {
+                    const result = {};
+                    for (var key in optionsDict) {
+                        const $item = $itemoflist.querySelector(optionsDict[key]);
+                        result[key] = $item ? $item.innerText : undefined;
+                    }
+                    return result;
+                }''', chunkSize=chunkSize)
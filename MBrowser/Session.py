@@ -1,66 +1,264 @@
 # -*- coding: utf-8 -*-
 
 import asyncio
-import json
 import logging
+import time
+from collections import deque
 
-from MBrowser import EventLoop
+from MBrowser import Codec, EventLoop
 from MBrowser.Const import *
 from MBrowser.EventEmitter import EventEmitter
 
 __all__ = ['Session']
 
+# events which may be merged into a queued event of the same key when the queue is full, method -> key param, and
+# the params summed by the merge
+COALESCE = {Network_dataReceived: (RID, ('dataLength', 'encodedDataLength'))}
+
 
 class Session(EventEmitter):
-    def __init__(self, connection, targetId: str, sessionId: str):
+    """
+    Commands and events of one target
+
+    events are put in a bounded queue drained by the dispatcher task of this Session, so a slow listener only delays
+    the events of its own tab; an ack is resolved by the receive loop of the Connection when nothing is queued, and
+    otherwise queued behind the events received before it, so a command returns once they are handled;
+    the receive loop never waits for a session, when the queue is full the overflow policy applies to this session
+    only: OVERFLOW_COALESCE merges the event into a queued one of the same request when it can (COALESCE) and drops
+    the oldest event otherwise, OVERFLOW_DROP_OLDEST and OVERFLOW_DROP_NEWEST drop an event right away, queueStats
+    tells how far behind the tab is
+    """
+
+    def __init__(self, connection, targetId: str, sessionId: str, flatten: bool = False,
+                 maxQueue: int = DISPATCH_QUEUE_SIZE, overflow: str = OVERFLOW_COALESCE):
+        """
+        :param maxQueue: events waiting for the dispatcher at most
+        :param overflow: OVERFLOW_COALESCE, OVERFLOW_DROP_OLDEST or OVERFLOW_DROP_NEWEST
+        """
+        if overflow not in (OVERFLOW_COALESCE, OVERFLOW_DROP_OLDEST, OVERFLOW_DROP_NEWEST):
+            raise ValueError('unknown overflow policy {}'.format(overflow))
         self._log = logging.getLogger('Browser.Session')
         self._connection = connection
         self._targetId = targetId
         self._sessionId = sessionId
+        self._flatten = flatten
         self._msgid = 0
         self._sessionAcks = {}
+        self._maxQueue = maxQueue
+        self._overflow = overflow
+        # (enqueue time, event)
+        self._events = deque()
+        # (method, key) -> queued event a COALESCE event can be merged into
+        self._mergeable = {}
+        self._eventReady = asyncio.Event()
+        self._behind = False
+        self._enqueued = 0
+        self._dispatched = 0
+        self._dropped = 0
+        self._coalesced = 0
+        self._maxDepth = 0
+        self._dispatchTime = 0.0
+        self._dispatcher = EventLoop.create_task(self._dispatch())
         self.on(SE, self.send)
 
+    @property
+    def targetId(self) -> str:
+        return self._targetId
+
+    @property
+    def sessionId(self) -> str:
+        return self._sessionId
+
     def __msgid(self):
         self._msgid = self._msgid + 1
         return self._msgid
 
-    def _onMessage(self, msg: str):
-        event = json.loads(msg)
+    def _onMessage(self, msg):
+        """
+        Handle a message for this session, an event is queued for the dispatcher, an ack is resolved here or queued
+        behind the events waiting for the dispatcher
+        :param msg: dict already decoded by the Connection in flattened mode, otherwise the JSON string carried by
+                    Target.receivedMessageFromTarget
+        :return: None
+        """
+        event = msg if isinstance(msg, dict) else Codec.loads(msg)
         if event.get(METHOD):
             self._log.debug('◀ RECV Event: {} '.format(event.get(METHOD)))
-            self.emit(event.get(METHOD), event.get(METHOD), event.get(PARAMS))
+            self._enqueue(event)
             return
         if event.get(ID):
             self._log.debug('◀ RECV ACK with msgid: {}'.format(event.get(ID)))
-            fat = self._sessionAcks.get(event.get(ID))
-            if event.get(ERROR):
-                self._log.error('Session get Error Response: {}'.format(event))
-            if fat:
-                self._sessionAcks.pop(event.get(ID))
-                fat.set_result(event)
-            else:
-                self._log.warning('Not found ackcallback {}'.format(event))
+            if self._events and self._dispatcher != None:
+                # acks are never dropped
+                self._events.append((time.monotonic(), event))
+                return
+            self._resolveAck(event)
             return
 
+    def _resolveAck(self, event: dict) -> None:
+        fat = self._sessionAcks.get(event.get(ID))
+        if event.get(ERROR):
+            self._log.error('Session get Error Response: {}'.format(event))
+        if fat:
+            self._sessionAcks.pop(event.get(ID))
+            if not fat.done():
+                fat.set_result(event)
+        else:
+            self._log.warning('Not found ackcallback {}'.format(event))
+
     def _onClosed(self):
-        pass
+        if self._dispatcher != None:
+            self._dispatcher.cancel()
+            self._dispatcher = None
+        for (_, event) in self._events:
+            if not event.get(METHOD):
+                self._resolveAck(event)
+        self._events.clear()
+        self._mergeable.clear()
+
+    ################################# dispatch ##################################
+    def _enqueue(self, event: dict) -> None:
+        if len(self._events) >= self._maxQueue:
+            if self._overflow == OVERFLOW_COALESCE and self._coalesce(event):
+                return
+            self._dropped += 1
+            if self._overflow == OVERFLOW_DROP_NEWEST:
+                self._log.debug('queue of session {} full, drop {}'.format(self._sessionId, event.get(METHOD)))
+                return
+            while self._events:
+                (_, oldest) = self._events.popleft()
+                if oldest.get(METHOD):
+                    self._forget(oldest)
+                    break
+                # an ack ahead of the dropped event, the events before it are handled already
+                self._resolveAck(oldest)
+        self._events.append((time.monotonic(), event))
+        self._enqueued += 1
+        rule = COALESCE.get(event.get(METHOD))
+        if rule != None:
+            self._mergeable[(event.get(METHOD), (event.get(PARAMS) or {}).get(rule[0]))] = event
+        depth = len(self._events)
+        if depth > self._maxDepth:
+            self._maxDepth = depth
+        if not self._behind and depth >= self._maxQueue // 2:
+            self._behind = True
+            self._log.warning('session {} is falling behind, {} events queued'.format(self._sessionId, depth))
+        self._eventReady.set()
+
+    def _coalesce(self, event: dict) -> bool:
+        """
+        Merge event into the queued event of the same method and key
+        :return: False when event is not a COALESCE event or no such event is queued
+        """
+        rule = COALESCE.get(event.get(METHOD))
+        if rule == None:
+            return False
+        params = event.get(PARAMS) or {}
+        queued = self._mergeable.get((event.get(METHOD), params.get(rule[0])))
+        if queued == None:
+            return False
+        merged = queued.get(PARAMS)
+        for name in rule[1]:
+            merged[name] = merged.get(name, 0) + params.get(name, 0)
+        self._coalesced += 1
+        return True
+
+    def _forget(self, event: dict) -> None:
+        rule = COALESCE.get(event.get(METHOD))
+        if rule != None:
+            key = (event.get(METHOD), (event.get(PARAMS) or {}).get(rule[0]))
+            if self._mergeable.get(key) is event:
+                self._mergeable.pop(key)
+
+    async def _dispatch(self):
+        while True:
+            if not self._events:
+                self._eventReady.clear()
+                await self._eventReady.wait()
+                continue
+            # listeners run synchronously, coroutine listeners as tasks, so the dispatcher yields between batches
+            for _ in range(min(len(self._events), DISPATCH_BATCH)):
+                (_, event) = self._events.popleft()
+                if not event.get(METHOD):
+                    self._resolveAck(event)
+                    continue
+                self._forget(event)
+                startTime = time.monotonic()
+                self.dispatch(event.get(METHOD), event.get(METHOD), event.get(PARAMS))
+                self._dispatchTime += time.monotonic() - startTime
+                self._dispatched += 1
+            if self._behind and len(self._events) < self._maxQueue // 4:
+                self._behind = False
+                self._log.info('session {} caught up'.format(self._sessionId))
+            await asyncio.sleep(0)
+
+    def queueStats(self) -> dict:
+        """
+        :return: depth and maxDepth of the event queue, lag in seconds of the oldest queued event, enqueued,
+                 dispatched, dropped and coalesced events and seconds spent in its listeners
+        """
+        lag = time.monotonic() - self._events[0][0] if self._events else 0.0
+        return dict(depth=len(self._events), maxDepth=self._maxDepth, lag=lag, enqueued=self._enqueued,
+                    dispatched=self._dispatched, dropped=self._dropped, coalesced=self._coalesced,
+                    dispatchTime=self._dispatchTime)
+
+    ################################# dispatch ##################################
 
     async def send(self, method: str, params: dict = None) -> object:
         msgid = self.__msgid()
-
-        command = json.dumps(dict(id=msgid, method=method, params=params))
+        message = dict(id=msgid, method=method, params=params)
         try:
-            if command and self._connection:
+            if self._connection:
                 fat = EventLoop.create_future()
                 self._sessionAcks[msgid] = fat
-                await self._connection.send('Target.sendMessageToTarget',
-                                            dict(sessionId=self._sessionId, message=command))
-                self._log.info('SEND ▶  msgid: {} msg: {}'.format(msgid, command))
+                if self._flatten:
+                    message[SID] = self._sessionId
+                    await self._connection.sendRaw(message)
+                else:
+                    await self._connection.send('Target.sendMessageToTarget',
+                                                dict(sessionId=self._sessionId, message=Codec.dumps(message)))
+                self._log.info('SEND ▶  msgid: {} method: {}'.format(msgid, method))
                 return await asyncio.wait_for(fat, TIMEOUT_S)
             else:
-                self._log.error('command {} and connection {} error'.format(command, self._connection))
+                self._log.error('command {} and connection {} error'.format(method, self._connection))
         except TimeoutError as e:
             self._log.error('time out for msgid: {} method: {}'.format(msgid, method))
-            self._sessionAcks.pop(msgid)
+            self._sessionAcks.pop(msgid, None)
         return None
+
+    async def sendMany(self, commands: list, timeout: int = TIMEOUT_S) -> list:
+        """
+        Pipeline commands: write all of them back to back, then wait for all the acks together, so N commands
+        cost about one round trip instead of N
+        :param commands: list of (method, params)
+        :param timeout: timeout for the whole batch
+        :return: list of responses in the same order as commands, a failed command gets its error response, None or
+                 its exception, it does not affect the others
+        """
+        msgids = []
+        futures = []
+        messages = []
+        for method, params in commands:
+            msgid = self.__msgid()
+            fat = EventLoop.create_future()
+            self._sessionAcks[msgid] = fat
+            msgids.append(msgid)
+            futures.append(fat)
+            messages.append(dict(id=msgid, method=method, params=params))
+        if self._flatten:
+            for message, fat in zip(messages, futures):
+                message[SID] = self._sessionId
+                try:
+                    await self._connection.sendRaw(message)
+                except Exception as e:
+                    self._log.exception(e)
+                    fat.set_exception(e)
+        else:
+            await self._connection.sendMany(
+                [('Target.sendMessageToTarget', dict(sessionId=self._sessionId, message=Codec.dumps(message)))
+                 for message in messages], timeout)
+        self._log.info('SEND ▶  {} msgs: {}'.format(len(messages), [message.get(METHOD) for message in messages]))
+        results = await asyncio.gather(*[asyncio.wait_for(fat, timeout) for fat in futures], return_exceptions=True)
+        for msgid in msgids:
+            self._sessionAcks.pop(msgid, None)
+        return results
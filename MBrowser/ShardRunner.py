@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+
+"""
+Run a large crawl over several worker processes, each with its own event loop, Connection, browser and
+CrawlScheduler, so decoding, event dispatch and HAR writing use one core per worker instead of sharing one loop
+
+jobs are sharded by host, the jobs of one host go round robin to a few workers and the per-host concurrency and QPS
+limits of CrawlScheduler are divided between them, so the limits hold for the whole crawl and a crawl of one large
+host still uses several cores; results come back to the coordinator over a queue, HARs are spooled by the workers to
+files the results point to
+"""
+
+import asyncio
+import importlib
+import logging
+import multiprocessing
+import os
+import pickle
+import queue
+import time
+import zlib
+from urllib.parse import urlsplit
+
+from MBrowser import EventLoop
+from MBrowser.Browser import Browser
+from MBrowser.Const import *
+from MBrowser.Crawler import HOST_CONCURRENCY, CrawlScheduler
+from MBrowser.Launcher import Launcher
+
+__all__ = ['ShardRunner', 'harHandler']
+
+# results the coordinator waits for a worker before it checks the workers are still alive, seconds
+POLL_S = 1.0
+
+
+async def harHandler(page, job):
+    """
+    Job handler of ShardRunner(recordHar=True), navigate to job.url, stream its HAR to job.meta['harFile']
+    :return: url of the page once loaded
+    """
+    await page.goto(job.url, startHarRecord=True, waitFinish=False, harFile=job.meta.get('harFile'))
+    try:
+        await page.waitForPageLoadFinish(job.timeout)
+    finally:
+        # a page which did not load still gets its HAR file closed
+        await page.getHar()
+    return page.url()
+
+
+def _resolve(handler):
+    """
+    :param handler: None, callable or 'package.module:function', workers are spawned so a handler has to be
+                    importable there, a lambda or a nested function is not
+    """
+    if handler == None or callable(handler):
+        return handler
+    (module, _, name) = handler.partition(':')
+    return getattr(importlib.import_module(module), name)
+
+
+def _workerMain(index: int, config: dict, jobs, results):
+    """
+    Entry of a worker process: start or connect a browser, run the jobs of its shard, put one message per finished
+    job on results, then ('done', index, stats)
+    """
+    log = logging.getLogger('ShardRunner.worker{}'.format(index))
+    browser = None
+    launch = None
+    try:
+        endpoints = config.get('endpoints')
+        if endpoints:
+            browser = Browser(endpoints[index % len(endpoints)])
+        else:
+            options = dict(config.get('launchOptions') or {})
+            # every worker launches its own browser, on a temporary profile of its own unless launchOptions give one
+            options[KILLEXISTING] = False
+            browser = Launcher.startBrowser(options)
+            launch = (Launcher.browserPid, Launcher.userDataDir)
+            if browser == None:
+                raise RuntimeError('launch browser failed')
+        # EventLoop.loop is created when the package is imported, so it is a loop of this process only
+        EventLoop.loop.run_until_complete(browser.connect())
+        EventLoop.loop.run_until_complete(_serve(index, config, browser, jobs, results))
+    except Exception as e:
+        log.exception(e)
+        results.put(('failed', index, '{}: {}'.format(type(e).__name__, e)))
+    finally:
+        if browser != None:
+            browser.disconnect()
+        if launch != None:
+            Launcher.closeBrowser(*launch)
+
+
+async def _serve(index: int, config: dict, browser: Browser, jobs, results):
+    spoolDir = config.get('spoolDir')
+    recordHar = config.get('recordHar')
+    # jobs taken from the shard queue and not finished yet, enough to keep every page busy
+    window = config.get('pages') * 2
+    taken = [0]
+
+    def onResult(job):
+        taken[0] -= 1
+        result = dict(id=job.meta.get('id'), url=job.url, ok=job.ok, result=job.result,
+                      error='{}: {}'.format(type(job.error).__name__, job.error) if job.error != None else None,
+                      attempts=job.attempts, queueTime=job.queueTime, runTime=job.runTime,
+                      harFile=job.meta.get('harFile'))
+        try:
+            pickle.dumps(job.result)
+        except Exception as e:
+            # the queue pickles in a feeder thread which only logs the failure, the job would be lost silently
+            logging.getLogger('ShardRunner.worker{}'.format(index)).error(
+                'result of {} is not picklable: {}'.format(job.url, e))
+            result.update(ok=False, result=None,
+                          error='result is not picklable: {}: {}'.format(type(e).__name__, e))
+        results.put(('result', index, result))
+
+    options = dict(config.get('schedulerOptions') or {})
+    handler = harHandler if recordHar else _resolve(options.pop('handler', None))
+    if handler != None:
+        options['handler'] = handler
+    # the results go to the coordinator, the scheduler does not keep them
+    scheduler = CrawlScheduler(browser, pages=config.get('pages'), onResult=onResult, keepFinished=False, **options)
+    running = EventLoop.create_task(scheduler.run(keepOpen=True))
+    # the scheduler ends early when it can create no page
+    while not running.done():
+        if taken[0] >= window:
+            await asyncio.sleep(0.05)
+            continue
+        try:
+            spec = jobs.get_nowait()
+        except queue.Empty:
+            # the blocking get runs in a thread so the pages keep working meanwhile
+            spec = await EventLoop.loop.run_in_executor(None, jobs.get)
+        if spec == None:
+            break
+        meta = dict(spec.get('meta') or {}, id=spec.get('id'))
+        if recordHar:
+            meta['harFile'] = os.path.join(spoolDir, '{}.har'.format(spec.get('id')))
+        taken[0] += 1
+        scheduler.add(spec.get('url'), spec.get('priority') or 0, _resolve(spec.get('handler')), spec.get('timeout'),
+                      meta)
+    scheduler.close()
+    await running
+    results.put(('done', index, scheduler.stats()))
+
+
+class ShardRunner(object):
+    """
+    Coordinator of the worker processes, eg:
+
+            runner = ShardRunner(workers=8, launchOptions={BROWSEPATH: BROWSER, HEADLESS: True}, pagesPerWorker=4,
+                                 spoolDir='hars', recordHar=True, hostQps=2.0)
+            results = runner.run(['https://www.jd.com', dict(url='https://item.jd.com/1.html', priority=5)])
+
+    each worker launches its own browser, or connects to one of endpoints, round robin; a job is a url or a dict
+    with url and optional priority, handler, timeout and meta, a handler is a module level function or a
+    'package.module:function' string because the workers are spawned, and its return value has to be picklable, a
+    job whose result is not fails with an error saying so
+    """
+
+    def __init__(self, workers: int = None, launchOptions: dict = None, endpoints: list = None,
+                 pagesPerWorker: int = 4, spoolDir: str = None, recordHar: bool = False, onResult=None,
+                 hostSpread: int = None, **schedulerOptions):
+        """
+        :param workers: worker processes, default os.cpu_count()
+        :param launchOptions: Launcher.startBrowser options of the browser every worker starts, each browser gets a
+                              temporary profile of its own, a --user-data-dir in ARGS is shared by every worker so
+                              it only suits workers=1
+        :param endpoints: browserWSEndpoint of running browsers the workers connect to instead of launching
+        :param pagesPerWorker: pages of each worker running jobs at the same time
+        :param spoolDir: directory the HARs are written to, one file per job named by job id
+        :param recordHar: record a HAR of every job with harHandler instead of the handler of schedulerOptions,
+                          needs spoolDir, a job with its own handler finds the file to write in job.meta['harFile']
+        :param onResult: function(result: dict) called in the coordinator for every finished job
+        :param hostSpread: workers the jobs of one host are spread over, each gets hostConcurrency / hostSpread
+                           (rounded down) and hostQps / hostSpread, default as many as hostConcurrency allows, at
+                           most workers
+        :param schedulerOptions: CrawlScheduler options of every worker, e.g. hostConcurrency, hostQps, retries,
+                                 timeout, handler
+        """
+        if recordHar and not spoolDir:
+            raise ValueError('recordHar needs a spoolDir')
+        self._workers = workers or os.cpu_count()
+        hostConcurrency = schedulerOptions.get('hostConcurrency', HOST_CONCURRENCY)
+        self._hostSpread = min(hostSpread or self._workers, self._workers)
+        if hostConcurrency:
+            # every worker of a host keeps at least one job of it running
+            self._hostSpread = min(self._hostSpread, hostConcurrency)
+            schedulerOptions['hostConcurrency'] = hostConcurrency // self._hostSpread
+        if schedulerOptions.get('hostQps'):
+            schedulerOptions['hostQps'] = schedulerOptions.get('hostQps') / self._hostSpread
+        self._config = dict(launchOptions=launchOptions, endpoints=endpoints, pages=pagesPerWorker,
+                            spoolDir=os.path.abspath(spoolDir) if spoolDir else None, recordHar=recordHar,
+                            schedulerOptions=schedulerOptions)
+        self._onResult = onResult
+        self._log = logging.getLogger('ShardRunner.ShardRunner')
+        self.workerStats = {}
+        self.elapsed = 0.0
+
+    def shardOf(self, url: str, seq: int = 0) -> int:
+        """
+        :param seq: number of the job among the jobs of its host, they go round robin over hostSpread workers
+        :return: index of the worker the job goes to
+        """
+        host = (urlsplit(url).hostname or '').lower()
+        return (zlib.crc32(host.encode('utf-8')) + seq % self._hostSpread) % self._workers
+
+    def run(self, jobs: list) -> list:
+        """
+        Run every job and wait for them, blocking, call it from the main module under if __name__ == '__main__'
+        :param jobs: list of url or dict(url=, priority=, handler=, timeout=, meta=)
+        :return: list of result dict(id, url, ok, result, error, attempts, queueTime, runTime, harFile, worker), one
+                 per job in jobs order, jobs lost with a crashed worker have ok False and error set
+        """
+        if self._config.get('spoolDir'):
+            os.makedirs(self._config.get('spoolDir'), exist_ok=True)
+        specs = [dict(url=job) if isinstance(job, str) else dict(job) for job in jobs]
+        context = multiprocessing.get_context('spawn')
+        shards = [context.Queue() for _ in range(self._workers)]
+        results = context.Queue()
+        hostJobs = {}
+        assigned = {}
+        for (jobId, spec) in sorted(enumerate(specs), key=lambda item: -(item[1].get('priority') or 0)):
+            spec['id'] = jobId
+            host = (urlsplit(spec.get('url')).hostname or '').lower()
+            seq = hostJobs[host] = hostJobs.get(host, -1) + 1
+            assigned[jobId] = self.shardOf(spec.get('url'), seq)
+            shards[assigned[jobId]].put(spec)
+        for shard in shards:
+            shard.put(None)
+
+        startTime = time.monotonic()
+        processes = [context.Process(target=_workerMain, args=(index, self._config, shards[index], results),
+                                     name='MBrowser-shard-{}'.format(index), daemon=True)
+                     for index in range(self._workers)]
+        for process in processes:
+            process.start()
+        self._log.info('{} jobs sharded over {} workers, {} per host'.format(len(specs), self._workers,
+                                                                             self._hostSpread))
+
+        collected = {}
+        ended = set()
+        while len(ended) < len(processes):
+            try:
+                (kind, index, payload) = results.get(timeout=POLL_S)
+            except queue.Empty:
+                for (index, process) in enumerate(processes):
+                    if index not in ended and not process.is_alive():
+                        self._log.error('worker {} exited with code {}'.format(index, process.exitcode))
+                        ended.add(index)
+                continue
+            if kind == 'result':
+                payload['worker'] = index
+                collected[payload.get('id')] = payload
+                if self._onResult != None:
+                    self._onResult(payload)
+                if len(collected) % 100 == 0:
+                    self._log.info('{}/{} jobs done'.format(len(collected), len(specs)))
+            elif kind == 'done':
+                self.workerStats[index] = payload
+                ended.add(index)
+            else:
+                self._log.error('worker {} failed: {}'.format(index, payload))
+                ended.add(index)
+        for process in processes:
+            process.join(POLL_S)
+        self.elapsed = time.monotonic() - startTime
+
+        output = []
+        for (jobId, spec) in enumerate(specs):
+            output.append(collected.get(jobId) or dict(id=jobId, url=spec.get('url'), ok=False, result=None,
+                                                       error='worker {} ended before the job ran'.format(
+                                                           assigned[jobId]),
+                                                       attempts=0, queueTime=0.0, runTime=0.0, harFile=None,
+                                                       worker=assigned[jobId]))
+        self._log.info('{} jobs in {:.1f}s, {} failed'.format(len(output), self.elapsed,
+                                                             len([result for result in output if not result['ok']])))
+        return output
+
+    def stats(self) -> dict:
+        """
+        :return: throughput of the last run and the CrawlScheduler stats of every worker
+        """
+        done = sum(stats.get('succeeded') + stats.get('failed') for stats in self.workerStats.values())
+        return dict(elapsed=self.elapsed, throughput=done / self.elapsed if self.elapsed else 0.0,
+                    workers=self.workerStats)
@@ -8,19 +8,32 @@ __version__ = '0.0.1'
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s %(filename)s[line:%(lineno)d] %(levelname)s:  %(message)s')
 
-from MBrowser.Browser import Browser
+from MBrowser.BodyCapture import BodyCapturePolicy
+from MBrowser.Browser import Browser, BrowserContext
+from MBrowser.ConnectionPool import ConnectionPool
+from MBrowser.Crawler import CrawlJob, CrawlScheduler
+from MBrowser.DomSnapshot import DomSnapshot
 from MBrowser.ElementHandle import ElementHandle
 from MBrowser.EventEmitter import EventEmitter
 from MBrowser.EventLoop import execute, create_task, create_future
-from MBrowser.ExecutionContext import ExecutionContext, JSHandle
+from MBrowser.ExecutionContext import ExecutionContext, HandleScope, JSHandle
 from MBrowser.FrameManager import Frame, FrameManager
+from MBrowser.HarAnalytics import HarTable
+from MBrowser.HarReplay import HarArchive, HarReplayServer
+from MBrowser.HttpCache import HttpCache
 from MBrowser.helper import waitFor
 from MBrowser.Input import Keyboard, Mouse, Touchscreen
+from MBrowser.Interception import InterceptedRequest, Interceptor, RequestRule
 from MBrowser.Launcher import Launcher
+from MBrowser.PagePool import PagePool
 from MBrowser.Pages import Page
 from MBrowser.Session import Session
+from MBrowser.ShardRunner import ShardRunner
 import MBrowser.Const as Const
+import MBrowser.Codec as Codec
 
-__all__ = ['Browser', 'ElementHandle', 'EventEmitter', 'execute', 'create_task', 'create_future',
-           'ExecutionContext', 'JSHandle', 'Frame', 'FrameManager', 'waitFor', 'Keyboard', 'Mouse',
-           'Touchscreen', 'Launcher', 'Page', 'Session', 'Const']
+__all__ = ['BodyCapturePolicy', 'Browser', 'BrowserContext', 'ConnectionPool', 'CrawlJob', 'CrawlScheduler',
+           'DomSnapshot', 'ElementHandle', 'EventEmitter', 'execute', 'create_task', 'create_future',
+           'ExecutionContext', 'HandleScope', 'JSHandle', 'Frame', 'FrameManager', 'HarArchive', 'HarReplayServer',
+           'HarTable', 'HttpCache', 'waitFor', 'InterceptedRequest', 'Interceptor', 'Keyboard', 'Mouse', 'RequestRule',
+           'Touchscreen', 'Launcher', 'Page', 'PagePool', 'Session', 'ShardRunner', 'Const', 'Codec']
@@ -4,6 +4,7 @@
 import asyncio
 import logging
 import math
+import re
 import sys
 
 from MBrowser.Const import *
@@ -11,6 +12,10 @@ from MBrowser.Session import Session
 
 __all__ = ['waitFor']
 
+# parameters of an arrow function may hold one level of parentheses, e.g. (a = f()) => a, deeper ones are caught at
+# run time by the function result of the expression
+_functionPattern = re.compile(r'^\s*(async\s+)?(function\b|\((?:[^()]|\([^()]*\))*\)\s*=>|[\w$]+\s*=>)')
+
 
 def dictToObject(d):
     if d.get(METHOD):
@@ -31,20 +36,48 @@ def dictToObject(d):
     return resultObj
 
 
-async def waitFor(breakfunction: object, timeout: int = TIMEOUT_S):
+async def waitFor(breakfunction: object, timeout: int = TIMEOUT_S, emitter: object = None, events: list = None):
+    """
+    Wait until breakfunction returns True
+    :param breakfunction: function without args
+    :param timeout: seconds, raise TimeoutError when reached
+    :param emitter: EventEmitter, with events breakfunction is only checked again when one of events is emitted,
+                    without it breakfunction is polled every 100 ms
+    :param events: list of event names which may change the result of breakfunction
+    :return: None
+    """
     if timeout <= 0:
         raise ValueError('time out should >0')
+    if breakfunction():
+        return
+    caller = sys._getframe().f_back.f_code.co_name
+    if emitter != None and events:
+        try:
+            await emitter.waitForEvent(events, lambda *args, **kwargs: breakfunction(), timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError('time out for waitfor: {}'.format(caller))
+        return
     loop = asyncio.get_event_loop();
     end_time = loop.time() + timeout
     while True:
         if loop.time() >= end_time:
-            raise TimeoutError('time out for waitfor: {}'.format(sys._getframe().f_back.f_code.co_name))
+            raise TimeoutError('time out for waitfor: {}'.format(caller))
             break
         if breakfunction():
             break
         await asyncio.sleep(0.1)
 
 
+def isFunction(pageFunction: str) -> bool:
+    """
+    Check whether the source is a function declaration or an arrow function rather than an expression, a guess from
+    the source, ExecutionContext calls the function when the expression turns out to be one
+    :param pageFunction: js source
+    :return: bool
+    """
+    return bool(_functionPattern.match(pageFunction))
+
+
 def getExceptionMessage(exceptionDetails: dict) -> str:
     exception = exceptionDetails.get('exception')
     if exception:
@@ -53,9 +86,8 @@ def getExceptionMessage(exceptionDetails: dict) -> str:
     stackTrace = exceptionDetails.get('stackTrace', dict())
     if stackTrace:
         for callframe in stackTrace.get('callFrames'):
-            location = (callframe.get('url', '') + ':' +
-                        callframe.get('lineNumber', '') + ':' +
-                        callframe.get('columnNumber'))
+            location = '{}:{}:{}'.format(callframe.get('url', ''), callframe.get('lineNumber', ''),
+                                         callframe.get('columnNumber', ''))
             functionName = callframe.get('functionName', '<anonymous>')
             message = message + f'\n    at {functionName} ({location})'
     return message
@@ -83,3 +115,17 @@ async def releaseObject(client: Session, remoteObject: dict) -> None:
         await client.send('Runtime.releaseObject', dict(objectId=objectId))
     except:
         pass
+
+
+async def releaseObjects(client: Session, remoteObjects: list) -> None:
+    """
+    Release many remote objects in one pipelined batch instead of one round trip each
+    """
+    commands = [('Runtime.releaseObject', dict(objectId=remoteObject.get('objectId')))
+                for remoteObject in remoteObjects if remoteObject.get('objectId')]
+    if not commands:
+        return
+    try:
+        await client.sendMany(commands)
+    except:
+        pass
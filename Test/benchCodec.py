@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+"""
+Micro benchmark for the CDP JSON codecs
+
+replay frames recorded by Connection.recordFrames:
+
+    python benchCodec.py frames.txt
+
+without a file a set of synthetic frames shaped like Network.responseReceived, Network.requestWillBeSent,
+Network.dataReceived and Network.getResponseBody replies is used
+"""
+
+import base64
+import json
+import logging
+import os
+import sys
+import time
+
+from MBrowser import Codec
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(filename)s[line:%(lineno)d] %(levelname)s:  %(message)s')
+
+ROUNDS = 20
+
+
+def syntheticFrames():
+    headers = {'x-header-{}'.format(i): 'value-{}-'.format(i) * 8 for i in range(40)}
+    timing = dict(requestTime=1234.5678, proxyStart=-1, proxyEnd=-1, dnsStart=0.1, dnsEnd=2.3, connectStart=2.3,
+                  connectEnd=30.2, sslStart=10.1, sslEnd=30.1, sendStart=30.4, sendEnd=30.6, receiveHeadersEnd=80.7)
+    frames = []
+    for i in range(200):
+        sid = 'B1C2D3E4F5'
+        frames.append(dict(method='Network.requestWillBeSent', sessionId=sid, params=dict(
+            requestId='1000.{}'.format(i), loaderId='L1', documentURL='https://www.jd.com/',
+            request=dict(url='https://img.example.com/item/{}.jpg?x=1&y=2'.format(i), method='GET', headers=headers,
+                         initialPriority='Low', referrerPolicy='no-referrer-when-downgrade'),
+            timestamp=1234.5 + i, wallTime=1530000000.5 + i, initiator=dict(type='parser', url='https://www.jd.com/'),
+            type='Image', frameId='F1')))
+        frames.append(dict(method='Network.responseReceived', sessionId=sid, params=dict(
+            requestId='1000.{}'.format(i), loaderId='L1', timestamp=1235.5 + i, type='Image', frameId='F1',
+            response=dict(url='https://img.example.com/item/{}.jpg'.format(i), status=200, statusText='OK',
+                          headers=headers, requestHeaders=headers, mimeType='image/jpeg', connectionReused=True,
+                          connectionId=42, remoteIPAddress='1.2.3.4', remotePort=443, fromDiskCache=False,
+                          encodedDataLength=512, timing=timing, protocol='http/1.1', securityState='secure'))))
+        frames.append(dict(method='Network.dataReceived', sessionId=sid, params=dict(
+            requestId='1000.{}'.format(i), timestamp=1236.5 + i, dataLength=65536, encodedDataLength=65536)))
+    body = base64.b64encode(os.urandom(256 * 1024)).decode('ascii')
+    for i in range(20):
+        frames.append(dict(id=i + 1, sessionId='B1C2D3E4F5', result=dict(body=body, base64Encoded=True)))
+    return [json.dumps(frame) for frame in frames]
+
+
+def loadFrames(filename):
+    with open(filename, encoding='utf-8') as fileHandler:
+        return [line.rstrip('\n') for line in fileHandler if line.strip()]
+
+
+def bench(codec, frames):
+    size = sum(len(frame) for frame in frames)
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        decoded = [codec.loads(frame) for frame in frames]
+    decodeS = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        for msg in decoded:
+            codec.dumps(msg)
+    encodeS = time.perf_counter() - start
+    mb = size * ROUNDS / 1024 / 1024
+    logging.info('{:8} decode {:8.1f} MB/s {:8.3f} s   encode {:8.1f} MB/s {:8.3f} s'.format(
+        codec.name, mb / decodeS, decodeS, mb / encodeS, encodeS))
+
+
+def main():
+    frames = loadFrames(sys.argv[1]) if len(sys.argv) > 1 else syntheticFrames()
+    logging.info('{} frames, {:.1f} MB, {} rounds'.format(len(frames), sum(len(f) for f in frames) / 1024 / 1024,
+                                                         ROUNDS))
+    for codec in Codec.availableCodecs().values():
+        bench(codec, frames)
+
+
+if __name__ == "__main__":
+    main()
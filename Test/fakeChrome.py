@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+"""
+A stand-in for the chrome executable, for the Launcher tests: it prints a DevTools endpoint and runs until
+terminated, and like chrome it hands over to the browser already running on its profile and exits without an endpoint
+"""
+
+import os
+import stat
+import sys
+
+SCRIPT = r'''#!{python}
+import os, signal, sys, time, uuid
+
+profile = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'default-profile')
+for arg in sys.argv[1:]:
+    if arg.startswith('--user-data-dir='):
+        profile = arg.partition('=')[2]
+os.makedirs(profile, exist_ok=True)
+lock = os.path.join(profile, 'SingletonLock')
+try:
+    fd = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+except FileExistsError:
+    print('Opening in existing browser session.', flush=True)
+    sys.exit(0)
+os.close(fd)
+
+
+def quit(signum, frame):
+    os.remove(lock)
+    sys.exit(0)
+
+
+signal.signal(signal.SIGTERM, quit)
+print('DevTools listening on ws://127.0.0.1:{{}}/devtools/browser/{{}}'.format(9222, uuid.uuid4()), flush=True)
+while True:
+    time.sleep(1)
+'''
+
+
+def install(directory: str) -> str:
+    """
+    :param directory: where the fake executable and its default profile go
+    :return: path of the executable, the BROWSEPATH launch option
+    """
+    path = os.path.join(directory, 'chrome')
+    with open(path, 'w') as fileHandler:
+        fileHandler.write(SCRIPT.format(python=sys.executable))
+    os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR)
+    return path
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import fakeChrome
+from MBrowser import EventLoop
+from MBrowser.Browser import Browser
+from MBrowser.ConnectionPool import ConnectionPool
+from MBrowser.Const import BROWSEPATH
+
+
+class LaunchOnlyPool(ConnectionPool):
+    """
+    Keeps the endpoints launched instead of connecting to them, the fake chrome has no DevTools server
+    """
+
+    def __init__(self):
+        super().__init__(healthInterval=None)
+        self.endpoints = []
+
+    async def add(self, endpoint: str) -> Browser:
+        self.endpoints.append(endpoint)
+        return Browser(endpoint)
+
+
+@unittest.skipIf(os.name == 'nt', 'the fake chrome is a script run by its shebang')
+class LaunchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.options = {BROWSEPATH: fakeChrome.install(self.directory)}
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_launchTwo(self):
+        pool = LaunchOnlyPool()
+        browsers = EventLoop.loop.run_until_complete(pool.launch(2, self.options))
+        try:
+            self.assertEqual(2, len(browsers))
+            self.assertEqual(2, len(set(browser.endpoint for browser in browsers)))
+            profiles = [userDataDir for (_, userDataDir) in pool._processes]
+            self.assertEqual(2, len(set(profiles)))
+        finally:
+            EventLoop.loop.run_until_complete(pool.close())
+        self.assertFalse([profile for profile in profiles if os.path.exists(profile)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from MBrowser import EventLoop
+from MBrowser.Crawler import CrawlScheduler, MAX_PAGE_FAILURES
+
+
+class FakePage(object):
+    resets = 0
+
+    async def reset(self, **kwargs):
+        FakePage.resets += 1
+
+
+class FakeBrowser(object):
+
+    def __init__(self, broken: bool = False):
+        self.broken = broken
+        self.created = 0
+        self.closed = 0
+
+    async def createPage(self):
+        self.created += 1
+        if self.broken:
+            raise RuntimeError('browser is gone')
+        return FakePage()
+
+    async def closePage(self, page):
+        self.closed += 1
+
+
+class PickTest(unittest.TestCase):
+
+    def test_priorityAcrossHosts(self):
+        scheduler = CrawlScheduler(FakeBrowser(), hostConcurrency=None)
+        scheduler.add('https://a.com/low', priority=1)
+        scheduler.add('https://b.com/high', priority=5)
+        scheduler.add('https://a.com/mid', priority=3)
+        scheduler.add('https://b.com/first', priority=3)
+        urls = [scheduler._pick(0)[0].url for _ in range(4)]
+        self.assertEqual(['https://b.com/high', 'https://a.com/mid', 'https://b.com/first', 'https://a.com/low'], urls)
+        self.assertEqual((None, None), scheduler._pick(0))
+
+    def test_hostConcurrency(self):
+        scheduler = CrawlScheduler(FakeBrowser(), hostConcurrency=2)
+        for index in range(3):
+            scheduler.add('https://a.com/{}'.format(index))
+        scheduler.add('https://b.com/0', priority=-1)
+        hosts = [scheduler._pick(0)[0].host for _ in range(3)]
+        self.assertEqual(['a.com', 'a.com', 'b.com'], hosts)
+        self.assertEqual((None, None), scheduler._pick(0))
+        self.assertEqual({'a.com': dict(queued=1, running=2), 'b.com': dict(queued=0, running=1)},
+                         scheduler.hostStats())
+
+    def test_hostQps(self):
+        scheduler = CrawlScheduler(FakeBrowser(), hostConcurrency=None, hostQps=2.0)
+        scheduler.add('https://a.com/0')
+        scheduler.add('https://a.com/1')
+        self.assertIsNotNone(scheduler._pick(10.0)[0])
+        (job, wait) = scheduler._pick(10.2)
+        self.assertIsNone(job)
+        self.assertAlmostEqual(0.3, wait)
+        self.assertEqual('https://a.com/1', scheduler._pick(10.5)[0].url)
+
+    def test_idleHostsDropped(self):
+        scheduler = CrawlScheduler(FakeBrowser(), hostConcurrency=None, hostQps=1.0)
+        scheduler.addJobs(['https://a.com/', 'https://b.com/'])
+        (first, _) = scheduler._pick(0)
+        (second, _) = scheduler._pick(0)
+        scheduler._running = 2
+        scheduler._done(first, 'done', None)
+        self.assertEqual({first.host, second.host}, set(scheduler.hostStats()))
+        # rate limited until 1.0
+        scheduler._pick(0.5)
+        self.assertEqual({first.host, second.host}, set(scheduler.hostStats()))
+        scheduler._pick(1.0)
+        self.assertEqual({second.host}, set(scheduler.hostStats()))
+        scheduler._done(second, 'done', None)
+        self.assertEqual((None, None), scheduler._pick(1.0))
+        self.assertEqual({}, scheduler.hostStats())
+
+
+class RetryTest(unittest.TestCase):
+
+    def run_(self, coro):
+        return EventLoop.loop.run_until_complete(coro)
+
+    def test_retryThenSucceed(self):
+        calls = []
+
+        async def flaky(page, job):
+            calls.append(job.url)
+            if len(calls) < 3:
+                raise RuntimeError('flaky')
+            return 'done'
+
+        scheduler = CrawlScheduler(FakeBrowser(), pages=1, retries=2, backoff=0.01, handler=flaky)
+        job = scheduler.add('https://a.com/')
+        self.assertEqual([job], self.run_(scheduler.run()))
+        self.assertEqual((3, 'done', None), (job.attempts, job.result, job.error))
+        stats = scheduler.stats()
+        self.assertEqual((1, 0, 2), (stats['succeeded'], stats['failed'], stats['retried']))
+
+    def test_retriesExhausted(self):
+        async def broken(page, job):
+            raise RuntimeError('broken')
+
+        scheduler = CrawlScheduler(FakeBrowser(), pages=2, retries=1, backoff=0.01, handler=broken)
+        jobs = scheduler.addJobs(['https://a.com/', 'https://b.com/'])
+        self.run_(scheduler.run())
+        self.assertEqual([2, 2], [job.attempts for job in jobs])
+        self.assertTrue(all(isinstance(job.error, RuntimeError) for job in jobs))
+        stats = scheduler.stats()
+        self.assertEqual((0, 2, 2), (stats['succeeded'], stats['failed'], stats['retried']))
+
+    def test_noPageStopsTheCrawl(self):
+        browser = FakeBrowser(broken=True)
+        scheduler = CrawlScheduler(browser, pages=1, retries=0, backoff=0.01)
+        scheduler.addJobs(['https://h{}.com/'.format(index) for index in range(10)])
+        finished = self.run_(scheduler.run())
+        self.assertEqual(MAX_PAGE_FAILURES, len(finished))
+        self.assertEqual([1] * MAX_PAGE_FAILURES, [job.attempts for job in finished])
+        self.assertEqual(MAX_PAGE_FAILURES, browser.created)
+        self.assertEqual(10 - MAX_PAGE_FAILURES, scheduler.stats()['queued'])
+
+    def test_keepFinished(self):
+        results = []
+        scheduler = CrawlScheduler(FakeBrowser(), pages=2, handler=self._echo, keepFinished=False,
+                                   onResult=results.append)
+        scheduler.addJobs(['https://a.com/{}'.format(index) for index in range(5)])
+        self.assertEqual([], self.run_(scheduler.run()))
+        self.assertEqual(5, len(results))
+
+    @staticmethod
+    async def _echo(page, job):
+        return job.url
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from MBrowser.DomSnapshot import DomSnapshot, ELEMENT_NODE, TEXT_NODE
+
+DOCUMENT_NODE = 9
+
+
+class SnapshotBuilder(object):
+    """
+    Build a DOMSnapshot.captureSnapshot result, strings are shared through the string table as the browser does
+    """
+
+    def __init__(self):
+        self.strings = []
+        self.nodes = dict(parentIndex=[], nodeType=[], nodeName=[], nodeValue=[], attributes=[])
+
+    def string(self, value: str) -> int:
+        if value not in self.strings:
+            self.strings.append(value)
+        return self.strings.index(value)
+
+    def add(self, parent: int, nodeType: int, name: str, value: str = None, attrs: tuple = ()) -> int:
+        self.nodes['parentIndex'].append(parent)
+        self.nodes['nodeType'].append(nodeType)
+        self.nodes['nodeName'].append(self.string(name))
+        self.nodes['nodeValue'].append(-1 if value == None else self.string(value))
+        self.nodes['attributes'].append([self.string(item) for item in attrs])
+        return len(self.nodes['parentIndex']) - 1
+
+    def element(self, parent: int, name: str, **attrs) -> int:
+        return self.add(parent, ELEMENT_NODE, name, attrs=[item for pair in attrs.items() for item in pair])
+
+    def text(self, parent: int, value: str) -> int:
+        return self.add(parent, TEXT_NODE, '#text', value)
+
+    def snapshot(self) -> dict:
+        return dict(strings=self.strings, documents=[dict(nodes=self.nodes)])
+
+
+def _listPage() -> dict:
+    builder = SnapshotBuilder()
+    document = builder.add(-1, DOCUMENT_NODE, '#document')
+    html = builder.element(document, 'HTML')
+    head = builder.element(html, 'HEAD')
+    builder.text(builder.element(head, 'TITLE'), 'title')
+    body = builder.element(html, 'BODY')
+    items = builder.element(body, 'UL', id='items', **{'class': 'list'})
+    for index in range(3):
+        item = builder.element(items, 'LI', **{'class': 'item odd' if index % 2 == 0 else 'item', 'data-id':
+                                               'sku-{}'.format(index)})
+        builder.text(builder.element(item, 'SPAN', **{'class': 'name'}), '  Item \n {} '.format(index))
+        price = builder.element(item, 'B')
+        builder.text(price, '{}.00'.format(index))
+        builder.text(builder.element(price, 'SCRIPT'), 'var hidden = 1')
+    return builder.snapshot()
+
+
+class DomSnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.snapshot = DomSnapshot(_listPage())
+
+    def test_decodeNames(self):
+        node = self.snapshot.querySelector('#items')
+        self.assertEqual('ul', self.snapshot.nodeName(node))
+        self.assertEqual('list', self.snapshot.attribute(node, 'CLASS'))
+        self.assertIsNone(self.snapshot.attribute(node, 'title'))
+
+    def test_selectors(self):
+        self.assertEqual(3, len(self.snapshot.querySelectorAll('ul.list > li.item')))
+        self.assertEqual(2, len(self.snapshot.querySelectorAll('li.odd')))
+        self.assertEqual(2, len(self.snapshot.querySelectorAll('li ~ li')))
+        self.assertEqual(1, len(self.snapshot.querySelectorAll('li + li.odd')))
+        self.assertEqual(3, len(self.snapshot.querySelectorAll('[data-id^=sku-]')))
+        self.assertEqual(6, len(self.snapshot.querySelectorAll('li span, b')))
+        self.assertEqual([], self.snapshot.querySelectorAll('body > li'))
+
+    def test_extract(self):
+        self.assertEqual([dict(name='Item 0', price='0.00', missing=None),
+                          dict(name='Item 1', price='1.00', missing=None),
+                          dict(name='Item 2', price='2.00', missing=None)],
+                         self.snapshot.extract('li.item', dict(name='span.name', price='span + b', missing='i')))
+
+    def test_unsupportedSelector(self):
+        with self.assertRaises(ValueError):
+            self.snapshot.querySelectorAll('li:first-child')
+        with self.assertRaises(ValueError):
+            self.snapshot.querySelectorAll('ul >')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from MBrowser import EventLoop, helper
+from MBrowser.Const import SE
+from MBrowser.ExecutionContext import ExecutionContext
+
+
+class FakeRuntime(object):
+    """
+    Answers the Runtime commands of an ExecutionContext, the sources in functions evaluate to a function object
+    """
+
+    def __init__(self, functions: list):
+        self.functions = functions
+        self.sent = []
+
+    async def send(self, method: str, params: dict):
+        self.sent.append(method)
+        if method == 'Runtime.evaluate' and params.get('expression') in self.functions:
+            return dict(id=1, result=dict(result=dict(type='function', className='Function', value={})))
+        if method == 'Runtime.callFunctionOn':
+            return dict(id=1, result=dict(result=dict(type='number', value=len(params.get('arguments')))))
+        return dict(id=1, result=dict(result=dict(type='string', value='expression')))
+
+
+class EvaluateTest(unittest.TestCase):
+
+    def evaluate(self, source: str, *args, functions: list = ()):
+        runtime = FakeRuntime(list(functions))
+        context = ExecutionContext(None, 1, None)
+        context.on(SE, runtime.send)
+        return (EventLoop.loop.run_until_complete(context.evaluate(source, *args)), runtime.sent)
+
+    def test_isFunction(self):
+        for source in ('function f(a) { return a }', 'async () => 1', 'a => a', '(a, b) => a + b',
+                       '(a = f()) => a', 'async ({x} = g(1)) => x'):
+            self.assertTrue(helper.isFunction(source), source)
+        for source in ('document.title', '1 + 2', '(a)', 'f(a => a)'):
+            self.assertFalse(helper.isFunction(source), source)
+
+    def test_expression(self):
+        self.assertEqual(('expression', ['Runtime.evaluate']), self.evaluate('document.title'))
+
+    def test_missedFunctionIsCalled(self):
+        source = '(a = f(g())) => a'
+        self.assertFalse(helper.isFunction(source))
+        (value, sent) = self.evaluate(source, 7, 8, functions=[source])
+        self.assertEqual(2, value)
+        self.assertEqual(['Runtime.evaluate', 'Runtime.callFunctionOn'], sent)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from MBrowser.HarAnalytics import HarTable, np
+
+
+def _entry(page: str, started, time, url: str = 'https://a.com/'):
+    return dict(pageref=page, startedDateTime=started, time=time, request=dict(method='GET', url=url),
+                response=dict(status=200, headersSize=-1, bodySize=-1, content=dict(size=-1, mimeType='text/html')),
+                timings=dict(blocked=-1, dns=-1, connect=-1, ssl=-1, send=0, wait=-1, receive=-1))
+
+
+@unittest.skipIf(np == None, 'HarTable needs numpy')
+class HarTableTest(unittest.TestCase):
+
+    def test_nanOnlyPage(self):
+        table = HarTable.fromEntries([_entry('p', None, None), _entry('p', None, -1)])
+        self.assertEqual(2, len(table))
+        self.assertEqual([], table.criticalPath('p'))
+        self.assertEqual({50: None}, table.percentiles(q=(50,)))
+        self.assertIsNone(table.timingBreakdown().get('wait'))
+
+    def test_criticalPath(self):
+        table = HarTable.fromEntries([_entry('p', '2020-09-13T12:26:40.000Z', 100),
+                                      _entry('p', '2020-09-13T12:26:40.050Z', 20, 'https://a.com/1.js'),
+                                      _entry('q', None, None)])
+        self.assertTrue(table.criticalPath('p'))
+        self.assertEqual([], table.criticalPath('q'))
+
+
+
+def _timed(url: str, started: str, time: float, mimeType: str, transferSize: int, timings: dict,
+           initiator: str = None):
+    entry = dict(pageref='page_1', startedDateTime=started, time=time, request=dict(method='GET', url=url),
+                 response=dict(status=200, headersSize=100, bodySize=transferSize, _transferSize=transferSize,
+                               content=dict(size=transferSize, mimeType=mimeType)),
+                 timings=dict(dict(blocked=-1, dns=-1, connect=-1, ssl=-1, send=1), **timings))
+    if initiator:
+        entry['initiator'] = dict(type='parser', url=initiator)
+    return entry
+
+
+@unittest.skipIf(np == None, 'HarTable needs numpy')
+class HarFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'page.har')
+        entries = [_timed('https://a.com/', '2020-09-13T12:26:40.000Z', 100, 'text/html; charset=utf-8', 1000,
+                          dict(blocked=1, dns=2, connect=3, wait=50, receive=43)),
+                   _timed('https://a.com/app.js', '2020-09-13T12:26:40.010Z', 40, 'application/javascript', 500,
+                          dict(wait=30, receive=9), initiator='https://a.com/'),
+                   _timed('https://b.com/1.png', '2020-09-13T12:26:40.020Z', 20, 'image/png', 300,
+                          dict(wait=10, receive=9), initiator='https://a.com/'),
+                   _timed('https://b.com/2.png', '2020-09-13T12:26:40.050Z', 60, 'image/png', -1,
+                          dict(wait=40, receive=19), initiator='https://a.com/app.js')]
+        with open(self.filename, 'w', encoding='utf-8') as fileHandler:
+            json.dump(dict(log=dict(version='1.2', entries=entries, pages=[dict(id='page_1')])), fileHandler)
+        self.table = HarTable.fromFiles([self.filename])
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_labels(self):
+        self.assertEqual(4, len(self.table))
+        self.assertEqual([self.filename + ':page_1'], self.table.labels('page'))
+        self.assertEqual(['document', 'script', 'image'], self.table.labels('type'))
+
+    def test_percentiles(self):
+        self.assertEqual({50: 50.0, 100: 100.0}, self.table.percentiles(q=(50, 100)))
+
+    def test_groupBy(self):
+        groups = self.table.groupBy('host', q=(50, 95))
+        # the percentiles interpolate like np.percentile
+        self.assertAlmostEqual(np.percentile([40, 100], 95), groups.get('a.com').pop('p95'))
+        self.assertAlmostEqual(np.percentile([20, 60], 95), groups.get('b.com').pop('p95'))
+        self.assertEqual(dict(count=2, sum=140.0, mean=70.0, min=40.0, max=100.0, p50=70.0), groups.get('a.com'))
+        self.assertEqual(dict(count=2, sum=80.0, mean=40.0, min=20.0, max=60.0, p50=40.0), groups.get('b.com'))
+
+    def test_bytesBy(self):
+        self.assertEqual({'a.com': 1500.0, 'b.com': 300.0}, self.table.bytesBy('host'))
+        self.assertEqual(['document', 'script', 'image'], list(self.table.bytesBy('type')))
+
+    def test_timingBreakdown(self):
+        breakdown = self.table.timingBreakdown()
+        self.assertEqual((2.0, None, 32.5, 20.0), (breakdown['dns'], breakdown['ssl'], breakdown['wait'],
+                                                  breakdown['receive']))
+        byHost = self.table.timingBreakdown('host')
+        self.assertEqual((25.0, None, 1.0), (byHost['b.com']['wait'], byHost['b.com']['dns'],
+                                             byHost['b.com']['send']))
+
+    def test_criticalPath(self):
+        path = self.table.criticalPath(self.filename + ':page_1')
+        self.assertEqual(['https://a.com/', 'https://a.com/app.js', 'https://b.com/2.png'],
+                         [step['url'] for step in path])
+        self.assertAlmostEqual(110.0, path[-1]['end'])
+
+
+if __name__ == '__main__':
+    unittest.main()
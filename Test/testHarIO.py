@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+"""
+Offline tests, no browser needed, run from the repository root:
+
+    python -m unittest discover -s Test -p 'test*.py'
+"""
+
+import io
+import json
+import unittest
+
+from MBrowser.HarIO import HarReader
+
+
+def _har(count: int, pagesFirst: bool = True) -> str:
+    entries = [dict(request=dict(url='https://a.com/{}'.format(i), method='GET'), time=i, text='x' * i)
+               for i in range(count)]
+    log = dict(version='1.2', creator=dict(name='MBrowser'))
+    if pagesFirst:
+        log['pages'] = [dict(id='page_1')]
+        log['entries'] = entries
+    else:
+        log['entries'] = entries
+        log['pages'] = [dict(id='page_1')]
+    return json.dumps(dict(log=log), indent=1)
+
+
+class HarReaderTest(unittest.TestCase):
+
+    def test_entriesAcrossChunks(self):
+        text = _har(50)
+        for chunkSize in (1, 7, 64, 1 << 16):
+            reader = HarReader(io.StringIO(text), chunkSize)
+            entries = list(reader.entries())
+            self.assertEqual(json.loads(text).get('log').get('entries'), entries)
+            self.assertEqual([dict(id='page_1')], reader.meta.get('pages'))
+
+    def test_metaAfterEntries(self):
+        reader = HarReader(io.StringIO(_har(3, pagesFirst=False)), 5)
+        self.assertEqual(3, len(list(reader.entries())))
+        self.assertEqual('1.2', reader.meta.get('version'))
+        self.assertEqual([dict(id='page_1')], reader.meta.get('pages'))
+
+    def test_noEntries(self):
+        reader = HarReader(io.StringIO(_har(0)), 4)
+        self.assertEqual([], list(reader.entries()))
+        self.assertEqual('MBrowser', reader.meta.get('creator').get('name'))
+
+    def test_truncated(self):
+        text = _har(5)
+        reader = HarReader(io.StringIO(text[:len(text) // 2]), 16)
+        with self.assertRaises(ValueError):
+            list(reader.entries())
+
+
+if __name__ == '__main__':
+    unittest.main()
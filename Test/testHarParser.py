@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from MBrowser.HarParser import HarHandler, HarWriter, harinfo
+
+
+class HarHandlerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'page.har')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_abortClosesStreamedHar(self):
+        fileHandler = open(self.filename, 'w', encoding='utf-8')
+        writer = HarWriter(fileHandler)
+        writer.writeEntry(dict(pageref='page_1', request=dict(url='https://a.com/')))
+        handler = HarHandler(writer)
+        page = harinfo('page_1', 'loader', 'frame')
+        page.firstRequestWallTime = 1600000000.0
+        page.firstRequestMs = 1000
+        handler._pages = [page, harinfo('page_2', 'loader2', 'frame')]
+        handler.abort()
+        self.assertTrue(fileHandler.closed)
+        self.assertFalse(handler.streaming())
+        with open(self.filename, encoding='utf-8') as fileHandler:
+            log = json.load(fileHandler).get('log')
+        self.assertEqual(1, len(log.get('entries')))
+        self.assertEqual(['page_1'], [page.get('id') for page in log.get('pages')])
+        # a second abort, e.g. from Page.reset after a failed getHar, leaves the file alone
+        handler.abort()
+
+
+if __name__ == '__main__':
+    unittest.main()
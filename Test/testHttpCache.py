@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from email.utils import formatdate
+
+from MBrowser import EventLoop
+from MBrowser.HttpCache import HttpCache
+
+
+class FakeRequest(object):
+    """
+    The parts of InterceptedRequest HttpCache uses, records how the request was answered
+    """
+
+    def __init__(self, url: str, resourceType: str = 'Script', status: int = None, headers: dict = None,
+                 body: bytes = b'', requestId: str = '1'):
+        self.requestId = requestId
+        self.url = url
+        self.method = 'GET'
+        self.resourceType = resourceType
+        self.headers = {'Accept': '*/*'}
+        self.responseStatusCode = status
+        self.responseHeaders = [dict(name=name, value=value) for name, value in (headers or {}).items()]
+        self._body = body
+        self.answer = None
+
+    async def fulfill(self, status, headers, body):
+        self.answer = ('fulfill', status, body)
+
+    async def continueRequest(self, **overrides):
+        self.answer = ('continue', overrides)
+
+    async def getResponseBody(self):
+        return self._body
+
+
+class HttpCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = HttpCache(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def run_(self, coro):
+        return EventLoop.loop.run_until_complete(coro)
+
+    def assertFreshFor(self, seconds, headers):
+        expires = self.cache._expires(headers)
+        self.assertIsNotNone(expires)
+        self.assertAlmostEqual(time.time() + seconds, expires, delta=2)
+
+    def test_freshness(self):
+        now = time.time()
+        self.assertFreshFor(600, {'cache-control': 'max-age=600'})
+        self.assertFreshFor(60, {'cache-control': 'max-age=600, s-maxage=60'})
+        self.assertFreshFor(500, {'cache-control': 'max-age=600', 'age': '100'})
+        self.assertFreshFor(0, {'cache-control': 'no-cache, max-age=600'})
+        self.assertFreshFor(300, {'date': formatdate(now, usegmt=True),
+                                  'expires': formatdate(now + 300, usegmt=True)})
+        self.assertFreshFor(1000, {'date': formatdate(now, usegmt=True),
+                                   'last-modified': formatdate(now - 10000, usegmt=True)})
+        self.assertFreshFor(86400, {'date': formatdate(now, usegmt=True),
+                                    'last-modified': formatdate(now - 10 ** 8, usegmt=True)})
+        self.assertFreshFor(0, {})
+
+    def test_notStored(self):
+        self.assertIsNone(self.cache._expires({'cache-control': 'no-store'}))
+        self.assertIsNone(self.cache._expires({'cache-control': 'private, max-age=60'}))
+        self.assertIsNone(self.cache._expires({'cache-control': 'max-age=60', 'vary': 'Cookie'}))
+        self.assertIsNotNone(self.cache._expires({'cache-control': 'max-age=60', 'vary': 'Accept-Encoding'}))
+
+    def test_freshHit(self):
+        url = 'https://a.com/app.js'
+        self.assertFalse(self.run_(self.cache.onRequest(FakeRequest(url))))
+        response = FakeRequest(url, status=200, body=b'console.log(1)',
+                               headers={'Cache-Control': 'max-age=600', 'Content-Encoding': 'gzip'})
+        self.assertFalse(self.run_(self.cache.onResponse(response)))
+        request = FakeRequest(url)
+        self.assertTrue(self.run_(self.cache.onRequest(request)))
+        self.assertEqual(('fulfill', 200, b'console.log(1)'), request.answer)
+        stats = self.cache.stats()
+        self.assertEqual((1, 1, 0, 1), (stats['hits'], stats['misses'], stats['revalidated'], stats['stored']))
+
+    def test_revalidation(self):
+        url = 'https://a.com/old.js'
+        self.run_(self.cache.onResponse(FakeRequest(url, status=200, body=b'old',
+                                                    headers={'Cache-Control': 'no-cache', 'ETag': '"v1"'})))
+        request = FakeRequest(url)
+        self.assertTrue(self.run_(self.cache.onRequest(request)))
+        self.assertEqual('continue', request.answer[0])
+        self.assertIn(dict(name='If-None-Match', value='"v1"'), request.answer[1].get('headers'))
+
+        response = FakeRequest(url, status=304)
+        self.assertTrue(self.run_(self.cache.onResponse(response)))
+        self.assertEqual(('fulfill', 200, b'old'), response.answer)
+
+        # a new version instead of 304
+        self.run_(self.cache.onRequest(FakeRequest(url)))
+        self.run_(self.cache.onResponse(FakeRequest(url, status=200, body=b'new',
+                                                    headers={'Cache-Control': 'max-age=60'})))
+        stats = self.cache.stats()
+        self.assertEqual((0, 1, 1), (stats['hits'], stats['misses'], stats['revalidated']))
+
+    def test_staleWithoutValidatorCountsOnce(self):
+        url = 'https://a.com/short.js'
+        self.run_(self.cache.onResponse(FakeRequest(url, status=200, body=b'short',
+                                                    headers={'Cache-Control': 'max-age=1'})))
+        self.cache._index[url]['expires'] = time.time() - 1
+        self.assertFalse(self.run_(self.cache.onRequest(FakeRequest(url, requestId='2'))))
+        self.run_(self.cache.onResponse(FakeRequest(url, status=200, body=b'short', requestId='2',
+                                                    headers={'Cache-Control': 'max-age=1'})))
+        stats = self.cache.stats()
+        self.assertEqual((0, 1, 0, 2), (stats['hits'], stats['misses'], stats['revalidated'], stats['stored']))
+
+    def test_bodyGone(self):
+        url = 'https://a.com/gone.js'
+        self.run_(self.cache.onResponse(FakeRequest(url, status=200, body=b'gone',
+                                                    headers={'Cache-Control': 'max-age=60', 'ETag': '"v1"'})))
+        os.remove(self.cache._bodyPath(self.cache._index[url]['body']))
+        request = FakeRequest(url, requestId='2')
+        self.assertFalse(self.run_(self.cache.onRequest(request)))
+        self.assertIsNone(request.answer)
+        self.run_(self.cache.onResponse(FakeRequest(url, status=200, body=b'back', requestId='2',
+                                                    headers={'Cache-Control': 'max-age=60'})))
+        stats = self.cache.stats()
+        self.assertEqual((0, 1, 0, 1), (stats['hits'], stats['misses'], stats['revalidated'], stats['urls']))
+
+    def test_sharedBodiesAndEviction(self):
+        cache = HttpCache(self.directory, maxBytes=10)
+        for url in ('https://a.com/1.js', 'https://b.com/1.js'):
+            self.run_(cache.onResponse(FakeRequest(url, status=200, body=b'12345678',
+                                                   headers={'Cache-Control': 'max-age=60'})))
+        self.assertEqual(8, cache.stats()['bytes'])
+        self.run_(cache.onResponse(FakeRequest('https://c.com/2.js', status=200, body=b'abcdef',
+                                               headers={'Cache-Control': 'max-age=60'})))
+        stats = cache.stats()
+        self.assertEqual((2, 1, 6), (stats['evicted'], stats['urls'], stats['bytes']))
+
+    def test_saveAndLoad(self):
+        self.run_(self.cache.onResponse(FakeRequest('https://a.com/1.js', status=200, body=b'x',
+                                                    headers={'Cache-Control': 'max-age=60'})))
+        self.cache.save()
+        self.assertEqual(1, HttpCache(self.directory).stats()['urls'])
+
+
+if __name__ == '__main__':
+    unittest.main()
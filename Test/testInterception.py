@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from MBrowser import EventLoop
+from MBrowser.EventEmitter import EventEmitter
+from MBrowser.HarReplay import HarArchive
+from MBrowser.Interception import RequestRule, RequestRules
+from MBrowser.Pages import Page
+
+
+class FakeSession(EventEmitter):
+    """
+    Acknowledges every command and keeps the Fetch commands sent
+    """
+
+    def __init__(self):
+        self.fetch = []
+
+    async def send(self, method: str, params: dict = None, timeout: float = None):
+        if method.startswith('Fetch.'):
+            self.fetch.append((method, params))
+        return dict(id=1, result={})
+
+    async def sendMany(self, commands: list, timeout: float = None):
+        return [await self.send(method, params) for (method, params) in commands]
+
+
+class RequestRulesTest(unittest.TestCase):
+
+    def test_firstMatchWins(self):
+        rules = RequestRules([RequestRule('continue', urlGlob='https://a.com/keep/*'),
+                              RequestRule('block', hosts=['a.com']),
+                              RequestRule('fulfill', urlRegex=r'\.js(\?|$)', body='ok')])
+        self.assertEqual('continue', rules.match('https://a.com/keep/1.png', 'Image').action)
+        self.assertEqual('block', rules.match('https://a.com/app.js', 'Script').action)
+        self.assertEqual('fulfill', rules.match('https://b.com/app.js?v=1', 'Script').action)
+        self.assertIsNone(rules.match('https://b.com/app.css', 'Stylesheet'))
+
+    def test_hostMatchesSubdomains(self):
+        rules = RequestRules([RequestRule('block', hosts=['*.ads.com'])])
+        self.assertIsNotNone(rules.match('https://ads.com/x', 'Image'))
+        self.assertIsNotNone(rules.match('https://img.cdn.ads.com/x', 'Image'))
+        self.assertIsNone(rules.match('https://badads.com/x', 'Image'))
+        self.assertIsNone(rules.match('https://ads.com.evil.org/x', 'Image'))
+
+    def test_resourceTypes(self):
+        rules = RequestRules([RequestRule('block', resourceTypes=['image', 'FONT'])])
+        self.assertIsNotNone(rules.match('https://a.com/x.png', 'Image'))
+        self.assertIsNotNone(rules.match('https://a.com/x.woff', 'Font'))
+        self.assertIsNone(rules.match('https://a.com/x.js', 'Script'))
+        self.assertEqual([dict(urlPattern='*', resourceType='Image'), dict(urlPattern='*', resourceType='Font')],
+                         rules.patterns())
+
+    def test_patternsWithAnyType(self):
+        rules = RequestRules([RequestRule('block', resourceTypes=['Image']), RequestRule('block', hosts=['a.com'])])
+        self.assertIsNone(rules.patterns())
+        self.assertIsNotNone(rules.match('https://a.com/x.js', 'Script'))
+
+    def test_globAndRegexTogether(self):
+        rules = RequestRules([RequestRule('block', urlGlob='*.png*', urlRegex='thumb')])
+        self.assertIsNotNone(rules.match('https://a.com/thumb/1.png?w=2', 'Image'))
+        self.assertIsNone(rules.match('https://a.com/full/1.png', 'Image'))
+
+    def test_invalidRule(self):
+        with self.assertRaises(ValueError):
+            RequestRule('drop')
+        with self.assertRaises(ValueError):
+            RequestRule('block', resourceTypes=['Picture'])
+
+
+class PageInterceptionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.session = FakeSession()
+        self.page = self.run_(Page.create(self.session))
+
+    def run_(self, coro):
+        return EventLoop.loop.run_until_complete(coro)
+
+    def test_lastRulesRemovedDisablesFetch(self):
+        self.run_(self.page.setRequestRules([RequestRule('block', resourceTypes=['Image'])]))
+        self.assertTrue(self.page.interceptor.enabled)
+        self.run_(self.page.setRequestRules([]))
+        self.assertFalse(self.page.interceptor.enabled)
+        self.assertEqual(['Fetch.enable', 'Fetch.disable'], [method for (method, _) in self.session.fetch])
+
+    def test_replacedRulesNarrowPatterns(self):
+        self.run_(self.page.setRequestRules([RequestRule('block', resourceTypes=['Image'])]))
+        self.run_(self.page.setRequestRules([RequestRule('block', resourceTypes=['Font'])]))
+        (method, params) = self.session.fetch[-1]
+        self.assertEqual(('Fetch.enable', [dict(urlPattern='*', resourceType='Font')]),
+                         (method, params.get('patterns')))
+
+    def test_stopReplayKeepsOtherHandlers(self):
+        self.run_(self.page.setRequestRules([RequestRule('block', resourceTypes=['Image'])]))
+        self.run_(self.page.replayHar(HarArchive([])))
+        self.run_(self.page.stopReplay())
+        self.assertTrue(self.page.interceptor.enabled)
+        self.run_(self.page.setRequestRules(None))
+        self.assertFalse(self.page.interceptor.enabled)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import fakeChrome
+from MBrowser.Const import ARGS, BROWSEPATH, KILLEXISTING
+from MBrowser.Launcher import Launcher
+
+
+@unittest.skipIf(os.name == 'nt', 'the fake chrome is a script run by its shebang')
+class LauncherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.options = {BROWSEPATH: fakeChrome.install(self.directory), KILLEXISTING: False}
+        self.launched = []
+
+    def tearDown(self):
+        for process, userDataDir in self.launched:
+            Launcher.closeBrowser(process, userDataDir)
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def start(self, options):
+        browser = Launcher.startBrowser(options)
+        self.launched.append((Launcher.browserPid, Launcher.userDataDir))
+        return browser
+
+    def test_sideBySide(self):
+        first = self.start(self.options)
+        second = self.start(self.options)
+        self.assertIsNotNone(first)
+        self.assertIsNotNone(second)
+        self.assertNotEqual(first.endpoint, second.endpoint)
+        (process, userDataDir) = self.launched[0]
+        self.assertTrue(os.path.isdir(userDataDir))
+        Launcher.closeBrowser(process, userDataDir)
+        self.assertIsNotNone(process.poll())
+        self.assertFalse(os.path.exists(userDataDir))
+
+    def test_profileGiven(self):
+        profile = os.path.join(self.directory, 'profile')
+        options = dict(self.options)
+        options[ARGS] = ['--user-data-dir={}'.format(profile)]
+        self.assertIsNotNone(self.start(options))
+        self.assertIsNone(Launcher.userDataDir)
+        # a second browser on the same profile hands over and gives no endpoint
+        self.assertIsNone(self.start(options))
+        self.assertTrue(os.path.isdir(profile))
+
+
+if __name__ == '__main__':
+    unittest.main()